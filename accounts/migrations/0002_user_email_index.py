@@ -0,0 +1,34 @@
+from django.db import migrations
+
+INDEX_NAME = 'accounts_user_email_ci_idx'
+
+
+def create_email_index(apps, schema_editor):
+    """
+    Case-insensitive index for login's email__iexact lookup. Django compiles
+    iexact to LIKE on SQLite, which can use a NOCASE index, and to UPPER() = UPPER()
+    on PostgreSQL, which needs an expression index.
+    """
+    table = schema_editor.quote_name('auth_user')
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON {table} ("email" COLLATE NOCASE)')
+    elif vendor == 'postgresql':
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON {table} (UPPER("email"))')
+
+
+def drop_email_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute(f'DROP INDEX IF EXISTS {INDEX_NAME}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_email_index, drop_email_index),
+    ]
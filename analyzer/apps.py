@@ -3,4 +3,7 @@ from django.apps import AppConfig
 class AnalyzerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'analyzer'
-    
\ No newline at end of file
+
+    def ready(self):
+        # Connects the search index cleanup to Contract deletes
+        from . import signals  # noqa: F401
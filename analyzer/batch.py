@@ -0,0 +1,82 @@
+# analyzer/batch.py
+"""
+ZIP batch uploads.
+Entries are read one at a time from the archive (Django keeps large uploads
+in a temporary file, and zipfile only reads the central directory plus the
+entry being copied), so a 200-document archive is never held in memory.
+"""
+import logging
+import os
+import zipfile
+from django.conf import settings
+from django.core.files import File
+from .models import Batch, Contract
+from .services import SUPPORTED_EXTENSIONS
+
+logger = logging.getLogger(__name__)
+
+MAX_ENTRY_BYTES = 10 * 1024 * 1024  # same limit as a single upload
+
+
+def _skip_reason(info):
+    name = os.path.basename(info.filename)
+    if info.is_dir():
+        return 'directory'
+    if info.filename.startswith('__MACOSX/') or not name or name.startswith('.'):
+        return 'hidden file'
+    if os.path.splitext(name)[1].lower() not in SUPPORTED_EXTENSIONS:
+        return 'unsupported file type'
+    if info.file_size > MAX_ENTRY_BYTES:
+        return 'file too large'
+    if info.file_size == 0:
+        return 'empty file'
+    return None
+
+
+def create_batch(user, uploaded, analysis_mode='interactive'):
+    """
+    Create a Batch and one Contract per supported ZIP entry, with the entry
+    stored as the contract's source file. Returns (batch, contracts).
+    Raises zipfile.BadZipFile or ValueError for unusable archives.
+    """
+    with zipfile.ZipFile(uploaded) as archive:
+        entries, skipped = [], []
+        for info in archive.infolist():
+            reason = _skip_reason(info)
+            if reason is None:
+                entries.append(info)
+            elif reason not in ('directory', 'hidden file'):
+                skipped.append({'filename': info.filename, 'reason': reason})
+
+        if not entries:
+            raise ValueError('The archive contains no supported documents.')
+        if len(entries) > settings.BATCH_MAX_ENTRIES:
+            raise ValueError(f'Too many documents in one batch (max {settings.BATCH_MAX_ENTRIES}).')
+
+        batch = Batch.objects.create(
+            user=user,
+            filename=uploaded.name,
+            total=len(entries),
+            skipped=skipped,
+        )
+        contracts = []
+        for info in entries:
+            name = os.path.basename(info.filename)
+            contract = Contract(
+                user=user,
+                batch=batch,
+                analysis_mode=analysis_mode,
+                filename=name,
+                summary='',
+                overall_risk_score=0,
+                overall_risk_level='Low',
+                analysis_json={},
+            )
+            with archive.open(info) as entry:
+                # Copies the entry to storage in chunks, decompressing as it goes
+                contract.source_file.save(name, File(entry, name=name), save=False)
+            contract.save()
+            contracts.append(contract)
+
+    logger.info(f"Batch {batch.id}: {len(contracts)} contracts from {uploaded.name}, {len(skipped)} skipped")
+    return batch, contracts
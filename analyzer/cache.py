@@ -0,0 +1,178 @@
+# analyzer/cache.py
+import hashlib
+import logging
+import re
+import threading
+from datetime import timedelta
+import redis
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import Q, Sum
+from django.utils import timezone
+from .models import AnalysisCacheEntry, ExtractionCacheEntry
+from .services import EXTRACTOR_VERSION, PROMPT_VERSION
+
+logger = logging.getLogger(__name__)
+
+# Hit/miss counters live in Redis: counting every lookup in SQLite would put
+# a write on the read path of the shared single-writer database
+STATS_KEY = 'cache:stats:{name}'
+STATS_NAMES = ('extraction', 'analysis')
+
+_redis = None
+_redis_lock = threading.Lock()
+
+
+def file_digest(file) -> str:
+    """SHA-256 of an uploaded file (or raw bytes) without reading it into memory twice."""
+    digest = hashlib.sha256()
+    if isinstance(file, bytes):
+        digest.update(file)
+    else:
+        for chunk in file.chunks():
+            digest.update(chunk)
+        file.seek(0)
+    return digest.hexdigest()
+
+
+def get_cached_extraction(sha256: str):
+    """Return cached text for this digest and extractor version, or None."""
+    entry = (
+        ExtractionCacheEntry.objects
+        .filter(sha256=sha256, extractor_version=EXTRACTOR_VERSION)
+        .only('id', 'text')
+        .first()
+    )
+    if entry is None:
+        _count('extraction', hit=False)
+        return None
+
+    _count('extraction', hit=True)
+    # LRU eviction orders by last_used_at; hits are only counted in Redis
+    ExtractionCacheEntry.objects.filter(id=entry.id).update(last_used_at=timezone.now())
+    logger.info(f"Extraction cache hit for {sha256[:12]}")
+    return entry.text
+
+
+def store_extraction(sha256: str, text: str):
+    """Cache extracted text, then evict least recently used entries over the size limit."""
+    try:
+        ExtractionCacheEntry.objects.create(
+            sha256=sha256,
+            extractor_version=EXTRACTOR_VERSION,
+            text=text,
+            size=len(text.encode('utf-8')),
+        )
+    except IntegrityError:
+        # Another worker stored the same document first
+        return
+
+    _evict_extractions()
+
+
+def _evict_extractions():
+    total = ExtractionCacheEntry.objects.aggregate(total=Sum('size'))['total'] or 0
+    excess = total - settings.EXTRACTION_CACHE_MAX_BYTES
+    if excess <= 0:
+        return
+
+    stale_ids = []
+    for entry_id, size in (
+        ExtractionCacheEntry.objects.order_by('last_used_at').values_list('id', 'size').iterator()
+    ):
+        stale_ids.append(entry_id)
+        excess -= size
+        if excess <= 0:
+            break
+
+    ExtractionCacheEntry.objects.filter(id__in=stale_ids).delete()
+    logger.info(f"Evicted {len(stale_ids)} extraction cache entries")
+
+
+def normalize_contract_text(text: str) -> str:
+    """Collapse whitespace so re-extractions with different line breaks share a key."""
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def analysis_text_hash(text: str) -> str:
+    return hashlib.sha256(normalize_contract_text(text).encode('utf-8')).hexdigest()
+
+
+def get_cached_analysis(text: str, model: str):
+    """Return a cached analysis for this text, model and prompt version, or None."""
+    entry = (
+        AnalysisCacheEntry.objects
+        .filter(
+            text_hash=analysis_text_hash(text),
+            model=model,
+            prompt_version=PROMPT_VERSION,
+            expires_at__gt=timezone.now(),
+        )
+        .only('id', 'analysis')
+        .first()
+    )
+    if entry is None:
+        _count('analysis', hit=False)
+        return None
+
+    _count('analysis', hit=True)
+    logger.info(f"Analysis cache hit for entry {entry.id}")
+    return entry.analysis
+
+
+def store_analysis(text: str, model: str, analysis: dict):
+    """Cache an analysis until ANALYSIS_CACHE_TTL elapses."""
+    AnalysisCacheEntry.objects.update_or_create(
+        text_hash=analysis_text_hash(text),
+        model=model,
+        prompt_version=PROMPT_VERSION,
+        defaults={
+            'analysis': analysis,
+            'expires_at': timezone.now() + timedelta(seconds=settings.ANALYSIS_CACHE_TTL),
+        },
+    )
+
+
+def invalidate_analysis_cache(everything: bool = False) -> int:
+    """
+    Delete cached analyses made with an older prompt version or past their TTL.
+    Pass everything=True to drop the whole cache. Returns the number deleted.
+    """
+    entries = AnalysisCacheEntry.objects.all()
+    if not everything:
+        entries = entries.filter(
+            ~Q(prompt_version=PROMPT_VERSION) | Q(expires_at__lte=timezone.now())
+        )
+    deleted, _ = entries.delete()
+    logger.info(f"Invalidated {deleted} cached analyses")
+    return deleted
+
+
+def _get_redis():
+    global _redis
+    if _redis is None:
+        with _redis_lock:
+            if _redis is None:
+                _redis = redis.Redis.from_url(settings.REDIS_URL, socket_timeout=2)
+    return _redis
+
+
+def cache_stats() -> dict:
+    """Hit/miss counters for every cache, e.g. {'analysis': {'hits': 3, 'misses': 1}}."""
+    stats = {}
+    try:
+        for name in STATS_NAMES:
+            counts = _get_redis().hgetall(STATS_KEY.format(name=name))
+            if counts:
+                stats[name] = {field: int(counts.get(field.encode(), 0)) for field in ('hits', 'misses')}
+    except redis.RedisError as e:
+        logger.warning(f"Cache counters unavailable: {str(e)}")
+    return stats
+
+
+def _count(name: str, hit: bool):
+    try:
+        _get_redis().hincrby(STATS_KEY.format(name=name), 'hits' if hit else 'misses', 1)
+    except redis.RedisError as e:
+        # Counters are diagnostics only; never fail a lookup over them
+        logger.debug(f"Could not count cache {name} lookup: {str(e)}")
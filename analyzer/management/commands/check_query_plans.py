@@ -0,0 +1,10 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Check on SQLite that each hot query's plan uses its index and needs no extra sort step"
+
+    def handle(self, *args, **options):
+        # The plans are asserted in analyzer.tests.QueryPlanTests, against a freshly migrated database
+        call_command('test', 'analyzer.tests.QueryPlanTests', verbosity=options['verbosity'])
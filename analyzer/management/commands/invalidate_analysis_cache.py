@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from analyzer.cache import cache_stats, invalidate_analysis_cache
+
+
+class Command(BaseCommand):
+    help = "Delete cached analyses from older prompt versions or past their TTL"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Drop every cached analysis")
+
+    def handle(self, *args, **options):
+        deleted = invalidate_analysis_cache(everything=options['all'])
+        self.stdout.write(f"Deleted {deleted} cached analyses")
+        for name, counts in sorted(cache_stats().items()):
+            self.stdout.write(f"{name}: {counts['hits']} hits, {counts['misses']} misses")
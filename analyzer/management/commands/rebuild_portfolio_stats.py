@@ -0,0 +1,19 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from analyzer.portfolio import rebuild
+from clauseguard.sqlite import write_transaction
+
+
+class Command(BaseCommand):
+    help = "Recompute portfolio dashboard counters from stored analyses (all users unless --user)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', help="Username to rebuild; repeatable")
+
+    def handle(self, *args, **options):
+        users = None
+        if options['user']:
+            users = list(get_user_model().objects.filter(username__in=options['user']))
+        with write_transaction():
+            counted = rebuild(users)
+        self.stdout.write(f"Rebuilt portfolio counters from {counted} contracts")
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from analyzer.models import Contract
+from analyzer.tasks import save_clauses
+
+
+class Command(BaseCommand):
+    help = "Segment stored contracts into clauses (only those without clauses unless --all)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Re-segment every contract")
+
+    def handle(self, *args, **options):
+        contracts = Contract.objects.exclude(document__raw_text='')
+        if not options['all']:
+            contracts = contracts.filter(clauses__isnull=True)
+        segmented = clauses = 0
+        for contract in contracts.select_related('document').iterator():
+            clauses += save_clauses(contract)
+            segmented += 1
+        self.stdout.write(f"Segmented {segmented} contracts into {clauses} clauses")
@@ -0,0 +1,97 @@
+import os
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from django.core.management.base import BaseCommand
+from clauseguard.sqlite.base import configure_connection
+
+
+class Command(BaseCommand):
+    help = (
+        "Run concurrent readers against writers on a scratch SQLite file, once with "
+        "SQLite's defaults and once with the backend's WAL settings, and compare reader latency"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--seconds', type=float, default=5.0)
+        parser.add_argument('--rows', type=int, default=20, help="Rows written per write transaction")
+        parser.add_argument('--payload-kb', type=int, default=64, help="Size of each written row")
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{'mode':<10} {'reads':>7} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'locked':>7} {'writes':>7}"
+        )
+        for mode, tuned in (('default', False), ('wal', True)):
+            with tempfile.TemporaryDirectory() as tmp:
+                result = self.run_workload(os.path.join(tmp, 'stress.sqlite3'), tuned, options)
+            latencies = sorted(result['latencies']) or [0.0]
+            self.stdout.write(
+                f"{mode:<10} {len(result['latencies']):>7} {statistics.median(latencies):>8.2f} "
+                f"{latencies[int(len(latencies) * 0.99)]:>8.2f} {latencies[-1]:>8.2f} "
+                f"{result['locked']:>7} {result['writes']:>7}"
+            )
+
+    def connect(self, path, tuned):
+        # isolation_level=None: transactions are explicit, as Django's backend runs them
+        conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        if tuned:
+            configure_connection(conn)
+        return conn
+
+    def run_workload(self, path, tuned, options):
+        conn = self.connect(path, tuned)
+        conn.execute('CREATE TABLE contract (id INTEGER PRIMARY KEY, score INTEGER, body TEXT)')
+        conn.executemany('INSERT INTO contract (score, body) VALUES (?, ?)', [(i % 100, 'x' * 1024) for i in range(500)])
+        conn.close()
+
+        payload = 'y' * (options['payload_kb'] * 1024)
+        deadline = time.monotonic() + options['seconds']
+        result = {'latencies': [], 'locked': 0, 'writes': 0}
+        lock = threading.Lock()
+
+        def reader():
+            conn = self.connect(path, tuned)
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    conn.execute('SELECT id, score FROM contract ORDER BY id DESC LIMIT 50').fetchall()
+                except sqlite3.OperationalError:
+                    with lock:
+                        result['locked'] += 1
+                    continue
+                with lock:
+                    result['latencies'].append((time.perf_counter() - started) * 1000)
+            conn.close()
+
+        def writer():
+            conn = self.connect(path, tuned)
+            while time.monotonic() < deadline:
+                try:
+                    conn.execute('BEGIN IMMEDIATE' if tuned else 'BEGIN')
+                    conn.execute('SELECT count(*) FROM contract').fetchone()
+                    conn.executemany(
+                        'INSERT INTO contract (score, body) VALUES (?, ?)',
+                        [(50, payload) for _ in range(options['rows'])],
+                    )
+                    conn.execute('COMMIT')
+                except sqlite3.OperationalError:
+                    if conn.in_transaction:
+                        conn.execute('ROLLBACK')
+                    with lock:
+                        result['locked'] += 1
+                    continue
+                with lock:
+                    result['writes'] += 1
+            conn.close()
+
+        threads = [threading.Thread(target=reader) for _ in range(options['readers'])]
+        threads += [threading.Thread(target=writer) for _ in range(options['writers'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return result
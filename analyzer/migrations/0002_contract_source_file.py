@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-16 20:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contract',
+            name='source_file',
+            field=models.FileField(blank=True, upload_to='uploads/%Y/%m/%d/'),
+        ),
+    ]
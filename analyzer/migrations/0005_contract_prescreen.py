@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-16 20:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0004_analysis_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contract',
+            name='prescreen',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
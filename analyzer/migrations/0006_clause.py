@@ -0,0 +1,32 @@
+# Generated by Django 4.2.16 on 2026-10-16 20:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0005_contract_prescreen'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Clause',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.IntegerField()),
+                ('number', models.CharField(blank=True, max_length=50)),
+                ('heading', models.CharField(blank=True, max_length=255)),
+                ('level', models.IntegerField(default=1)),
+                ('parent_index', models.IntegerField(blank=True, null=True)),
+                ('start_offset', models.IntegerField()),
+                ('end_offset', models.IntegerField()),
+                ('contract', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='clauses', to='analyzer.contract')),
+            ],
+            options={
+                'ordering': ['index'],
+                'unique_together': {('contract', 'index')},
+            },
+        ),
+    ]
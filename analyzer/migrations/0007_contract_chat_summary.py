@@ -0,0 +1,23 @@
+# Generated by Django 4.2.16 on 2026-10-16 20:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0006_clause'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contract',
+            name='chat_summary',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='contract',
+            name='chat_summary_upto',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.16 on 2026-10-16 20:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0008_batch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('batch_id', models.CharField(blank=True, max_length=100, null=True, unique=True)),
+                ('model', models.CharField(max_length=100)),
+                ('status', models.CharField(choices=[('in_progress', 'In progress'), ('processed', 'Processed'), ('failed', 'Failed')], db_index=True, default='in_progress', max_length=20)),
+                ('request_count', models.IntegerField(default=0)),
+                ('contract_requests', models.JSONField(default=dict)),
+                ('succeeded', models.IntegerField(default=0)),
+                ('errored', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='contract',
+            name='analysis_mode',
+            field=models.CharField(choices=[('interactive', 'Interactive'), ('offline', 'Offline (Message Batches)')], default='interactive', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='contract',
+            name='message_batch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='contracts', to='analyzer.messagebatch'),
+        ),
+    ]
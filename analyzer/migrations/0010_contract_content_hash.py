@@ -0,0 +1,23 @@
+# Generated by Django 4.2.16 on 2026-10-16 20:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0009_message_batch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contract',
+            name='analysis_task_id',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='contract',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
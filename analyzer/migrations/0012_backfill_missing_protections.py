@@ -0,0 +1,43 @@
+from django.db import migrations
+
+
+def backfill(apps, schema_editor):
+    """Copy missing protections and favorable clauses out of analysis_json."""
+    Contract = apps.get_model('analyzer', 'Contract')
+    MissingProtection = apps.get_model('analyzer', 'MissingProtection')
+    PositiveClause = apps.get_model('analyzer', 'PositiveClause')
+
+    missing, positive = [], []
+    for contract in Contract.objects.exclude(analysis_json={}).only('id', 'analysis_json').iterator():
+        analysis = contract.analysis_json or {}
+        for p in analysis.get('missing_protections', []):
+            missing.append(MissingProtection(
+                contract_id=contract.id,
+                title=(p.get('title') or '')[:255],
+                importance=p.get('importance') or 'Medium',
+                explanation=p.get('explanation', ''),
+            ))
+        for c in analysis.get('positive_clauses', []):
+            positive.append(PositiveClause(
+                contract_id=contract.id,
+                title=(c.get('title') or '')[:255],
+                explanation=c.get('explanation', ''),
+            ))
+    MissingProtection.objects.bulk_create(missing, batch_size=500)
+    PositiveClause.objects.bulk_create(positive, batch_size=500)
+
+
+def clear(apps, schema_editor):
+    apps.get_model('analyzer', 'MissingProtection').objects.all().delete()
+    apps.get_model('analyzer', 'PositiveClause').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0011_missing_protection_positive_clause'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, clear),
+    ]
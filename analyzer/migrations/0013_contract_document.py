@@ -0,0 +1,58 @@
+# Generated by Django 4.2.16 on 2026-10-16 20:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_to_documents(apps, schema_editor):
+    """Move each contract's raw_text and analysis_json into its document row."""
+    Contract = apps.get_model('analyzer', 'Contract')
+    ContractDocument = apps.get_model('analyzer', 'ContractDocument')
+    documents = []
+    for contract in Contract.objects.only('id', 'raw_text', 'analysis_json').iterator():
+        documents.append(ContractDocument(
+            contract_id=contract.id,
+            raw_text=contract.raw_text,
+            analysis_json=contract.analysis_json,
+        ))
+        if len(documents) >= 500:
+            ContractDocument.objects.bulk_create(documents)
+            documents = []
+    ContractDocument.objects.bulk_create(documents)
+
+
+def copy_from_documents(apps, schema_editor):
+    Contract = apps.get_model('analyzer', 'Contract')
+    ContractDocument = apps.get_model('analyzer', 'ContractDocument')
+    for document in ContractDocument.objects.iterator():
+        Contract.objects.filter(id=document.contract_id).update(
+            raw_text=document.raw_text,
+            analysis_json=document.analysis_json,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0012_backfill_missing_protections'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContractDocument',
+            fields=[
+                ('contract', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='document', serialize=False, to='analyzer.contract')),
+                ('raw_text', models.TextField(blank=True)),
+                ('analysis_json', models.JSONField(default=dict)),
+            ],
+        ),
+        migrations.RunPython(copy_to_documents, copy_from_documents),
+        migrations.RemoveField(
+            model_name='contract',
+            name='analysis_json',
+        ),
+        migrations.RemoveField(
+            model_name='contract',
+            name='raw_text',
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.16 on 2026-10-16 20:55
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill(apps, schema_editor):
+    """Count each contract's existing risks by severity."""
+    Contract = apps.get_model('analyzer', 'Contract')
+    Risk = apps.get_model('analyzer', 'Risk')
+    fields = {'Critical': 'critical_risks', 'High': 'high_risks', 'Medium': 'medium_risks', 'Low': 'low_risks'}
+    counts = {}
+    rows = Risk.objects.order_by().values_list('contract_id', 'severity').annotate(n=Count('id'))
+    for contract_id, severity, n in rows:
+        if severity in fields:
+            counts.setdefault(contract_id, {})[fields[severity]] = n
+    for contract_id, values in counts.items():
+        Contract.objects.filter(id=contract_id).update(**values)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0013_contract_document'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contract',
+            name='critical_risks',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='contract',
+            name='high_risks',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='contract',
+            name='low_risks',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='contract',
+            name='medium_risks',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.16 on 2026-10-16 20:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0014_contract_risk_counts'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='contract',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='contract_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='risk',
+            index=models.Index(fields=['contract', 'severity'], name='risk_contract_severity_idx'),
+        ),
+    ]
@@ -0,0 +1,72 @@
+from django.db import migrations
+
+CREATE_SQL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS analyzer_search USING fts5(
+        owner, title, body, tokenize = 'porter unicode61', prefix = '3'
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS analyzer_search_row (
+        rowid INTEGER PRIMARY KEY,
+        contract_id INTEGER NOT NULL,
+        kind VARCHAR(20) NOT NULL,
+        object_id INTEGER NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS analyzer_search_row_contract_idx ON analyzer_search_row (contract_id, kind)",
+]
+
+
+def create_search_index(apps, schema_editor):
+    """Create the FTS5 tables and index every existing contract, risk and chat message."""
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    Contract = apps.get_model('analyzer', 'Contract')
+    Risk = apps.get_model('analyzer', 'Risk')
+    ChatMessage = apps.get_model('chat', 'ChatMessage')
+
+    for sql in CREATE_SQL:
+        schema_editor.execute(sql)
+    owners = dict(Contract.objects.values_list('id', 'user_id'))
+
+    def rows():
+        contracts = Contract.objects.select_related('document').only(
+            'id', 'user_id', 'filename', 'summary', 'document__raw_text'
+        )
+        for c in contracts.iterator(chunk_size=200):
+            raw_text = c.document.raw_text if hasattr(c, 'document') else ''
+            yield c.user_id, c.id, 'contract', c.id, c.filename, f"{c.summary}\n{raw_text}"
+        for r in Risk.objects.values_list('id', 'contract_id', 'title', 'clause', 'explanation').iterator():
+            yield owners[r[1]], r[1], 'risk', r[0], r[2], f"{r[3]}\n{r[4]}"
+        for m in ChatMessage.objects.values_list('id', 'contract_id', 'user_id', 'content').iterator():
+            yield m[2], m[1], 'chat', m[0], '', m[3]
+
+    with schema_editor.connection.cursor() as cursor:
+        for owner_id, contract_id, kind, object_id, title, body in rows():
+            cursor.execute(
+                "INSERT INTO analyzer_search_row (contract_id, kind, object_id) VALUES (%s, %s, %s)",
+                [contract_id, kind, object_id],
+            )
+            cursor.execute(
+                "INSERT INTO analyzer_search (rowid, owner, title, body) VALUES (%s, %s, %s, %s)",
+                [cursor.lastrowid, f'u{owner_id}', title, body],
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS analyzer_search')
+        schema_editor.execute('DROP TABLE IF EXISTS analyzer_search_row')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0015_hot_path_indexes'),
+        ('chat', '0003_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
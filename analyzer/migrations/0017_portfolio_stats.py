@@ -0,0 +1,35 @@
+# Generated by Django 4.2.16 on 2026-10-16 21:10
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('analyzer', '0016_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contract',
+            name='portfolio_counts',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.CreateModel(
+            name='PortfolioStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(choices=[('level', 'Contract risk level'), ('severity', 'Risk severity'), ('category', 'Risk category'), ('status', 'Risk status'), ('month', 'Month analyzed')], max_length=20)),
+                ('key', models.CharField(max_length=100)),
+                ('count', models.IntegerField(default=0)),
+                ('total', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='portfolio_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'dimension', 'key')},
+            },
+        ),
+    ]
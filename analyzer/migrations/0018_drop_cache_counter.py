@@ -0,0 +1,16 @@
+# Generated by Django 4.2.16 on 2026-10-16 21:21
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0017_portfolio_stats'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='CacheCounter',
+        ),
+    ]
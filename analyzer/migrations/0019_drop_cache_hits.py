@@ -0,0 +1,21 @@
+# Generated by Django 4.2.16 on 2026-10-16 22:31
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0018_drop_cache_counter'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='analysiscacheentry',
+            name='hits',
+        ),
+        migrations.RemoveField(
+            model_name='extractioncacheentry',
+            name='hits',
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+def backfill(apps, schema_editor):
+    """Count every contract analyzed before the counters existed."""
+    from analyzer.portfolio import rebuild
+
+    rebuild(contract_model=apps.get_model('analyzer', 'Contract'), stat_model=apps.get_model('analyzer', 'PortfolioStat'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0019_drop_cache_hits'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,54 @@
+from collections import Counter
 from django.db import models
 from django.contrib.auth.models import User
 
 
+class Batch(models.Model):
+    """A ZIP upload of many contracts analyzed together."""
+    STATUS_CHOICES = [
+        ('processing', 'Processing'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='batches')
+    filename = models.CharField(max_length=255)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='processing')
+    total = models.IntegerField(default=0)
+    skipped = models.JSONField(default=list, blank=True)  # entries that were not analyzed, with reasons
+    report = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.filename} ({self.total} contracts) - {self.user.email}"
+
+
+class MessageBatch(models.Model):
+    """An Anthropic Message Batch carrying the analysis requests of offline contracts."""
+    STATUS_CHOICES = [
+        ('in_progress', 'In progress'),
+        ('processed', 'Processed'),
+        ('failed', 'Failed'),
+    ]
+
+    batch_id = models.CharField(max_length=100, unique=True, null=True, blank=True)
+    model = models.CharField(max_length=100)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='in_progress', db_index=True)
+    request_count = models.IntegerField(default=0)
+    contract_requests = models.JSONField(default=dict)  # contract id -> number of prompts
+    succeeded = models.IntegerField(default=0)
+    errored = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.batch_id or 'unsubmitted'} ({self.request_count} requests, {self.status})"
+
+
 class Contract(models.Model):
     RISK_LEVELS = [
         ('Low', 'Low'),
@@ -9,22 +56,119 @@ class Contract(models.Model):
         ('High', 'High'),
         ('Critical', 'Critical'),
     ]
+    ANALYSIS_MODES = [
+        ('interactive', 'Interactive'),
+        ('offline', 'Offline (Message Batches)'),
+    ]
 
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='contracts')
     filename = models.CharField(max_length=255)
-    raw_text = models.TextField(blank=True)
+    # Normalized-text hash shared with the analysis cache; identical contracts share one analysis
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    source_file = models.FileField(upload_to='uploads/%Y/%m/%d/', blank=True)
     summary = models.TextField(blank=True)
     overall_risk_score = models.IntegerField(default=0)
     overall_risk_level = models.CharField(max_length=20, choices=RISK_LEVELS, default='Low')
-    analysis_json = models.JSONField(default=dict)
+    # Per-severity counts of the contract's Risk rows, kept in step by recount_risks()
+    critical_risks = models.IntegerField(default=0)
+    high_risks = models.IntegerField(default=0)
+    medium_risks = models.IntegerField(default=0)
+    low_risks = models.IntegerField(default=0)
+    # What this contract currently adds to its owner's PortfolioStat rows, so it can be taken back out
+    portfolio_counts = models.JSONField(default=dict, blank=True)
+    # Rule-based pre-screen shown until (and alongside) the full analysis
+    prescreen = models.JSONField(default=dict, blank=True)
+    batch = models.ForeignKey(Batch, on_delete=models.SET_NULL, null=True, blank=True, related_name='contracts')
+    analysis_mode = models.CharField(max_length=20, choices=ANALYSIS_MODES, default='interactive')
+    analysis_task_id = models.CharField(max_length=255, blank=True)  # the id clients poll
+    message_batch = models.ForeignKey(
+        MessageBatch, on_delete=models.SET_NULL, null=True, blank=True, related_name='contracts'
+    )
+    # Rolling summary of chat turns that no longer fit the history window
+    chat_summary = models.TextField(blank=True)
+    chat_summary_upto = models.IntegerField(default=0)  # id of the last ChatMessage folded in
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Columns the dashboard and history lists render; load them with .only(*Contract.LIST_FIELDS)
+    LIST_FIELDS = (
+        'id', 'filename', 'overall_risk_score', 'overall_risk_level', 'created_at',
+        'critical_risks', 'high_risks', 'medium_risks', 'low_risks',
+    )
+    RISK_COUNT_FIELDS = {
+        'Critical': 'critical_risks',
+        'High': 'high_risks',
+        'Medium': 'medium_risks',
+        'Low': 'low_risks',
+    }
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Dashboard and history: a user's contracts, newest first
+            models.Index(fields=['user', '-created_at', '-id'], name='contract_user_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.filename} ({self.user.username})"
 
+    @property
+    def risk_count(self):
+        return self.critical_risks + self.high_risks + self.medium_risks + self.low_risks
+
+    def set_risk_counts(self, severities):
+        """Set the counters from an iterable of risk severities (without saving)."""
+        counts = Counter(severities)
+        for severity, field in self.RISK_COUNT_FIELDS.items():
+            setattr(self, field, counts.get(severity, 0))
+
+    def recount_risks(self):
+        """Recompute the counters from the stored Risk rows and save them."""
+        self.set_risk_counts(self.risks.values_list('severity', flat=True))
+        self.save(update_fields=list(self.RISK_COUNT_FIELDS.values()))
+
+    # raw_text and analysis_json live in ContractDocument so list queries never
+    # touch them. They read and write through to the document, which is loaded
+    # on first access and saved along with the contract.
+    def _get_document(self):
+        try:
+            return self.document
+        except ContractDocument.DoesNotExist:
+            self.document = ContractDocument(contract=self)
+            return self.document
+
+    @property
+    def raw_text(self):
+        return self._get_document().raw_text
+
+    @raw_text.setter
+    def raw_text(self, value):
+        self._get_document().raw_text = value
+
+    @property
+    def analysis_json(self):
+        return self._get_document().analysis_json
+
+    @analysis_json.setter
+    def analysis_json(self, value):
+        self._get_document().analysis_json = value
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            super().save(*args, **kwargs)
+            # An untouched document is left alone; a new contract always gets one
+            if adding or Contract.document.is_cached(self):
+                self._get_document().save()
+            return
+        document_fields = [f for f in update_fields if f in ContractDocument.PAYLOAD_FIELDS]
+        kwargs['update_fields'] = [f for f in update_fields if f not in ContractDocument.PAYLOAD_FIELDS]
+        if kwargs['update_fields']:
+            super().save(*args, **kwargs)
+        if document_fields:
+            document = self._get_document()
+            document.save(update_fields=None if document._state.adding else document_fields)
+
 
 class Risk(models.Model):
     SEVERITY_CHOICES = [
@@ -52,5 +196,136 @@ class Risk(models.Model):
     user_note = models.TextField(blank=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['contract', 'severity'], name='risk_contract_severity_idx'),
+        ]
+
     def __str__(self):
         return f"{self.title} - {self.severity}"
+
+
+class MissingProtection(models.Model):
+    """A protective clause the analysis found missing from the contract."""
+    IMPORTANCE_CHOICES = [
+        ('Low', 'Low'),
+        ('Medium', 'Medium'),
+        ('High', 'High'),
+    ]
+
+    contract = models.ForeignKey(Contract, on_delete=models.CASCADE, related_name='missing_protections')
+    title = models.CharField(max_length=255)
+    importance = models.CharField(max_length=20, choices=IMPORTANCE_CHOICES, default='Medium')
+    explanation = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.title} - {self.importance}"
+
+
+class PositiveClause(models.Model):
+    """A clause the analysis found favorable to the user."""
+    contract = models.ForeignKey(Contract, on_delete=models.CASCADE, related_name='positive_clauses')
+    title = models.CharField(max_length=255)
+    explanation = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return self.title
+
+
+class Clause(models.Model):
+    """A numbered section or clause of a contract, stored as offsets into raw_text."""
+    contract = models.ForeignKey(Contract, on_delete=models.CASCADE, related_name='clauses')
+    index = models.IntegerField()
+    number = models.CharField(max_length=50, blank=True)
+    heading = models.CharField(max_length=255, blank=True)
+    level = models.IntegerField(default=1)
+    parent_index = models.IntegerField(null=True, blank=True)
+    start_offset = models.IntegerField()
+    end_offset = models.IntegerField()
+
+    class Meta:
+        ordering = ['index']
+        unique_together = [('contract', 'index')]
+
+    def text_in(self, raw_text):
+        return raw_text[self.start_offset:self.end_offset]
+
+    def __str__(self):
+        return f"{self.number} {self.heading}".strip() or f"Clause {self.index}"
+
+
+class ContractDocument(models.Model):
+    """A contract's full text and raw analysis payload, stored apart from its summary row."""
+    PAYLOAD_FIELDS = ('raw_text', 'analysis_json')
+
+    contract = models.OneToOneField(Contract, on_delete=models.CASCADE, primary_key=True, related_name='document')
+    raw_text = models.TextField(blank=True)
+    analysis_json = models.JSONField(default=dict)
+
+    def __str__(self):
+        return f"Document for contract {self.contract_id}"
+
+
+class ExtractionCacheEntry(models.Model):
+    """Extracted text keyed by the SHA-256 of the uploaded bytes."""
+    sha256 = models.CharField(max_length=64)
+    extractor_version = models.CharField(max_length=20)
+    text = models.TextField()
+    size = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        unique_together = [('sha256', 'extractor_version')]
+
+    def __str__(self):
+        return f"{self.sha256[:12]} (v{self.extractor_version}, {self.size} bytes)"
+
+
+class AnalysisCacheEntry(models.Model):
+    """A full analysis keyed by normalized text hash, model and prompt version."""
+    text_hash = models.CharField(max_length=64)
+    model = models.CharField(max_length=100)
+    prompt_version = models.CharField(max_length=20)
+    analysis = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = [('text_hash', 'model', 'prompt_version')]
+
+    def __str__(self):
+        return f"{self.text_hash[:12]} ({self.model}, prompt {self.prompt_version})"
+
+
+class PortfolioStat(models.Model):
+    """
+    One counter on a user's portfolio dashboard, e.g. contracts rated High or
+    risks in the Liability category. Maintained incrementally by
+    analyzer.portfolio as analyses are saved, risks reviewed and contracts deleted.
+    """
+    DIMENSIONS = [
+        ('level', 'Contract risk level'),
+        ('severity', 'Risk severity'),
+        ('category', 'Risk category'),
+        ('status', 'Risk status'),
+        ('month', 'Month analyzed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='portfolio_stats')
+    dimension = models.CharField(max_length=20, choices=DIMENSIONS)
+    key = models.CharField(max_length=100)
+    count = models.IntegerField(default=0)
+    total = models.IntegerField(default=0)  # sum of overall risk scores, for per-month averages
+
+    class Meta:
+        unique_together = [('user', 'dimension', 'key')]
+
+    def __str__(self):
+        return f"{self.user_id} {self.dimension}:{self.key} = {self.count}"
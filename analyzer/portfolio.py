@@ -0,0 +1,139 @@
+# analyzer/portfolio.py
+"""
+Portfolio analytics kept as running counters.
+Each analyzed contract contributes a handful of counts to its owner's
+PortfolioStat rows (its risk level, its month, and the category, severity and
+status of each risk). The contribution is remembered on the contract, so when
+the analysis is replaced, a risk is reviewed or the contract is deleted, only
+the difference is written. Reading the dashboard never touches Contract or Risk.
+"""
+from django.db.models import F
+from .models import Contract, PortfolioStat
+
+TOP_CATEGORIES = 8
+TREND_MONTHS = 12
+
+
+def contribution(contract, risks):
+    """{'dimension:key': [count, total]} for an analyzed contract and its final risks."""
+    counts = {
+        f'level:{contract.overall_risk_level}': [1, 0],
+        f'month:{contract.created_at:%Y-%m}': [1, contract.overall_risk_score],
+    }
+    for risk in risks:
+        for dimension, key in (('severity', risk.severity), ('category', risk.category), ('status', risk.status)):
+            entry = counts.setdefault(f'{dimension}:{key or "Other"}', [0, 0])
+            entry[0] += 1
+    return counts
+
+
+def apply(user_id, old, new):
+    """Move a user's counters from contribution old to contribution new. Call inside a write transaction."""
+    deltas = {}
+    for name in set(old) | set(new):
+        count = new.get(name, [0, 0])[0] - old.get(name, [0, 0])[0]
+        total = new.get(name, [0, 0])[1] - old.get(name, [0, 0])[1]
+        if count or total:
+            deltas[name] = (count, total)
+
+    for name, (count, total) in deltas.items():
+        dimension, key = name.split(':', 1)
+        updated = PortfolioStat.objects.filter(user_id=user_id, dimension=dimension, key=key[:100]).update(
+            count=F('count') + count, total=F('total') + total
+        )
+        if not updated:
+            PortfolioStat.objects.create(user_id=user_id, dimension=dimension, key=key[:100], count=count, total=total)
+    if deltas:
+        PortfolioStat.objects.filter(user_id=user_id, count__lte=0).delete()
+
+
+def record_analysis(contract, risks):
+    """Count a freshly persisted analysis, replacing whatever the contract counted before."""
+    new = contribution(contract, risks)
+    apply(contract.user_id, contract.portfolio_counts, new)
+    contract.portfolio_counts = new
+
+
+def forget(contract):
+    """Take a contract out of its owner's counters (deleted, or its analysis failed)."""
+    apply(contract.user_id, contract.portfolio_counts, {})
+    contract.portfolio_counts = {}
+
+
+def change_risk_status(contract, old_status, new_status):
+    """Move one risk between status counters, if its contract is counted."""
+    if not contract.portfolio_counts or old_status == new_status:
+        return
+    new = {name: list(value) for name, value in contract.portfolio_counts.items()}
+    new.setdefault(f'status:{old_status}', [0, 0])[0] -= 1
+    new.setdefault(f'status:{new_status}', [0, 0])[0] += 1
+    new = {name: value for name, value in new.items() if value[0] > 0 or value[1]}
+    apply(contract.user_id, contract.portfolio_counts, new)
+    contract.portfolio_counts = new
+
+
+def dashboard(user):
+    """The user's portfolio figures, read from their PortfolioStat rows only."""
+    stats = {}
+    for stat in PortfolioStat.objects.filter(user=user):
+        stats.setdefault(stat.dimension, {})[stat.key] = stat
+
+    def counts(dimension, keys):
+        found = stats.get(dimension, {})
+        return [(key, found[key].count if key in found else 0) for key in keys]
+
+    levels = [key for key, _ in Contract.RISK_LEVELS]
+    months = sorted(stats.get('month', {}).values(), key=lambda stat: stat.key)[-TREND_MONTHS:]
+    categories = sorted(stats.get('category', {}).values(), key=lambda stat: (-stat.count, stat.key))
+    return {
+        'contracts': sum(stat.count for stat in stats.get('level', {}).values()),
+        'levels': counts('level', levels),
+        'severities': counts('severity', levels),
+        'statuses': counts('status', ['pending', 'reviewed', 'accepted', 'disputed']),
+        'top_categories': [(stat.key, stat.count) for stat in categories[:TOP_CATEGORIES]],
+        'trend': [
+            {'month': stat.key, 'contracts': stat.count, 'average_score': round(stat.total / stat.count)}
+            for stat in months
+        ],
+    }
+
+
+def rebuild(users=None, contract_model=Contract, stat_model=PortfolioStat):
+    """
+    Recompute the counters from the stored analyses, for backfills or after a
+    bug: every user's, or only those in users. Call inside a write transaction.
+    Migrations pass their historical models. Returns the number of contracts counted.
+    """
+    contracts = contract_model.objects.all()
+    stats = stat_model.objects.all()
+    if users is not None:
+        contracts = contracts.filter(user__in=users)
+        stats = stats.filter(user__in=users)
+    stats.delete()
+    contracts.exclude(portfolio_counts={}).update(portfolio_counts={})
+
+    analyzed = (
+        contracts.exclude(document__analysis_json={})
+        .exclude(document__analysis_json__has_key='error')
+        .only('id', 'user_id', 'overall_risk_level', 'overall_risk_score', 'created_at')
+        .prefetch_related('risks')
+    )
+    totals = {}
+    counted = 0
+    for contract in analyzed.iterator(chunk_size=500):
+        counts = contribution(contract, contract.risks.all())
+        contract_model.objects.filter(id=contract.id).update(portfolio_counts=counts)
+        user_totals = totals.setdefault(contract.user_id, {})
+        for name, (count, total) in counts.items():
+            entry = user_totals.setdefault(name, [0, 0])
+            entry[0] += count
+            entry[1] += total
+        counted += 1
+
+    rows = []
+    for user_id, user_totals in totals.items():
+        for name, (count, total) in user_totals.items():
+            dimension, key = name.split(':', 1)
+            rows.append(stat_model(user_id=user_id, dimension=dimension, key=key[:100], count=count, total=total))
+    stat_model.objects.bulk_create(rows, batch_size=500)
+    return counted
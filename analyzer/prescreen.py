@@ -0,0 +1,176 @@
+# analyzer/prescreen.py
+"""
+Rule-based clause pre-screener.
+Flags candidate clauses per ANALYSIS_PROMPT category in a few milliseconds,
+before the LLM has returned anything. The output is provisional: it is shown
+while the full analysis runs and tells later stages which text matters most.
+"""
+import re
+import time
+from .segmentation import segment_contract
+
+PRESCREEN_VERSION = 2
+
+# (category, severity hint, label, pattern)
+RULES = [
+    ('Liability', 'High', 'Unlimited liability',
+     r'\bunlimited liability\b|\b(?:no|without)\s+(?:any\s+)?(?:limit|limitation|cap)\s+(?:on|of|to)\s+(?:its\s+|your\s+)?liability'),
+    ('Liability', 'High', 'Liable for all losses',
+     r'\bliable\s+for\s+(?:any\s+and\s+)?all\b'),
+    ('Liability', 'Medium', 'Consequential damages',
+     r'\b(?:consequential|indirect|special|punitive)\s+damages\b'),
+    ('Liability', 'Low', 'Limitation of liability',
+     r'\blimitation\s+of\s+liability\b'),
+    ('Indemnification', 'High', 'Indemnify and hold harmless',
+     r'\bhold\s+harmless\b|\bdefend,?\s+indemnify\b'),
+    ('Indemnification', 'Medium', 'Indemnity obligation',
+     r'\bindemnif(?:y|ies|ied|ication)\b'),
+    ('Non-compete', 'High', 'Non-compete',
+     r'\bnon-?\s?compet(?:e|ition)\b|\bshall\s+not\s+(?:directly\s+or\s+indirectly\s+)?(?:engage\s+in|compete)\b'),
+    ('Non-compete', 'Medium', 'Non-solicitation',
+     r'\bnon-?\s?solicit(?:ation)?\b|\bshall\s+not\s+(?:directly\s+or\s+indirectly\s+)?solicit\b'),
+    ('Termination', 'High', 'Termination without cause',
+     r'\bterminat\w*\s+(?:this\s+agreement\s+)?(?:at\s+any\s+time|for\s+convenience|without\s+(?:cause|notice|reason))'),
+    ('Termination', 'Medium', 'Automatic renewal',
+     r'\bautomatic(?:ally)?\s+renew\w*\b|\bauto-?renew\w*\b'),
+    ('Termination', 'Low', 'Termination clause',
+     r'\bterminat(?:e|ion)\b'),
+    ('IP', 'High', 'Assignment of IP rights',
+     r'\b(?:assigns?|transfers?)\s+(?:to\s+\w+\s+)?(?:all\s+)?(?:of\s+)?(?:its\s+|your\s+)?(?:right,?\s+title,?\s+(?:and\s+)?interest)\b'),
+    ('IP', 'High', 'Work made for hire',
+     r'\bworks?\s+made\s+for\s+hire\b'),
+    ('IP', 'Medium', 'Perpetual licence',
+     r'\bperpetual,?\s+(?:irrevocable|worldwide|royalty-free)\b'),
+    ('IP', 'Low', 'Intellectual property',
+     r'\bintellectual\s+property\b'),
+    ('Privacy', 'High', 'Sharing data with third parties',
+     r'\b(?:share|disclose|sell)\w*\s+(?:your\s+|any\s+)?(?:personal\s+)?(?:data|information)\s+(?:with|to)\s+(?:any\s+)?third\s+part(?:y|ies)\b'),
+    ('Privacy', 'Medium', 'Personal data',
+     r'\bpersonal\s+(?:data|information)\b|\bGDPR\b|\bCCPA\b'),
+    ('Privacy', 'Low', 'Confidentiality',
+     r'\bconfidential(?:ity)?\b'),
+    ('Payment', 'High', 'Non-refundable payment',
+     r'\bnon-?\s?refundable\b'),
+    ('Payment', 'Medium', 'Late payment charges',
+     r'\blate\s+(?:fee|payment|charge)s?\b|\binterest\s+(?:at|of)\s+(?:the\s+rate\s+of\s+)?\d'),
+    ('Payment', 'Medium', 'Unilateral price change',
+     r'\b(?:increase|adjust|change)\w*\s+(?:the\s+)?(?:price|fees?|rates?)\b'),
+    ('Payment', 'Low', 'Payment terms',
+     r'\bpayable\s+within\s+\d+\b|\binvoice[sd]?\b'),
+]
+
+COMPILED_RULES = [
+    (category, severity, label, re.compile(pattern, re.IGNORECASE))
+    for category, severity, label, pattern in RULES
+]
+
+SEVERITY_RANK = {'Low': 1, 'Medium': 2, 'High': 3}
+
+# Marks the gaps between excerpts picked by select_priority_text
+GAP_MARKER = '\n[...]\n'
+
+# Flags point at the clause around a match; longer clauses are cut into pieces of at
+# most this many characters (extracted PDFs often have no blank lines or headings at all)
+MAX_FLAG_CHARS = 400
+EXCERPT_CHARS = 200
+
+
+def _clause_spans(text):
+    spans = []
+    for clause in segment_contract(text) or [{'start': 0, 'end': len(text)}]:
+        start, end = clause['start'], clause['end']
+        while end - start > MAX_FLAG_CHARS:
+            # Cut at the last line break in the second half of the piece, else mid-line
+            cut = text.rfind('\n', start + MAX_FLAG_CHARS // 2, start + MAX_FLAG_CHARS) + 1
+            cut = cut or start + MAX_FLAG_CHARS
+            spans.append((start, cut))
+            start = cut
+        spans.append((start, end))
+    return spans
+
+
+def _excerpt(text, start, end, match):
+    """Up to EXCERPT_CHARS of the span, starting early enough to show the match."""
+    if match.end() - start > EXCERPT_CHARS:
+        line_start = text.rfind('\n', start, match.start()) + 1
+        start = line_start if match.start() - line_start <= EXCERPT_CHARS // 4 else match.start() - EXCERPT_CHARS // 4
+    return text[start:end].strip()[:EXCERPT_CHARS]
+
+
+def prescreen_contract(text: str) -> dict:
+    """
+    Run every rule over the text and return one flag per category and clause,
+    keeping the most severe rule that matched there.
+    """
+    started = time.perf_counter()
+    spans = _clause_spans(text)
+    span_starts = [start for start, _ in spans]
+
+    flags = {}
+    for category, severity, label, pattern in COMPILED_RULES:
+        for match in pattern.finditer(text):
+            # Binary search for the clause containing the match
+            lo, hi = 0, len(span_starts) - 1
+            while lo < hi:
+                mid = (lo + hi + 1) // 2
+                if span_starts[mid] <= match.start():
+                    lo = mid
+                else:
+                    hi = mid - 1
+            start, end = spans[lo]
+
+            key = (category, start)
+            current = flags.get(key)
+            if current and SEVERITY_RANK[current['severity']] >= SEVERITY_RANK[severity]:
+                continue
+            flags[key] = {
+                'category': category,
+                'severity': severity,
+                'label': label,
+                'excerpt': _excerpt(text, start, end, match),
+                'start': start,
+                'end': end,
+            }
+
+    ordered = sorted(
+        flags.values(),
+        key=lambda f: (-SEVERITY_RANK[f['severity']], f['start']),
+    )
+    counts = {}
+    for flag in ordered:
+        counts[flag['category']] = counts.get(flag['category'], 0) + 1
+
+    return {
+        'version': PRESCREEN_VERSION,
+        'flags': ordered,
+        'counts': counts,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 2),
+    }
+
+
+def select_priority_text(text: str, flags: list, max_chars: int, head_chars: int = 2000) -> str:
+    """
+    Fit the most relevant parts of a long contract into max_chars: the opening
+    (parties and definitions) followed by flagged clauses, most severe first,
+    reassembled in document order.
+    """
+    if len(text) <= max_chars:
+        return text
+
+    head_end = min(head_chars, max_chars)
+    budget = max_chars - head_end
+    chosen = []
+    for flag in flags:
+        start, end = max(flag['start'], head_end), flag['end']
+        cost = end - start + len(GAP_MARKER)
+        if end <= start or cost > budget:
+            continue
+        if any(start < c_end and c_start < end for c_start, c_end in chosen):
+            continue
+        chosen.append((start, end))
+        budget -= cost
+
+    parts = [text[:head_end]]
+    for start, end in sorted(chosen):
+        parts.append(text[start:end])
+    return GAP_MARKER.join(parts)
@@ -0,0 +1,184 @@
+# analyzer/search.py
+"""
+Full-text search over a user's contracts with SQLite FTS5.
+analyzer_search holds one FTS row per searchable object: the contract itself
+(filename, summary and full text), each of its risks, and each chat message.
+Rows are written as those objects are, so the index never needs a rebuild.
+owner is a single-token column, so a MATCH restricts results to one user
+through the index. analyzer_search_row maps each FTS rowid to its contract:
+ranking reads only that small table, and FTS content is read just for the
+snippets on the requested page.
+"""
+import html
+import logging
+import re
+import time
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+TABLE = 'analyzer_search'
+ROWS_TABLE = 'analyzer_search_row'
+
+# bm25 weights in column order (owner, title, body): titles count more
+RANK = f"bm25({TABLE}, 0, 5.0, 1.0)"
+
+SNIPPET_CHARS = 200
+
+TERM_RE = re.compile(r'"([^"]+)"|(\S+)')
+WORD_RE = re.compile(r'\w+')
+
+
+def available():
+    return connection.vendor == 'sqlite'
+
+
+def _write(owner_id, contract_id, rows):
+    with connection.cursor() as cursor:
+        for kind, object_id, title, body in rows:
+            cursor.execute(
+                f"INSERT INTO {ROWS_TABLE} (contract_id, kind, object_id) VALUES (%s, %s, %s)",
+                [contract_id, kind, object_id],
+            )
+            cursor.execute(
+                f"INSERT INTO {TABLE} (rowid, owner, title, body) VALUES (%s, %s, %s, %s)",
+                [cursor.lastrowid, f'u{owner_id}', title, body],
+            )
+
+
+def _delete(contract_id, kinds):
+    placeholders = ', '.join(['%s'] * len(kinds))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {TABLE} WHERE rowid IN "
+            f"(SELECT rowid FROM {ROWS_TABLE} WHERE contract_id = %s AND kind IN ({placeholders}))",
+            [contract_id, *kinds],
+        )
+        cursor.execute(
+            f"DELETE FROM {ROWS_TABLE} WHERE contract_id = %s AND kind IN ({placeholders})",
+            [contract_id, *kinds],
+        )
+
+
+def index_contract(contract, risks):
+    """(Re)index a contract's own text and its risks. Call inside the transaction that writes them."""
+    if not available():
+        return
+    _delete(contract.id, ['contract', 'risk'])
+    rows = [('contract', contract.id, contract.filename, f"{contract.summary}\n{contract.raw_text}")]
+    rows += [
+        ('risk', risk.id, risk.title, f"{risk.clause}\n{risk.explanation}")
+        for risk in risks
+    ]
+    _write(contract.user_id, contract.id, rows)
+
+
+def index_chat_message(message):
+    if not available():
+        return
+    _write(message.user_id, message.contract_id, [('chat', message.id, '', message.content)])
+
+
+def remove_contract(contract_id):
+    if not available():
+        return
+    _delete(contract_id, ['contract', 'risk', 'chat'])
+
+
+def match_expression(query):
+    """
+    Turn free text into a safe FTS5 expression: every word or "quoted phrase"
+    must appear, and the last word also matches as a prefix. Returns None if
+    the query has nothing searchable.
+    """
+    terms = []
+    for phrase, word in TERM_RE.findall(query):
+        words = WORD_RE.findall(phrase or word)
+        if words:
+            terms.append((' '.join(words), bool(phrase)))
+    if not terms:
+        return None
+    parts = [f'"{text}"' for text, _ in terms]
+    text, quoted = terms[-1]
+    if not quoted and ' ' not in text and len(text) >= 3:
+        parts[-1] += '*'
+    return '{title body} : (' + ' AND '.join(parts) + ')'
+
+
+def search(user, query, offset=0, limit=20):
+    """
+    Return [(contract_id, kind, snippet_html)] for the user's best-matching
+    contracts, best first. A contract matching in several places appears once,
+    ranked by its best row.
+    """
+    if not available():
+        return []
+    expression = match_expression(query)
+    if expression is None:
+        return []
+
+    started = time.perf_counter()
+    match = f'owner:u{user.id} AND {expression}'
+    with connection.cursor() as cursor:
+        # Rank contracts by their best row, then build snippets for just that page.
+        # bm25() cannot run inside an aggregate, hence the materialized CTE.
+        cursor.execute(
+            f"""
+            WITH scored AS MATERIALIZED (
+                SELECT rowid AS row_id, {RANK} AS score FROM {TABLE} WHERE {TABLE} MATCH %s
+            )
+            SELECT r.contract_id, r.kind, s.row_id, min(s.score) AS best
+            FROM scored s JOIN {ROWS_TABLE} r ON r.rowid = s.row_id
+            GROUP BY r.contract_id
+            ORDER BY best, r.contract_id DESC
+            LIMIT %s OFFSET %s
+            """,
+            [match, limit, offset],
+        )
+        hits = cursor.fetchall()
+        # FTS5's snippet() would re-evaluate the MATCH, which for common terms
+        # costs more than the ranking; excerpting the stored text by rowid is cheap
+        texts = {}
+        if hits:
+            cursor.execute(
+                f"SELECT rowid, title, body FROM {TABLE} WHERE rowid IN ({', '.join(['%s'] * len(hits))})",
+                [row_id for _, _, row_id, _ in hits],
+            )
+            texts = {row_id: (title, body) for row_id, title, body in cursor.fetchall()}
+    logger.debug(
+        f"Search for {query!r} by user {user.id}: {len(hits)} results "
+        f"in {(time.perf_counter() - started) * 1000:.1f}ms"
+    )
+    pattern = _highlight_pattern(query)
+    return [
+        (contract_id, kind, _snippet_html(*texts.get(row_id, ('', '')), pattern))
+        for contract_id, kind, row_id, best in hits
+    ]
+
+
+def _highlight_pattern(query):
+    # Match each query word by its leading characters, a rough stand-in for
+    # the porter stemming the index applied
+    stems = {word[:max(4, len(word) - 3)] for word in WORD_RE.findall(query.lower())}
+    return re.compile(r'\b(?:' + '|'.join(re.escape(stem) for stem in stems) + r')\w*', re.IGNORECASE)
+
+
+def _snippet_html(title, body, pattern):
+    """An escaped excerpt around the first match in the body (or the title), with matches in <mark>."""
+    text = body if pattern.search(body) or not pattern.search(title) else title
+    match = pattern.search(text)
+    start = 0
+    if match and match.start() > SNIPPET_CHARS // 3:
+        start = text.find(' ', match.start() - SNIPPET_CHARS // 3) + 1
+    end = start + SNIPPET_CHARS
+    if end < len(text):
+        end = text.rfind(' ', start, end) if ' ' in text[start:end] else end
+    excerpt = text[start:end]
+
+    parts, last = [], 0
+    for m in pattern.finditer(excerpt):
+        parts.append(html.escape(excerpt[last:m.start()]))
+        parts.append(f'<mark>{html.escape(m.group())}</mark>')
+        last = m.end()
+    parts.append(html.escape(excerpt[last:]))
+    return ('…' if start else '') + ''.join(parts).strip() + ('…' if end < len(text) else '')
@@ -0,0 +1,114 @@
+# analyzer/segmentation.py
+"""
+Clause segmenter.
+Splits contract text into numbered sections and clauses with character
+offsets and a heading hierarchy, so later stages (chunked analysis, chat
+retrieval, search) work on clause boundaries instead of raw slices.
+"""
+import re
+
+# One heading per line start: "ARTICLE IV", "Section 12.1", "Clause 3", "§ 3", "7.", "7.2", "7)", "(a)"
+HEADING_RE = re.compile(
+    r'^[ \t]*(?:'
+    r'(?P<article>(?:ARTICLE|Article)\s+(?P<article_no>[IVXLC]+|\d+))'
+    r'|(?P<section>(?:SECTION|Section|CLAUSE|Clause|§)\s*(?P<section_no>\d+(?:\.\d+)*))'
+    r'|(?P<numbered>(?P<numbered_no>\d+\.(?:\d+\.?)*|\d+\)))'
+    r'|(?P<lettered>\((?P<lettered_no>[a-z]{1,2}|[ivx]{1,4}|\d{1,2})\))'
+    r')[.:]?(?=\s)',
+    re.MULTILINE,
+)
+
+PARAGRAPH_BREAK_RE = re.compile(r'\n\s*\n')
+
+MAX_HEADING_CHARS = 255
+
+
+def _heading_text(text, end):
+    """
+    Title following a heading number, e.g. "Limitation of Liability" from
+    "9. Limitation of Liability. The ...", or the next line for "ARTICLE IV\nTERM".
+    """
+    rest = text[end:end + 2 * MAX_HEADING_CHARS].lstrip(' \t:.')
+    if rest.startswith('\n'):
+        rest = rest.strip()
+    line = rest.split('\n', 1)[0].strip()
+    title = re.split(r'(?<=[a-z0-9\)])\.\s', line, maxsplit=1)[0]
+    return title[:MAX_HEADING_CHARS]
+
+
+def _level(match, has_articles, last_numbered_level):
+    if match.group('article'):
+        return 1
+    number = match.group('section_no') or match.group('numbered_no')
+    if number:
+        # "7." is level 1 and "7.2" level 2; under an ARTICLE everything numbered is at least 2
+        level = len([part for part in re.split(r'[.)]', number) if part])
+        return max(level, 2) if has_articles else level
+    # (a), (i) sit one level below the nearest numbered clause
+    return last_numbered_level + 1
+
+
+def segment_contract(text: str) -> list:
+    """
+    Return clauses in document order as dicts with index, number, heading,
+    level, parent_index, start and end. Text before the first heading becomes
+    a "Preamble" clause. Documents without headings fall back to paragraphs.
+    """
+    matches = list(HEADING_RE.finditer(text))
+    has_articles = any(m.group('article') for m in matches)
+
+    clauses = []
+    if matches and matches[0].start() > 0 and text[:matches[0].start()].strip():
+        clauses.append({'number': '', 'heading': 'Preamble', 'level': 1, 'start': 0})
+
+    last_numbered_level = 1 if has_articles else 0
+    for match in matches:
+        level = _level(match, has_articles, last_numbered_level)
+        if not match.group('lettered'):
+            last_numbered_level = level
+        number = next(
+            match.group(name) for name in ('article_no', 'section_no', 'numbered_no', 'lettered_no')
+            if match.group(name)
+        )
+        clauses.append({
+            'number': number.rstrip('.)') if not match.group('lettered') else f'({number})',
+            'heading': _heading_text(text, match.end()),
+            'level': level,
+            'start': match.start(),
+        })
+
+    if not matches:
+        clauses = _paragraph_clauses(text)
+
+    # Each clause runs until the next one starts
+    for i, clause in enumerate(clauses):
+        clause['index'] = i
+        clause['end'] = clauses[i + 1]['start'] if i + 1 < len(clauses) else len(text)
+
+    # Parent is the nearest earlier clause at a shallower level
+    stack = []
+    for clause in clauses:
+        while stack and stack[-1]['level'] >= clause['level']:
+            stack.pop()
+        clause['parent_index'] = stack[-1]['index'] if stack else None
+        stack.append(clause)
+
+    return clauses
+
+
+def _paragraph_clauses(text):
+    clauses = []
+    start = 0
+    for match in list(PARAGRAPH_BREAK_RE.finditer(text)) + [None]:
+        end = match.start() if match else len(text)
+        paragraph = text[start:end]
+        if paragraph.strip():
+            clauses.append({
+                'number': str(len(clauses) + 1),
+                'heading': paragraph.strip().split('\n', 1)[0][:MAX_HEADING_CHARS],
+                'level': 1,
+                'start': start,
+            })
+        if match:
+            start = match.end()
+    return clauses
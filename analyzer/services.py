@@ -1,11 +1,20 @@
 import os
-import anthropic
 import json
 import re
+import hashlib
 import io
 import logging
+import math
+import multiprocessing
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from django.conf import settings
 import docx
+from clauseguard import llm
+from .prescreen import prescreen_contract, select_priority_text
+from .segmentation import segment_contract
+from .streaming import RiskStreamParser
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -25,6 +34,17 @@ except ImportError:
     PYPDF2_AVAILABLE = False
     logger.warning("PyPDF2 not available")
 
+# Bump whenever extraction output changes so cached text is not reused
+EXTRACTOR_VERSION = '2'
+
+# Extensions accepted for upload; extraction itself runs later in a Celery task
+SUPPORTED_EXTENSIONS = ('.pdf', '.docx', '.txt', '.doc', '.rtf')
+
+# Explanations for formats users commonly try that are not supported
+UNSUPPORTED_FORMAT_MESSAGES = {
+    '.odt': "ODT files are not supported yet. Please save as .docx or .txt",
+}
+
 SYSTEM_PROMPT = """You are an expert contract lawyer and risk analyst.
 Analyze contracts and identify risks for the signing party.
 Always respond with valid JSON only. No markdown, no explanation outside the JSON."""
@@ -75,63 +95,203 @@ ANALYSIS_PROMPT = """Analyze the following contract and return a JSON object wit
 Contract text:
 """
 
-def extract_text_from_pdf(file_bytes: bytes) -> str:
-    """Extract text from a PDF with multiple fallback methods."""
-    text = ""
+# Prepended to ANALYSIS_PROMPT when a long contract is analyzed in parts
+CHUNK_PROMPT = """The contract text below is part {index} of {total} of a single contract.
+Analyze only this part. Report a missing protection only if a contract of this type
+would normally cover it and it is clearly absent from this part.
+
+"""
+
+# Changes whenever a prompt is edited, which invalidates cached analyses
+PROMPT_VERSION = hashlib.sha256(
+    (SYSTEM_PROMPT + ANALYSIS_PROMPT + CHUNK_PROMPT).encode('utf-8')
+).hexdigest()[:12]
+
+
+def get_analysis_model() -> str:
+    """Anthropic model used for contract analysis."""
+    return os.getenv("ANTHROPIC_MODEL") or "claude-3-haiku-20240307"
+
+
+class PageTimeout(Exception):
+    """Raised when a single PDF page exceeds its extraction time budget."""
+
+
+# Set in pool workers by _init_pdf_worker so the document is inherited, not pickled per shard
+_WORKER_PDF_BYTES = None
+
+
+def _init_pdf_worker(file_bytes):
+    global _WORKER_PDF_BYTES
+    _WORKER_PDF_BYTES = file_bytes
+
+
+def _page_alarm(signum, frame):
+    raise PageTimeout()
+
+
+def _run_with_budget(func, budget):
+    """Run func() and raise PageTimeout if it takes longer than budget seconds."""
+    if (not budget or not hasattr(signal, 'setitimer')
+            or threading.current_thread() is not threading.main_thread()):
+        return func()
+
+    previous = signal.signal(signal.SIGALRM, _page_alarm)
+    signal.setitimer(signal.ITIMER_REAL, budget)
+    try:
+        return func()
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def _open_pypdf2_reader(file_bytes):
+    from PyPDF2 import PdfReader
+    pdf_reader = PdfReader(io.BytesIO(file_bytes))
+
+    # Check if encrypted
+    if pdf_reader.is_encrypted:
+        try:
+            pdf_reader.decrypt('')
+        except:
+            raise Exception("PDF is password protected")
+    return pdf_reader
+
+
+def _count_pdf_pages(file_bytes: bytes) -> int:
+    """Return the page count, trying PyPDF2 first since it does not parse page content."""
     errors = []
-    
-    # Method 1: Try pdfplumber first (better formatting)
+    if PYPDF2_AVAILABLE:
+        try:
+            return len(_open_pypdf2_reader(file_bytes).pages)
+        except Exception as e:
+            errors.append(f"PyPDF2 failed: {str(e)}")
     if PDFPLUMBER_AVAILABLE:
         try:
             with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
-                pages_text = []
-                for page in pdf.pages:
-                    page_text = page.extract_text() or ""
-                    if page_text.strip():
-                        pages_text.append(page_text)
-                text = "\n".join(pages_text)
-                if text.strip():
-                    logger.info(f"Successfully extracted {len(text)} chars with pdfplumber")
-                    return text.strip()
+                return len(pdf.pages)
         except Exception as e:
-            error_msg = f"pdfplumber failed: {str(e)}"
-            errors.append(error_msg)
-            logger.warning(error_msg)
-    
-    # Method 2: Try PyPDF2 as fallback
-    if PYPDF2_AVAILABLE:
+            errors.append(f"pdfplumber failed: {str(e)}")
+    error_details = "; ".join(errors) or "no PDF library installed"
+    raise Exception(f"Could not open PDF. Tried PyPDF2 and pdfplumber. Errors: {error_details}")
+
+
+def _extract_pdf_pages(page_numbers, page_timeout, file_bytes=None):
+    """
+    Extract text for the given pages of one document.
+    Each page is tried with pdfplumber first and falls back to PyPDF2 on its own,
+    so one bad page never forces a second pass over the whole document.
+    Returns a list of (page_number, text) tuples.
+    """
+    if file_bytes is None:
+        file_bytes = _WORKER_PDF_BYTES
+
+    plumber_doc = None
+    plumber_pages = None
+    pdf_reader = None
+    results = []
+
+    if PDFPLUMBER_AVAILABLE:
         try:
-            from PyPDF2 import PdfReader
-            pdf_reader = PdfReader(io.BytesIO(file_bytes))
-            
-            # Check if encrypted
-            if pdf_reader.is_encrypted:
-                try:
-                    pdf_reader.decrypt('')
-                except:
-                    raise Exception("PDF is password protected")
-            
-            pages_text = []
-            for page_num in range(len(pdf_reader.pages)):
-                page = pdf_reader.pages[page_num]
-                page_text = page.extract_text() or ""
-                if page_text.strip():
-                    pages_text.append(page_text)
-            
-            text = "\n".join(pages_text)
-            if text.strip():
-                logger.info(f"Successfully extracted {len(text)} chars with PyPDF2")
-                return text.strip()
+            plumber_doc = pdfplumber.open(io.BytesIO(file_bytes))
+            plumber_pages = plumber_doc.pages
         except Exception as e:
-            error_msg = f"PyPDF2 failed: {str(e)}"
-            errors.append(error_msg)
-            logger.warning(error_msg)
-    
-    # If we get here, both methods failed
+            logger.warning(f"pdfplumber could not open document: {str(e)}")
+
+    try:
+        for page_num in page_numbers:
+            page_text = ""
+
+            # Method 1: pdfplumber (better formatting)
+            if plumber_pages is not None:
+                try:
+                    page = plumber_pages[page_num]
+                    page_text = _run_with_budget(lambda: page.extract_text() or "", page_timeout)
+                    page.close()
+                except PageTimeout:
+                    logger.warning(f"pdfplumber exceeded {page_timeout}s on page {page_num + 1}")
+                except Exception as e:
+                    logger.warning(f"pdfplumber failed on page {page_num + 1}: {str(e)}")
+
+            # Method 2: PyPDF2 fallback for this page only
+            if not page_text.strip() and PYPDF2_AVAILABLE and pdf_reader is not False:
+                try:
+                    if pdf_reader is None:
+                        pdf_reader = _open_pypdf2_reader(file_bytes)
+                    page_text = _run_with_budget(
+                        lambda: pdf_reader.pages[page_num].extract_text() or "", page_timeout
+                    )
+                except PageTimeout:
+                    logger.warning(f"PyPDF2 exceeded {page_timeout}s on page {page_num + 1}")
+                except Exception as e:
+                    logger.warning(f"PyPDF2 failed on page {page_num + 1}: {str(e)}")
+                    if pdf_reader is None:
+                        pdf_reader = False
+
+            results.append((page_num, page_text))
+    finally:
+        if plumber_doc is not None:
+            plumber_doc.close()
+
+    return results
+
+
+def _extract_pdf_pages_parallel(file_bytes, page_count, workers, page_timeout):
+    """Shard the document across a process pool and collect (page_number, text) tuples."""
+    shard_size = max(1, math.ceil(page_count / (workers * 2)))
+    shards = [
+        list(range(start, min(start + shard_size, page_count)))
+        for start in range(0, page_count, shard_size)
+    ]
+
+    results = []
+    with multiprocessing.Pool(
+        processes=min(workers, len(shards)),
+        initializer=_init_pdf_worker,
+        initargs=(file_bytes,),
+    ) as pool:
+        pending = [
+            (shard, pool.apply_async(_extract_pdf_pages, (shard, page_timeout)))
+            for shard in shards
+        ]
+        for shard, async_result in pending:
+            # Backstop in case a page ignores the in-worker alarm; leaving the
+            # "with" block terminates any worker that is still stuck.
+            try:
+                results.extend(async_result.get(timeout=page_timeout * len(shard) * 2 + 5))
+            except multiprocessing.TimeoutError:
+                logger.warning(f"PDF shard {shard[0] + 1}-{shard[-1] + 1} timed out, skipping")
+                results.extend((page_num, "") for page_num in shard)
+    return results
+
+
+def extract_text_from_pdf(file_bytes: bytes) -> str:
+    """Extract text from a PDF page by page, in parallel for large documents."""
+    page_count = _count_pdf_pages(file_bytes)
+    workers = settings.PDF_EXTRACTION_WORKERS
+    page_timeout = settings.PDF_PAGE_TIMEOUT
+
+    pages = None
+    if workers > 1 and page_count >= settings.PDF_PARALLEL_MIN_PAGES:
+        # A prefork worker child is daemonic and may not fork its own pool;
+        # the extraction queue is served by a solo worker for this reason
+        if multiprocessing.current_process().daemon:
+            logger.warning("PDF extraction is running in a daemonic process, extracting pages serially")
+        else:
+            try:
+                pages = _extract_pdf_pages_parallel(file_bytes, page_count, workers, page_timeout)
+            except OSError as e:
+                logger.warning(f"Parallel PDF extraction unavailable, falling back to serial: {str(e)}")
+
+    if pages is None:
+        pages = _extract_pdf_pages(list(range(page_count)), page_timeout, file_bytes=file_bytes)
+
+    pages.sort(key=lambda item: item[0])
+    text = "\n".join(page_text for _, page_text in pages if page_text.strip())
     if not text.strip():
-        error_details = "; ".join(errors)
-        raise Exception(f"Could not extract text from PDF. Tried pdfplumber and PyPDF2. Errors: {error_details}")
-    
+        raise Exception("Could not extract text from PDF. Tried pdfplumber and PyPDF2 on every page.")
+
+    logger.info(f"Successfully extracted {len(text)} chars from {page_count} pages")
     return text.strip()
 
 def extract_text_from_docx(file_bytes: bytes) -> str:
@@ -219,78 +379,289 @@ def extract_text_from_file(file, filename: str) -> str:
                 return text.strip()
             except:
                 raise Exception("RTF extraction failed. Please save as .txt or .docx")
-        elif ext == ".odt":
-            raise Exception("ODT files are not supported yet. Please save as .docx or .txt")
+        elif ext in UNSUPPORTED_FORMAT_MESSAGES:
+            raise Exception(UNSUPPORTED_FORMAT_MESSAGES[ext])
         else:
             raise ValueError(f"Unsupported file type: {ext}")
     except Exception as e:
         logger.error(f"Extraction error for {filename}: {str(e)}")
         raise
 
-def analyze_contract(contract_text: str) -> dict:
-    """Analyze contract text using Anthropic API."""
+ANALYSIS_MAX_TOKENS = 4000
+
+SEVERITY_ORDER = {'Low': 1, 'Medium': 2, 'High': 3, 'Critical': 4}
+
+def split_contract_into_chunks(contract_text: str, max_chars: int, clause_starts=None) -> list:
+    """
+    Split a contract into chunks of at most max_chars, cutting only at clause
+    boundaries where possible. clause_starts are the stored Clause offsets;
+    without them the text is segmented on the spot.
+    """
+    if clause_starts is None:
+        clause_starts = [clause['start'] for clause in segment_contract(contract_text)]
+    boundaries = sorted(
+        {0, len(contract_text)}
+        | {start for start in clause_starts if 0 < start < len(contract_text)}
+    )
+    segments = [
+        contract_text[start:end]
+        for start, end in zip(boundaries, boundaries[1:])
+        if contract_text[start:end].strip()
+    ]
+
+    chunks = []
+    current = ""
+    for segment in segments:
+        # A single clause longer than a chunk is cut at line breaks, then hard-cut
+        while len(segment) > max_chars:
+            cut = segment.rfind('\n', 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(segment[:cut])
+            segment = segment[cut:]
+
+        if len(current) + len(segment) > max_chars and current:
+            chunks.append(current)
+            current = ""
+        current += segment
+
+    if current.strip():
+        chunks.append(current)
+    return [chunk.strip() for chunk in chunks if chunk.strip()]
+
+
+def _parse_analysis_response(raw: str) -> dict:
+    """Parse the model's JSON reply, tolerating markdown fences."""
+    raw = raw.strip()
+    logger.debug(f"Raw API response: {raw[:500]}...")
+
+    # Clean up JSON formatting
+    raw = re.sub(r'^```json\s*', '', raw)
+    raw = re.sub(r'\s*```$', '', raw)
+    raw = raw.strip()
+
+    try:
+        return json.loads(raw)
+    except json.JSONDecodeError as e:
+        logger.error(f"Failed to parse AI response as JSON: {str(e)}")
+        logger.error(f"Raw response: {raw}")
+        raise Exception("AI returned invalid JSON. Please try again.")
+
+
+def _quick_stats(risks: list) -> dict:
+    return {
+        'total_risks': len(risks),
+        'critical_risks': sum(1 for r in risks if r.get('severity') == 'Critical'),
+        'high_risks': sum(1 for r in risks if r.get('severity') == 'High'),
+        'medium_risks': sum(1 for r in risks if r.get('severity') == 'Medium'),
+        'low_risks': sum(1 for r in risks if r.get('severity') == 'Low'),
+    }
+
+
+def _complete_analysis(result: dict) -> dict:
+    """Fill in required fields the model left out."""
+    # Validate required fields
+    required_fields = ['overall_risk_score', 'overall_risk_level', 'summary', 'risks']
+    for field in required_fields:
+        if field not in result:
+            logger.warning(f"Missing required field in response: {field}")
+            result[field] = [] if field == 'risks' else ('Unknown' if field == 'overall_risk_level' else 0)
+
+    # Ensure quick_stats is present
+    if 'quick_stats' not in result:
+        result['quick_stats'] = _quick_stats(result.get('risks', []))
+
+    return result
+
+
+def analysis_request(model: str, prompt: str) -> dict:
+    """messages.create parameters for one analysis prompt."""
+    return {
+        'model': model,
+        'max_tokens': ANALYSIS_MAX_TOKENS,
+        'temperature': 0.1,  # Add temperature for more consistent results
+        'system': SYSTEM_PROMPT,
+        'messages': [{'role': 'user', 'content': prompt}],
+    }
+
+
+def analysis_prompts(contract_text: str, clause_starts=None) -> list:
+    """
+    User prompts for one contract: one per chunk for long contracts, otherwise
+    a single prompt. With chunking disabled, an over-long contract is reduced
+    to its flagged clauses rather than whatever happens to come first.
+    """
+    if settings.ANALYSIS_CHUNKED and len(contract_text) > settings.ANALYSIS_CHUNK_CHARS:
+        chunks = split_contract_into_chunks(contract_text, settings.ANALYSIS_CHUNK_CHARS, clause_starts)
+        return [
+            CHUNK_PROMPT.format(index=index, total=len(chunks)) + ANALYSIS_PROMPT + chunk
+            for index, chunk in enumerate(chunks, start=1)
+        ]
+
+    if len(contract_text) > settings.ANALYSIS_CHUNK_CHARS:
+        contract_text = select_priority_text(
+            contract_text,
+            prescreen_contract(contract_text)['flags'],
+            settings.ANALYSIS_CHUNK_CHARS,
+        )
+    return [ANALYSIS_PROMPT + contract_text]
+
+
+def analysis_from_replies(replies: list) -> dict:
+    """Build the final analysis from the reply text for each prompt, in prompt order."""
+    analyses = [_complete_analysis(_parse_analysis_response(reply)) for reply in replies]
+    return analyses[0] if len(analyses) == 1 else merge_chunk_analyses(analyses)
+
+
+def _request_analysis(model: str, prompt: str) -> dict:
+    message = llm.create_message('analyzer.analyze_contract', **analysis_request(model, prompt))
+    return _complete_analysis(_parse_analysis_response(message.content[0].text))
+
+
+def _stream_analysis(model: str, prompt: str, on_risks, on_progress) -> dict:
+    """
+    Stream the analysis, handing each completed risk to on_risks as soon as
+    its JSON object closes and reporting the share of max_tokens received.
+    """
+    parser = RiskStreamParser()
+    parts = []
+    received_chars = 0
+
+    stream = llm.stream_message('analyzer.analyze_contract', **analysis_request(model, prompt))
+    for text in stream:
+        parts.append(text)
+        received_chars += len(text)
+
+        risks = parser.feed(text)
+        if risks:
+            on_risks(risks)
+
+        # Roughly four characters per token
+        on_progress(min(0.99, received_chars / 4 / ANALYSIS_MAX_TOKENS))
+
+    return _complete_analysis(_parse_analysis_response(''.join(parts)))
+
+
+def _dedupe_key(item: dict) -> str:
+    return re.sub(r'[^a-z0-9]+', ' ', (item.get('title') or '').lower()).strip()
+
+
+def merge_chunk_analyses(analyses: list) -> dict:
+    """
+    Reduce per-chunk analyses into one result in the ANALYSIS_PROMPT schema.
+    Duplicate risks keep their most severe version; a protection reported
+    missing by one chunk is dropped if another chunk found it as a favorable clause.
+    """
+    risks = {}
+    positives = {}
+    missing = {}
+
+    for analysis in analyses:
+        for risk in analysis.get('risks', []):
+            key = (risk.get('category', 'Other'), _dedupe_key(risk))
+            current = risks.get(key)
+            if current is None or (
+                SEVERITY_ORDER.get(risk.get('severity'), 0) > SEVERITY_ORDER.get(current.get('severity'), 0)
+            ):
+                risks[key] = risk
+        for clause in analysis.get('positive_clauses', []):
+            positives.setdefault(_dedupe_key(clause), clause)
+        for protection in analysis.get('missing_protections', []):
+            key = _dedupe_key(protection)
+            current = missing.get(key)
+            if current is None or (
+                SEVERITY_ORDER.get(protection.get('importance'), 0) > SEVERITY_ORDER.get(current.get('importance'), 0)
+            ):
+                missing[key] = protection
+
+    merged_risks = sorted(
+        risks.values(),
+        key=lambda r: SEVERITY_ORDER.get(r.get('severity'), 0),
+        reverse=True,
+    )
+    for index, risk in enumerate(merged_risks, start=1):
+        risk['id'] = f'risk_{index}'
+
+    # The opening chunk names the parties and document type
+    first = analyses[0]
+    party_info = next((a['party_info'] for a in analyses if a.get('party_info')), {})
+    overall_level = max(
+        (a.get('overall_risk_level') for a in analyses),
+        key=lambda level: SEVERITY_ORDER.get(level, 0),
+    )
+
+    return {
+        'overall_risk_score': max(a.get('overall_risk_score') or 0 for a in analyses),
+        'overall_risk_level': overall_level,
+        'summary': first.get('summary', ''),
+        'party_info': party_info,
+        'risks': merged_risks,
+        'missing_protections': [p for key, p in missing.items() if key not in positives],
+        'positive_clauses': list(positives.values()),
+        'quick_stats': _quick_stats(merged_risks),
+    }
+
+
+def _analyze_in_chunks(model: str, prompts: list, on_risks=None, on_progress=None) -> dict:
+    """
+    Map each chunk prompt to its own analysis call concurrently, then merge the results.
+    As each chunk finishes, on_risks receives its risks not already reported by an earlier chunk.
+    """
+    logger.info(f"Analyzing contract in {len(prompts)} chunks")
+    reported = set()
+
+    with ThreadPoolExecutor(max_workers=min(settings.ANALYSIS_MAX_CONCURRENCY, len(prompts))) as pool:
+        futures = [pool.submit(_request_analysis, model, prompt) for prompt in prompts]
+        for done, future in enumerate(as_completed(futures), start=1):
+            analysis = future.result()
+            if on_risks:
+                risks = []
+                for risk in analysis.get('risks', []):
+                    key = (risk.get('category', 'Other'), _dedupe_key(risk))
+                    if key not in reported:
+                        reported.add(key)
+                        risks.append(risk)
+                if risks:
+                    on_risks(risks)
+            if on_progress:
+                on_progress(done / len(futures))
+        analyses = [future.result() for future in futures]
+
+    return merge_chunk_analyses(analyses)
+
+
+def analyze_contract(contract_text: str, on_risks=None, on_progress=None, clause_starts=None) -> dict:
+    """
+    Analyze contract text using Anthropic API.
+    When on_risks is given, single-call analysis is streamed and on_risks receives
+    each batch of risks as soon as they are complete; chunked analysis hands it
+    each chunk's new risks as that chunk finishes. on_progress receives the
+    fraction of the work done so far. clause_starts are the contract's stored
+    clause offsets, used to chunk long contracts.
+    """
     if not contract_text or len(contract_text.strip()) < 100:
         raise ValueError("Contract text too short (minimum 100 characters)")
     
-    try:
-        client = anthropic.Anthropic(api_key=settings.AI_API_KEY)
-    except Exception as e:
-        logger.error(f"Failed to initialize Anthropic client: {str(e)}")
-        raise Exception("AI service configuration error")
-    
-    # Trim text to avoid token limits
-    trimmed = contract_text[:15000]  # Increased to 15k chars
-    
-    model = os.getenv("ANTHROPIC_MODEL")  # Default to haiku
-    if not model:
-        model = "claude-3-haiku-20240307"  # Fallback default
+    model = get_analysis_model()
     
     logger.info(f"Using Anthropic model: {model}")
     
     try:
-        message = client.messages.create(
-            model=model,
-            max_tokens=4000,
-            temperature=0.1,  # Add temperature for more consistent results
-            system=SYSTEM_PROMPT,
-            messages=[{'role': 'user', 'content': ANALYSIS_PROMPT + trimmed}]
-        )
-        
-        raw = message.content[0].text.strip()
-        logger.debug(f"Raw API response: {raw[:500]}...")
-        
-        # Clean up JSON formatting
-        raw = re.sub(r'^```json\s*', '', raw)
-        raw = re.sub(r'\s*```$', '', raw)
-        raw = raw.strip()
-        
-        # Parse JSON
-        result = json.loads(raw)
-        
-        # Validate required fields
-        required_fields = ['overall_risk_score', 'overall_risk_level', 'summary', 'risks']
-        for field in required_fields:
-            if field not in result:
-                logger.warning(f"Missing required field in response: {field}")
-                result[field] = [] if field == 'risks' else ('Unknown' if field == 'overall_risk_level' else 0)
-        
-        # Ensure quick_stats is present
-        if 'quick_stats' not in result:
-            risks = result.get('risks', [])
-            result['quick_stats'] = {
-                'total_risks': len(risks),
-                'critical_risks': sum(1 for r in risks if r.get('severity') == 'Critical'),
-                'high_risks': sum(1 for r in risks if r.get('severity') == 'High'),
-                'medium_risks': sum(1 for r in risks if r.get('severity') == 'Medium'),
-                'low_risks': sum(1 for r in risks if r.get('severity') == 'Low'),
-            }
-        
-        return result
+        # Long contracts are analyzed in full, one chunk per call
+        prompts = analysis_prompts(contract_text, clause_starts)
+        if len(prompts) > 1:
+            return _analyze_in_chunks(model, prompts, on_risks, on_progress)
+
+        if on_risks:
+            return _stream_analysis(model, prompts[0], on_risks, on_progress or (lambda fraction: None))
+        return _request_analysis(model, prompts[0])
         
-    except json.JSONDecodeError as e:
-        logger.error(f"Failed to parse AI response as JSON: {str(e)}")
-        logger.error(f"Raw response: {raw}")
-        raise Exception("AI returned invalid JSON. Please try again.")
+    except llm.RATE_LIMIT_ERRORS:
+        # Let the Celery task reschedule itself instead of failing outright
+        raise
     except Exception as e:
         logger.error(f"Analysis failed: {str(e)}")
-        raise Exception(f"Analysis failed: {str(e)}")
\ No newline at end of file
+        raise Exception(f"Analysis failed: {str(e)}")
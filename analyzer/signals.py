@@ -0,0 +1,14 @@
+# analyzer/signals.py
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from .models import Contract
+from . import search
+
+
+@receiver(post_delete, sender=Contract)
+def remove_search_rows(sender, instance, **kwargs):
+    """
+    Drop a deleted contract's search rows, its chat messages' included, however
+    it was deleted: the view, the admin, or a cascade from its user or batch.
+    """
+    search.remove_contract(instance.id)
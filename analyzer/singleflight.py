@@ -0,0 +1,96 @@
+# analyzer/singleflight.py
+"""
+Single-flight for contract analyses.
+The first task to analyze a given text takes a Redis lock keyed by the text
+hash, model and prompt version. Tasks for the same text that arrive while it
+runs put themselves on a waiter list instead of calling the model; when the
+leader finishes it re-dispatches them under their original task ids, and they
+pick the result up from the analysis cache. Each waiter also schedules a
+fallback run for after the lock's TTL, in case the leader dies without
+releasing it.
+"""
+import json
+import logging
+import threading
+import redis
+from django.conf import settings
+from .services import PROMPT_VERSION
+
+logger = logging.getLogger(__name__)
+
+# Take the lock if it is free (or already ours, e.g. a redelivered task),
+# otherwise join the waiter list unless ARGV[4] is '0'. Returns 1 for the
+# leader, 0 otherwise.
+JOIN_SCRIPT = """
+local holder = redis.call('GET', KEYS[1])
+if not holder or holder == ARGV[1] then
+  redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+  return 1
+end
+if ARGV[4] == '0' then
+  return 0
+end
+redis.call('RPUSH', KEYS[2], ARGV[2])
+redis.call('EXPIRE', KEYS[2], tonumber(ARGV[3]) * 2)
+return 0
+"""
+
+# Drop the lock if we still hold it and hand back every waiter, atomically,
+# so nobody can join between the two steps and be left waiting.
+LEAVE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  redis.call('DEL', KEYS[1])
+end
+local waiters = redis.call('LRANGE', KEYS[2], 0, -1)
+redis.call('DEL', KEYS[2])
+return waiters
+"""
+
+_redis = None
+_scripts = None
+_redis_lock = threading.Lock()
+
+
+def _get_scripts():
+    global _redis, _scripts
+    if _scripts is None:
+        with _redis_lock:
+            if _scripts is None:
+                _redis = redis.Redis.from_url(settings.REDIS_URL, socket_timeout=2)
+                _scripts = (_redis.register_script(JOIN_SCRIPT), _redis.register_script(LEAVE_SCRIPT))
+    return _scripts
+
+
+def flight_key(text_hash: str, model: str) -> str:
+    return f'analysis:inflight:{model}:{PROMPT_VERSION}:{text_hash}'
+
+
+def join(key: str, task_id: str, waiter: dict, wait: bool = True) -> bool:
+    """
+    Return True if this task holds the lock and should run the analysis, False if
+    another task holds it. A task that may wait is then queued behind that task;
+    with wait=False it is not, and should analyze without the lock. If Redis is
+    unreachable every task leads, which costs a duplicate call but never blocks
+    an analysis.
+    """
+    join_script, _ = _get_scripts()
+    try:
+        leader = join_script(
+            keys=[key, f'{key}:waiters'],
+            args=[task_id, json.dumps(waiter), settings.ANALYSIS_SINGLEFLIGHT_TTL, '1' if wait else '0'],
+        )
+    except redis.RedisError as e:
+        logger.warning(f"Single-flight unavailable, analyzing without it: {str(e)}")
+        return True
+    return bool(leader)
+
+
+def leave(key: str, task_id: str) -> list:
+    """Release the lock and return the waiters that joined while it was held."""
+    _, leave_script = _get_scripts()
+    try:
+        waiters = leave_script(keys=[key, f'{key}:waiters'], args=[task_id])
+    except redis.RedisError as e:
+        logger.warning(f"Single-flight release failed, waiters stay queued until this text is analyzed again: {str(e)}")
+        return []
+    return [json.loads(waiter) for waiter in waiters]
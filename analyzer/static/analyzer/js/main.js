@@ -65,7 +65,7 @@ let pollInterval = null;
 
 function pollTaskStatus(taskId) {
   let pollCount = 0;
-  const maxPolls = 300; // 10 minutes max (2s * 300 = 600s = 10min)
+  let maxPolls = 300; // 10 minutes until the server reports its own poll_timeout
   
   // Clear any existing poll interval
   if (pollInterval) {
@@ -81,6 +81,7 @@ function pollTaskStatus(taskId) {
       
       // Update loading message based on status
       updateLoadingMessage(data);
+      if (data.poll_timeout) maxPolls = Math.ceil(data.poll_timeout / 2);
       
       if (data.status === 'SUCCESS') {
         clearInterval(pollInterval);
@@ -231,7 +232,7 @@ async function submitText() {
 // ── POLL TASK STATUS ───────────────────────────────────────────────────────────
 function pollTaskStatus(taskId) {
   let pollCount = 0;
-  const maxPolls = 300;
+  let maxPolls = 300; // until the server reports its own poll_timeout
 
   if (pollInterval) clearInterval(pollInterval);
 
@@ -245,6 +246,7 @@ function pollTaskStatus(taskId) {
       const data = await safeJson(res);
 
       updateLoadingMessage(data);
+      if (data.poll_timeout) maxPolls = Math.ceil(data.poll_timeout / 2);
 
       if (data.status === 'SUCCESS') {
         clearInterval(pollInterval);
@@ -567,26 +569,61 @@ async function sendChat() {
   const csrftoken = getCookie('csrftoken') || document.querySelector('[name=csrfmiddlewaretoken]')?.value;
 
   try {
-    // FIXED: Use the URL from your template or construct it properly
-    const url = `/chat/${contractId}/send/`;
+    // Stream the reply so text shows up as soon as the model starts writing
+    const url = `/chat/${contractId}/stream/`;
     
     const res = await fetch(url, {
       method: 'POST',
       headers: { 
         'Content-Type': 'application/json', 
-        'X-CSRFToken': csrftoken 
+        'X-CSRFToken': csrftoken,
+        'Accept': 'text/event-stream'
       },
       body: JSON.stringify({ message }),
     });
-    
-    const data = await res.json();
-    typing.remove();
-    
-    if (data.reply) {
-      appendBubble(msgs, 'assistant', data.reply);
-    } else {
+
+    if (!res.ok || !res.body) {
+      const data = await safeJson(res);
+      typing.remove();
       appendBubble(msgs, 'assistant', '⚠️ ' + (data.error || 'Something went wrong.'));
+      return;
     }
+
+    let bubble = null;
+    let buffer = '';
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      // Events are separated by a blank line: "event: <name>\ndata: <json>"
+      let boundary;
+      while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+        const raw = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+
+        const event = (raw.match(/^event: (.*)$/m) || [])[1];
+        const dataLine = (raw.match(/^data: (.*)$/m) || [])[1];
+        if (!event || !dataLine) continue;
+        const data = JSON.parse(dataLine);
+
+        if (event === 'token') {
+          if (!bubble) {
+            typing.remove();
+            bubble = appendBubble(msgs, 'assistant', '');
+          }
+          bubble.textContent += data.text;
+          msgs.scrollTop = msgs.scrollHeight;
+        } else if (event === 'error') {
+          typing.remove();
+          appendBubble(msgs, 'assistant', '⚠️ ' + (data.error || 'Something went wrong.'));
+        }
+      }
+    }
+    typing.remove();
   } catch (err) {
     console.error('Chat error:', err);
     typing.remove();
@@ -0,0 +1,76 @@
+# analyzer/streaming.py
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class RiskStreamParser:
+    """
+    Incremental scanner for a streamed analysis response.
+    Feed it text deltas as they arrive; each call returns the objects of the
+    top-level "risks" array whose closing brace has been seen since the last call.
+    Anything outside that array (fences, other keys) is skipped without parsing.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.string_chars = []
+        self.last_string = None
+        self.key = None
+        self.in_risks = False
+        self.capture = None
+
+    def feed(self, text: str) -> list:
+        completed = []
+        for char in text:
+            if self.capture is not None:
+                self.capture.append(char)
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == '\\':
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.depth == 1:
+                        self.last_string = ''.join(self.string_chars)
+                elif self.depth == 1:
+                    self.string_chars.append(char)
+                continue
+
+            if char == '"':
+                self.in_string = True
+                self.string_chars = []
+            elif char == ':' and self.depth == 1:
+                self.key = self.last_string
+            elif char == ',' and self.depth == 1:
+                self.key = None
+            elif char in '{[':
+                if char == '[' and self.depth == 1 and self.key == 'risks':
+                    self.in_risks = True
+                elif char == '{' and self.in_risks and self.depth == 2:
+                    self.capture = ['{']
+                self.depth += 1
+            elif char in '}]':
+                self.depth -= 1
+                if char == '}' and self.capture is not None and self.depth == 2:
+                    risk = self._finish_capture()
+                    if risk is not None:
+                        completed.append(risk)
+                elif char == ']' and self.in_risks and self.depth == 1:
+                    self.in_risks = False
+        return completed
+
+    def _finish_capture(self):
+        raw = ''.join(self.capture)
+        self.capture = None
+        try:
+            risk = json.loads(raw)
+        except json.JSONDecodeError:
+            logger.warning(f"Skipping unparseable streamed risk: {raw[:200]}")
+            return None
+        return risk if isinstance(risk, dict) else None
@@ -1,21 +1,238 @@
 # analyzer/tasks.py
 import logging
-from celery import shared_task
+from datetime import timedelta
+from celery import chain, chord, group, shared_task, uuid
+from celery.exceptions import Ignore
 from django.contrib.auth import get_user_model
-from .models import Contract, Risk
-from .services import analyze_contract
+from clauseguard import llm
+from django.utils import timezone
+from django.conf import settings
+from clauseguard.sqlite import write_transaction
+from .models import Batch, Clause, Contract, MessageBatch, MissingProtection, PositiveClause, Risk
+from .services import (
+    analysis_from_replies, analysis_prompts, analysis_request, analyze_contract, extract_text_from_file,
+    get_analysis_model,
+)
+from .prescreen import prescreen_contract
+from .segmentation import segment_contract
+from . import portfolio, search, singleflight
+from .cache import (
+    analysis_text_hash, file_digest, get_cached_analysis, get_cached_extraction, store_analysis,
+    store_extraction,
+)
 
 logger = logging.getLogger(__name__)
 
+# Batch documents share the extraction queue with interactive uploads, which go first
+BULK_EXTRACTION_PRIORITY = 5
+
+
+def dispatch_analysis(contract):
+    """
+    Start the Celery pipeline for a contract and return the task id to poll.
+    Uploaded files go through the extraction stage first; pasted text goes
+    straight to analysis. The returned id always belongs to the analysis task,
+    and the extraction stage reports its progress under that same id.
+    """
+    pipeline, analysis_task_id = analysis_pipeline(contract)
+    contract.analysis_task_id = analysis_task_id
+    contract.save(update_fields=['analysis_task_id'])
+    pipeline.apply_async()
+    return analysis_task_id
+
+
+def analysis_pipeline(contract, queue=None):
+    """
+    Return (signature, analysis task id) for a contract's extraction and analysis.
+    queue overrides the analysis queue, e.g. 'bulk' for ZIP batches; extraction
+    always runs on the extraction worker, behind interactive uploads.
+    """
+    options = {'queue': queue} if queue else {}
+    analysis_task_id = uuid()
+    analysis = analyze_contract_task.si(contract.id).set(task_id=analysis_task_id, **options)
+    if contract.source_file and not contract.raw_text:
+        return chain(
+            extract_contract_text_task.si(contract.id, progress_task_id=analysis_task_id).set(
+                **({'priority': BULK_EXTRACTION_PRIORITY} if queue else {})
+            ),
+            analysis,
+        ), analysis_task_id
+    return analysis, analysis_task_id
+
+
+def dispatch_batch(batch, contracts, offline=False):
+    """
+    Fan a batch's contracts out to their pipelines in one chord; finalize_batch_task
+    writes the aggregated report once every pipeline has finished.
+    Offline batches are only extracted here: submit_message_batches_task picks
+    them up, and poll_message_batches_task finalizes the batch.
+    """
+    if offline:
+        group([
+            extract_contract_text_task.si(contract.id).set(priority=BULK_EXTRACTION_PRIORITY)
+            for contract in contracts
+        ]).apply_async()
+        return
+
+    chord(
+        [analysis_pipeline(contract, queue='bulk')[0] for contract in contracts],
+        finalize_batch_task.si(batch.id),
+    ).apply_async()
+
+
+def prepare_contract(contract):
+    """
+    Steps that run once per contract as soon as its text is known:
+    clause segmentation and the rule-based pre-screen, saved as a
+    provisional analysis.
+    """
+    save_clauses(contract)
+    contract.content_hash = analysis_text_hash(contract.raw_text)
+    contract.prescreen = prescreen_contract(contract.raw_text)
+    contract.save(update_fields=['content_hash', 'prescreen'])
+    logger.info(
+        f"Pre-screen flagged {len(contract.prescreen['flags'])} clauses "
+        f"for contract {contract.id} in {contract.prescreen['elapsed_ms']}ms"
+    )
+
+
+def save_clauses(contract):
+    """Replace the contract's stored clauses with a fresh segmentation of raw_text."""
+    clauses = segment_contract(contract.raw_text)
+    with write_transaction():
+        contract.clauses.all().delete()
+        Clause.objects.bulk_create([
+            Clause(
+                contract=contract,
+                index=clause['index'],
+                number=clause['number'],
+                heading=clause['heading'],
+                level=clause['level'],
+                parent_index=clause['parent_index'],
+                start_offset=clause['start'],
+                end_offset=clause['end'],
+            )
+            for clause in clauses
+        ])
+    return len(clauses)
+
+
 @shared_task(bind=True)
-def analyze_contract_task(self, contract_id):
+def extract_contract_text_task(self, contract_id, progress_task_id=None):
+    """
+    First pipeline stage: extract text from the uploaded file stored on the contract.
+    Failures are recorded on the contract so the analysis stage can report them.
+    """
+    try:
+        contract = Contract.objects.get(id=contract_id)
+
+        # Redelivered after the text was already saved (late acks): nothing to redo
+        if contract.raw_text:
+            return {
+                'success': True,
+                'contract_id': contract.id,
+            }
+
+        self.update_state(
+            task_id=progress_task_id,
+            state='PROGRESS',
+            meta={
+                'step': 'extracting',
+                'message': 'Reading your document...',
+                'progress': 10
+            }
+        )
+
+        logger.info(f"Extracting text for contract {contract_id}, file: {contract.filename}")
+
+        with contract.source_file.open('rb') as f:
+            file_bytes = f.read()
+
+        # An identical upload may have been extracted since this one was queued
+        digest = file_digest(file_bytes)
+        text = get_cached_extraction(digest)
+        if text is None:
+            text = extract_text_from_file(file_bytes, contract.filename)
+
+            if len(text.strip()) < 100:
+                raise Exception('File has no readable text.')
+
+            store_extraction(digest, text)
+
+        # The raw upload is no longer needed once the text is stored
+        contract.raw_text = text
+        contract.save(update_fields=['raw_text'])
+        contract.source_file.delete(save=False)
+        contract.save(update_fields=['source_file'])
+        prepare_contract(contract)
+
+        flagged = len(contract.prescreen['flags'])
+        self.update_state(
+            task_id=progress_task_id,
+            state='PROGRESS',
+            meta={
+                'step': 'extracted',
+                'message': f'Document read, {flagged} clauses flagged for review. Starting analysis...',
+                'progress': 30
+            }
+        )
+
+        logger.info(f"Extracted {len(text)} chars for contract {contract_id}")
+
+        return {
+            'success': True,
+            'contract_id': contract.id,
+        }
+
+    except Contract.DoesNotExist:
+        logger.error(f"Contract {contract_id} not found")
+        return {
+            'success': False,
+            'error': f'Contract {contract_id} not found'
+        }
+    except Exception as e:
+        logger.error(f"Extraction failed: {str(e)}", exc_info=True)
+
+        try:
+            contract = Contract.objects.get(id=contract_id)
+            contract.analysis_json = {'error': f'Could not read file: {e}'}
+            contract.save(update_fields=['analysis_json'])
+        except Exception:
+            logger.exception(f"Could not record the extraction failure on contract {contract_id}")
+
+        return {
+            'success': False,
+            'error': f'Could not read file: {e}'
+        }
+
+@shared_task(bind=True, max_retries=5)
+def analyze_contract_task(self, contract_id, fallback=False):
     """
     Celery task to analyze contract asynchronously
-    Takes a contract_id and updates the existing contract with analysis results
+    Takes a contract_id and updates the existing contract with analysis results.
+    fallback marks the run a single-flight waiter schedules for itself in case
+    the analysis it waited on never finished.
     """
     try:
         # Get the contract
         contract = Contract.objects.get(id=contract_id)
+
+        # The leader finished and this task already ran again with its result
+        if fallback and contract.analysis_json:
+            if contract.analysis_json.get('error'):
+                return {'success': False, 'error': contract.analysis_json['error']}
+            return {
+                'success': True,
+                'contract_id': contract.id,
+                'redirect': f'/results/{contract.id}/'
+            }
+
+        # Extraction stage failed or produced nothing; surface its error
+        if not contract.raw_text.strip():
+            return {
+                'success': False,
+                'error': contract.analysis_json.get('error') or 'Contract has no text to analyze'
+            }
         
         # Update task state
         self.update_state(
@@ -23,43 +240,108 @@ def analyze_contract_task(self, contract_id):
             meta={
                 'step': 'analyzing',
                 'message': 'AI is analyzing your contract...',
-                'progress': 50
+                'progress': 35
             }
         )
         
         logger.info(f"Starting analysis for contract {contract_id}, file: {contract.filename}")
+
+        # Risks left by an interrupted earlier attempt are provisional; start clean
+        with write_transaction():
+            contract.risks.all().delete()
+            contract.recount_risks()
+        streamed_risks = []
+        last_progress = 35
+
+        def report_progress(fraction, force=False):
+            nonlocal last_progress
+            progress = 35 + int(fraction * 55)
+            if not force and progress - last_progress < 5:
+                return
+            last_progress = progress
+            found = len(streamed_risks)
+            self.update_state(
+                state='PROGRESS',
+                meta={
+                    'step': 'analyzing',
+                    'message': f'Found {found} risk{"" if found == 1 else "s"} so far...' if found
+                               else 'AI is analyzing your contract...',
+                    'progress': progress,
+                    'risks_found': found,
+                }
+            )
+
+        def save_risks(risks):
+            # Persist each risk as soon as the stream completes it
+            with write_transaction():
+                Risk.objects.bulk_create([_risk_row(contract, r) for r in risks])
+                contract.recount_risks()
+            streamed_risks.extend(risks)
+            report_progress((last_progress - 35) / 55, force=True)
         
-        # Run the actual analysis (this makes the Anthropic API call)
-        analysis = analyze_contract(contract.raw_text)
+        # Identical text analyzed with the same model and prompts: reuse it
+        model = get_analysis_model()
+        analysis = get_cached_analysis(contract.raw_text, model)
+        if analysis is None:
+            # Only one task per text calls the model; the others wait for its result.
+            # Chord members (ZIP batches) never wait: a task that ends in Ignore
+            # never reports back to its chord, so the batch would not finish.
+            flight = singleflight.flight_key(contract.content_hash or analysis_text_hash(contract.raw_text), model)
+            queue = (self.request.delivery_info or {}).get('routing_key')
+            waiter = {'contract_id': contract.id, 'task_id': self.request.id, 'queue': queue}
+            in_chord = bool(self.request.chord)
+            leader = singleflight.join(flight, self.request.id, waiter, wait=not in_chord)
+            if not leader and not in_chord:
+                logger.info(f"Contract {contract_id} is waiting for an identical analysis in flight")
+                self.update_state(
+                    state='PROGRESS',
+                    meta={
+                        'step': 'waiting',
+                        'message': 'An identical contract is being analyzed, reusing its result...',
+                        'progress': 40
+                    }
+                )
+                # The leader re-dispatches this task under the same id when it finishes. If it
+                # dies first, its lock expires and this fallback run analyzes the text itself.
+                analyze_contract_task.apply_async(
+                    (contract.id,),
+                    {'fallback': True},
+                    task_id=self.request.id,
+                    countdown=settings.ANALYSIS_SINGLEFLIGHT_TTL + 60,
+                    **({'queue': queue} if queue else {}),
+                )
+                raise Ignore()
+
+            try:
+                # It may have finished between our cache check and taking the lock
+                analysis = get_cached_analysis(contract.raw_text, model)
+                if analysis is None:
+                    # Run the actual analysis (this makes the Anthropic API call)
+                    clause_starts = list(contract.clauses.values_list('start_offset', flat=True)) or None
+                    analysis = analyze_contract(
+                        contract.raw_text,
+                        on_risks=save_risks,
+                        on_progress=report_progress,
+                        clause_starts=clause_starts,
+                    )
+                    store_analysis(contract.raw_text, model, analysis)
+            finally:
+                if leader:
+                    _release_waiters(flight, self.request.id)
+        else:
+            logger.info(f"Reusing cached analysis for contract {contract_id}")
         
         self.update_state(
             state='PROGRESS',
             meta={
                 'step': 'saving',
                 'message': 'Saving analysis results...',
-                'progress': 90
+                'progress': 90,
+                'risks_found': len(analysis.get('risks', [])),
             }
         )
         
-        # Update contract with analysis results
-        contract.summary = analysis.get('summary', '')
-        contract.overall_risk_score = analysis.get('overall_risk_score', 0)
-        contract.overall_risk_level = analysis.get('overall_risk_level', 'Low')
-        contract.analysis_json = analysis
-        contract.save()
-        
-        # Save individual risks
-        for r in analysis.get('risks', []):
-            Risk.objects.create(
-                contract=contract,
-                risk_id=r.get('id', ''),
-                title=r.get('title', ''),
-                severity=r.get('severity', 'Low'),
-                category=r.get('category', 'Other'),
-                clause=r.get('clause', ''),
-                explanation=r.get('explanation', ''),
-                recommendation=r.get('recommendation', ''),
-            )
+        persist_analysis(contract, analysis)
         
         logger.info(f"Analysis complete for contract {contract.id}")
         
@@ -75,18 +357,316 @@ def analyze_contract_task(self, contract_id):
             'success': False,
             'error': f'Contract {contract_id} not found'
         }
+    except Ignore:
+        raise
+    except llm.RATE_LIMIT_ERRORS as e:
+        countdown = 60 * (self.request.retries + 1)
+        # Batch members are not watched by a polling page, so only they may outlast it
+        if self.request.retries < self.max_retries and (
+            self.request.chord or _retry_fits_poll_window(contract_id, countdown)
+        ):
+            # Wait for capacity instead of failing; the client keeps polling the same id
+            logger.warning(f"LLM capacity exhausted for contract {contract_id}, retrying in {countdown}s")
+            self.update_state(
+                state='PROGRESS',
+                meta={
+                    'step': 'waiting',
+                    'message': 'High demand right now, your analysis is queued...',
+                    'progress': 40
+                }
+            )
+            raise self.retry(exc=e, countdown=countdown)
+
+        logger.error(f"Task gave up waiting for LLM capacity: {str(e)}")
+        return _mark_failed(contract_id, 'The AI service is busy. Please try again in a few minutes.')
     except Exception as e:
         logger.error(f"Task failed: {str(e)}", exc_info=True)
-        
-        # Update contract to show failure if needed
-        try:
+        return _mark_failed(contract_id, str(e))
+
+
+def _retry_fits_poll_window(contract_id, countdown):
+    """
+    Whether a retry in countdown seconds can still finish before the page stops
+    polling: it may wait LLM_RATE_LIMIT_MAX_WAIT for capacity, then make its call.
+    """
+    created_at = Contract.objects.filter(id=contract_id).values_list('created_at', flat=True).first()
+    if created_at is None:
+        return False
+    elapsed = (timezone.now() - created_at).total_seconds()
+    finishes_by = elapsed + countdown + settings.LLM_RATE_LIMIT_MAX_WAIT + settings.LLM_TIMEOUT
+    return finishes_by < settings.ANALYSIS_POLL_TIMEOUT
+
+
+def _release_waiters(flight, task_id):
+    """Re-dispatch the tasks that waited on this analysis; they find it in the cache."""
+    for waiter in singleflight.leave(flight, task_id):
+        analyze_contract_task.apply_async(
+            (waiter['contract_id'],),
+            task_id=waiter['task_id'],
+            **({'queue': waiter['queue']} if waiter.get('queue') else {}),
+        )
+
+
+def persist_analysis(contract, analysis):
+    """
+    Write a finished analysis in one transaction: the contract's score, summary
+    and risk counters, then its risks, missing protections and favorable
+    clauses, each replaced wholesale with one bulk insert, its search index
+    rows and its owner's portfolio counters. Running it again for the same
+    contract leaves the same rows, so retried tasks cannot duplicate results.
+    """
+    risks = [_risk_row(contract, r) for r in analysis.get('risks', [])]
+    with write_transaction():
+        contract.summary = analysis.get('summary', '')
+        contract.overall_risk_score = analysis.get('overall_risk_score', 0)
+        contract.overall_risk_level = analysis.get('overall_risk_level', 'Low')
+        contract.analysis_json = analysis
+        contract.set_risk_counts(risk.severity for risk in risks)
+        # Re-read what the contract already counts now that we hold the write lock
+        contract.portfolio_counts = Contract.objects.values_list('portfolio_counts', flat=True).get(id=contract.id)
+        portfolio.record_analysis(contract, risks)
+        contract.save(update_fields=[
+            'summary', 'overall_risk_score', 'overall_risk_level', 'analysis_json', 'portfolio_counts',
+            *Contract.RISK_COUNT_FIELDS.values(),
+        ])
+
+        # Streamed risks were provisional; the final list replaces them
+        contract.risks.all().delete()
+        contract.missing_protections.all().delete()
+        contract.positive_clauses.all().delete()
+        Risk.objects.bulk_create(risks)
+        search.index_contract(contract, risks)
+        MissingProtection.objects.bulk_create([
+            MissingProtection(
+                contract=contract,
+                title=(p.get('title') or '')[:255],
+                importance=p.get('importance') or 'Medium',
+                explanation=p.get('explanation', ''),
+            )
+            for p in analysis.get('missing_protections', [])
+        ])
+        PositiveClause.objects.bulk_create([
+            PositiveClause(
+                contract=contract,
+                title=(c.get('title') or '')[:255],
+                explanation=c.get('explanation', ''),
+            )
+            for c in analysis.get('positive_clauses', [])
+        ])
+
+
+def _risk_row(contract, r):
+    return Risk(
+        contract=contract,
+        risk_id=str(r.get('id', ''))[:50],
+        title=r.get('title', '')[:255],
+        severity=r.get('severity', 'Low'),
+        category=r.get('category', 'Other')[:100],
+        clause=r.get('clause', ''),
+        explanation=r.get('explanation', ''),
+        recommendation=r.get('recommendation', ''),
+    )
+
+
+def _mark_failed(contract_id, error):
+    # Update contract to show failure if needed
+    try:
+        with write_transaction():
             contract = Contract.objects.get(id=contract_id)
-            contract.analysis_json = {'error': str(e)}
+            contract.analysis_json = {'error': error}
+            if contract.portfolio_counts:
+                portfolio.forget(contract)
             contract.save()
-        except:
-            pass
-            
-        return {
-            'success': False,
-            'error': str(e)
-        }
\ No newline at end of file
+    except Exception:
+        logger.exception(f"Could not mark contract {contract_id} as failed")
+
+    return {
+        'success': False,
+        'error': error
+    }
+
+
+@shared_task
+def finalize_batch_task(batch_id):
+    """
+    Chord callback for a ZIP batch: aggregate every contract's outcome into
+    the batch report and mark the batch completed.
+    """
+    try:
+        batch = Batch.objects.get(id=batch_id)
+        contracts = list(batch.contracts.select_related('document'))
+
+        failed = [c for c in contracts if c.analysis_json.get('error') or not c.analysis_json]
+        analyzed = [c for c in contracts if c not in failed]
+        severity_counts = {level: 0 for level in ['Critical', 'High', 'Medium', 'Low']}
+        level_counts = {level: 0 for level in ['Critical', 'High', 'Medium', 'Low']}
+        for contract in analyzed:
+            level_counts[contract.overall_risk_level] = level_counts.get(contract.overall_risk_level, 0) + 1
+            for severity, field in Contract.RISK_COUNT_FIELDS.items():
+                severity_counts[severity] += getattr(contract, field)
+
+        batch.report = {
+            'analyzed': len(analyzed),
+            'failed': len(failed),
+            'average_risk_score': round(
+                sum(c.overall_risk_score for c in analyzed) / len(analyzed)
+            ) if analyzed else 0,
+            'risk_levels': level_counts,
+            'risk_severities': severity_counts,
+            'highest_risk': [
+                {'contract_id': c.id, 'filename': c.filename, 'score': c.overall_risk_score,
+                 'level': c.overall_risk_level}
+                for c in sorted(analyzed, key=lambda c: -c.overall_risk_score)[:10]
+            ],
+            'failures': [
+                {'contract_id': c.id, 'filename': c.filename,
+                 'error': c.analysis_json.get('error', 'Analysis did not complete')}
+                for c in failed
+            ],
+        }
+        batch.status = 'completed'
+        batch.finished_at = timezone.now()
+        batch.save(update_fields=['report', 'status', 'finished_at'])
+        logger.info(f"Batch {batch_id} finished: {len(analyzed)} analyzed, {len(failed)} failed")
+        return {'success': True, 'batch_id': batch_id}
+
+    except Exception as e:
+        logger.error(f"Failed to finalize batch {batch_id}: {str(e)}", exc_info=True)
+        Batch.objects.filter(id=batch_id).update(status='failed', finished_at=timezone.now())
+        return {'success': False, 'error': str(e)}
+
+
+@shared_task
+def submit_message_batches_task():
+    """
+    Periodic: collect offline contracts that are extracted but not yet analyzed
+    and submit their analysis prompts as one Message Batch.
+    """
+    _release_stale_claims()
+    pending = list(
+        Contract.objects.filter(analysis_mode='offline', message_batch__isnull=True, document__analysis_json={})
+        .exclude(document__raw_text='')
+        .values_list('id', flat=True)[:settings.MESSAGE_BATCH_MAX_CONTRACTS]
+    )
+    if not pending:
+        return {'success': True, 'submitted': 0}
+
+    # Claim the contracts first so an overlapping run cannot submit them twice
+    model = get_analysis_model()
+    batch = MessageBatch.objects.create(model=model)
+    Contract.objects.filter(id__in=pending, message_batch__isnull=True).update(message_batch=batch)
+
+    requests, contract_requests, cached = [], {}, 0
+    for contract in batch.contracts.select_related('document'):
+        analysis = get_cached_analysis(contract.raw_text, model)
+        if analysis is not None:
+            persist_analysis(contract, analysis)
+            cached += 1
+            continue
+        clause_starts = list(contract.clauses.values_list('start_offset', flat=True)) or None
+        prompts = analysis_prompts(contract.raw_text, clause_starts)
+        for index, prompt in enumerate(prompts):
+            requests.append({
+                'custom_id': f'contract-{contract.id}-{index}',
+                'params': analysis_request(model, prompt),
+            })
+        contract_requests[str(contract.id)] = len(prompts)
+
+    if not requests:
+        batch.status = 'processed'
+        batch.processed_at = timezone.now()
+        batch.save(update_fields=['status', 'processed_at'])
+        return {'success': True, 'submitted': 0, 'cached': cached}
+
+    try:
+        remote = llm.create_message_batch('analyzer.message_batch', requests)
+    except Exception as e:
+        logger.error(f"Message batch submission failed: {str(e)}", exc_info=True)
+        Contract.objects.filter(message_batch=batch).update(message_batch=None)
+        batch.delete()
+        return {'success': False, 'error': str(e)}
+
+    batch.batch_id = remote.id
+    batch.request_count = len(requests)
+    batch.contract_requests = contract_requests
+    batch.save(update_fields=['batch_id', 'request_count', 'contract_requests'])
+    logger.info(f"Submitted message batch {remote.id}: {len(requests)} requests for {len(contract_requests)} contracts")
+    return {'success': True, 'submitted': len(contract_requests), 'cached': cached}
+
+
+def _release_stale_claims():
+    """
+    Hand contracts back to the queue when the submission that claimed them died
+    before saving its batch_id, so no poll would ever collect them.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.MESSAGE_BATCH_CLAIM_TIMEOUT)
+    stale = MessageBatch.objects.filter(batch_id=None, status='in_progress', created_at__lt=cutoff)
+    for batch in stale:
+        released = batch.contracts.update(message_batch=None)
+        logger.warning(f"Released {released} contracts from unsubmitted message batch {batch.pk}")
+        batch.delete()
+
+
+@shared_task
+def poll_message_batches_task():
+    """
+    Periodic: collect the results of every Message Batch that has ended,
+    then finalize the offline ZIP batches that have nothing left pending.
+    """
+    collected = 0
+    for batch in MessageBatch.objects.filter(status='in_progress').exclude(batch_id=None):
+        try:
+            remote = llm.retrieve_message_batch('analyzer.message_batch', batch.batch_id)
+            if remote.processing_status != 'ended':
+                continue
+            _collect_message_batch(batch)
+            collected += 1
+        except Exception as e:
+            logger.error(f"Failed to collect message batch {batch.batch_id}: {str(e)}", exc_info=True)
+
+    # Also covers batches whose remaining contracts failed extraction
+    _finalize_offline_batches()
+    return {'success': True, 'collected': collected}
+
+
+def _collect_message_batch(batch):
+    """Fan an ended batch's results back out into Contract and Risk rows."""
+    replies, errors = {}, {}
+    for entry in llm.message_batch_results(batch.batch_id):
+        _, contract_id, index = entry.custom_id.split('-')
+        if entry.result.type == 'succeeded':
+            replies.setdefault(contract_id, {})[int(index)] = entry.result.message.content[0].text
+        elif entry.result.type == 'errored':
+            errors[contract_id] = entry.result.error.error.message
+        else:
+            errors[contract_id] = f'Batch request {entry.result.type}'
+
+    for contract in batch.contracts.select_related('document'):
+        key = str(contract.id)
+        expected = batch.contract_requests.get(key, 0)
+        received = replies.get(key, {})
+        if key in errors or len(received) < expected:
+            _mark_failed(contract.id, f"Analysis failed: {errors.get(key, 'missing batch results')}")
+            continue
+        try:
+            analysis = analysis_from_replies([received[index] for index in range(expected)])
+        except Exception as e:
+            _mark_failed(contract.id, f"Analysis failed: {str(e)}")
+            continue
+        store_analysis(contract.raw_text, batch.model, analysis)
+        persist_analysis(contract, analysis)
+
+    batch.status = 'processed'
+    batch.succeeded = sum(len(received) for received in replies.values())
+    batch.errored = batch.request_count - batch.succeeded
+    batch.processed_at = timezone.now()
+    batch.save(update_fields=['status', 'succeeded', 'errored', 'processed_at'])
+    logger.info(f"Collected message batch {batch.batch_id}: {batch.succeeded} succeeded, {batch.errored} failed")
+
+
+def _finalize_offline_batches():
+    """Finalize offline ZIP batches once none of their contracts is still pending."""
+    batches = Batch.objects.filter(status='processing', contracts__analysis_mode='offline').distinct()
+    for batch in batches:
+        if not batch.contracts.filter(document__analysis_json={}).exists():
+            finalize_batch_task.delay(batch.id)
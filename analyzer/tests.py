@@ -0,0 +1,968 @@
+import io
+import json
+import re
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+from http.server import ThreadingHTTPServer
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+from celery.exceptions import Ignore, Retry
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+import pdfplumber
+from PyPDF2 import PageObject
+from .prescreen import prescreen_contract, select_priority_text
+from clauseguard import llm, llm_stub, ratelimit
+from chat.models import ChatMessage
+from clauseguard.sqlite import write_transaction
+from . import batch, cache, portfolio, search, services, singleflight, tasks
+from .models import Batch, Contract, ExtractionCacheEntry, MessageBatch, PortfolioStat, Risk
+from .services import PageTimeout, analyze_contract, extract_text_from_pdf
+from .segmentation import segment_contract
+from .streaming import RiskStreamParser
+
+try:
+    # fakeredis runs the Lua scripts through lupa, so Redis-backed code is tested as written
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+requires_fakeredis = skipUnless(fakeredis, "fakeredis[lua] is not installed")
+
+
+def _use_fakeredis(test):
+    """Point the analyzer's Redis clients at one fake server for the length of a test."""
+    server = fakeredis.FakeRedis()
+    scripts = (server.register_script(singleflight.JOIN_SCRIPT), server.register_script(singleflight.LEAVE_SCRIPT))
+    for patcher in (
+        mock.patch.object(cache, '_redis', server),
+        mock.patch.object(singleflight, '_redis', server),
+        mock.patch.object(singleflight, '_scripts', scripts),
+    ):
+        patcher.start()
+        test.addCleanup(patcher.stop)
+    return server
+
+
+def _clause(number, heading):
+    body = f"The {heading.lower()} terms of this agreement apply to both parties in full. " * 5
+    return f"{number}. {heading}\n{body}\n"
+
+
+def _make_pdf(pages):
+    """A minimal PDF with one line of Helvetica text per page."""
+    objects = ['<< /Type /Catalog /Pages 2 0 R >>', None, '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    kids = []
+    for text in pages:
+        stream = f'BT /F1 12 Tf 72 720 Td ({text}) Tj ET'
+        objects.append(f'<< /Length {len(stream)} >>\nstream\n{stream}\nendstream')
+        objects.append(
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+            f'/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>'
+        )
+        kids.append(f'{len(objects)} 0 R')
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    data = b'%PDF-1.4\n'
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(data))
+        data += f'{number} 0 obj\n{body}\nendobj\n'.encode('latin-1')
+    xref = len(data)
+    data += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode()
+    data += ''.join(f'{offset:010d} 00000 n \n' for offset in offsets).encode()
+    data += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode()
+    return data
+
+
+def _analysis(*severities):
+    return {
+        'overall_risk_score': 20 * len(severities),
+        'overall_risk_level': 'High' if 'High' in severities else 'Low',
+        'summary': 'A services agreement.',
+        'risks': [
+            {'id': f'r{i}', 'title': f'{severity} risk {i}', 'severity': severity, 'category': 'Liability'}
+            for i, severity in enumerate(severities)
+        ],
+        'missing_protections': [],
+        'positive_clauses': [],
+    }
+
+
+def _zip(entries):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, content in entries.items():
+            archive.writestr(name, content)
+    return buffer.getvalue()
+
+
+def _run_chord(header, body):
+    """
+    Run a chord's header pipelines one task after another, each with
+    request.chord set as a worker would set it, then its callback.
+    """
+    for pipeline in header:
+        for signature in getattr(pipeline, 'tasks', [pipeline]):
+            task = signature.type
+            task.push_request(id=signature.id, chord=body, retries=0, delivery_info={'routing_key': 'bulk'})
+            try:
+                task.run(*signature.args, **signature.kwargs)
+            finally:
+                task.pop_request()
+    return body.apply().get()
+
+
+def _chunk_reply(risks):
+    return json.dumps({
+        'overall_risk_score': 50,
+        'overall_risk_level': 'Medium',
+        'summary': 'Chunk summary.',
+        'risks': risks,
+        'missing_protections': [],
+        'positive_clauses': [],
+    })
+
+
+class ChunkedAnalysisTests(SimpleTestCase):
+    @override_settings(ANALYSIS_CHUNKED=True, ANALYSIS_CHUNK_CHARS=500, ANALYSIS_MAX_CONCURRENCY=2)
+    def test_on_risks_receives_each_chunks_new_risks(self):
+        text = ''.join(_clause(n, heading) for n, heading in enumerate(
+            ['Payment', 'Liability', 'Termination', 'Confidentiality'], start=1
+        ))
+        liability = {'title': 'Uncapped liability', 'severity': 'High', 'category': 'Liability'}
+        payment = {'title': 'Late payment penalty', 'severity': 'Medium', 'category': 'Payment'}
+
+        def create_message(site, **kwargs):
+            part = int(re.search(r'part (\d+) of', kwargs['messages'][0]['content']).group(1))
+            # Every chunk repeats the liability risk; only the last adds a new one
+            risks = [dict(liability)] + ([dict(payment)] if part == 4 else [])
+            return SimpleNamespace(content=[SimpleNamespace(text=_chunk_reply(risks))])
+
+        batches = []
+        with mock.patch('analyzer.services.llm.create_message', side_effect=create_message) as create:
+            analysis = analyze_contract(text, on_risks=batches.append)
+
+        self.assertEqual(create.call_count, 4)
+        reported = [risk['title'] for batch in batches for risk in batch]
+        self.assertCountEqual(reported, ['Uncapped liability', 'Late payment penalty'])
+        self.assertEqual(analysis['quick_stats']['total_risks'], 2)
+
+
+
+class RiskStreamParserTests(SimpleTestCase):
+    RISKS = [
+        {'title': 'Unlimited "liability"', 'clause': 'Clause 9 {see schedule} [a], \\ b', 'severity': 'High'},
+        {'title': 'Auto-renewal', 'clause': 'renews unless "notice}" is given', 'severity': 'Medium'},
+        {'title': 'Nested', 'details': {'parties': ['a', 'b'], 'note': '}]'}, 'severity': 'Low'},
+    ]
+    RESPONSE = '```json\n' + json.dumps({
+        'summary': 'Mentions "risks": [{"title": "not one"}] in prose.',
+        'overall_risk_score': 60,
+        'risks': RISKS,
+        'missing_protections': [{'title': 'Not a risk'}],
+    }, indent=2) + '\n```'
+
+    def feed_in_pieces(self, size):
+        parser = RiskStreamParser()
+        emitted = []
+        for start in range(0, len(self.RESPONSE), size):
+            emitted.extend(parser.feed(self.RESPONSE[start:start + size]))
+        return emitted
+
+    def test_every_risk_is_emitted_once_however_the_text_is_split(self):
+        for size in (1, 2, 3, 7, 64, len(self.RESPONSE)):
+            self.assertEqual(self.feed_in_pieces(size), self.RISKS, size)
+
+    def test_split_at_every_position(self):
+        for split in range(len(self.RESPONSE)):
+            parser = RiskStreamParser()
+            emitted = parser.feed(self.RESPONSE[:split]) + parser.feed(self.RESPONSE[split:])
+            self.assertEqual(emitted, self.RISKS, split)
+
+    def test_a_risk_is_emitted_as_soon_as_its_object_closes(self):
+        parser = RiskStreamParser()
+        first_end = self.RESPONSE.index('"severity": "High"') + len('"severity": "High"')
+        first_end = self.RESPONSE.index('}', first_end) + 1
+        self.assertEqual(parser.feed(self.RESPONSE[:first_end - 1]), [])
+        self.assertEqual(parser.feed(self.RESPONSE[first_end - 1:first_end]), self.RISKS[:1])
+
+
+
+class SegmentationTests(TestCase):
+    ARTICLES = (
+        "SERVICES AGREEMENT between Acme Ltd and Beta LLC.\n\n"
+        "ARTICLE I\nDEFINITIONS\n"
+        "Section 1.1 Services. The services described in Schedule A.\n"
+        "Section 1.2 Fees. The fees set out below.\n"
+        "(a) Fees are payable monthly.\n"
+        "(b) Late fees accrue at 2%.\n"
+        "ARTICLE II\nTERM\n"
+        "Section 2.1 Term. One year from signature.\n"
+    )
+    NUMBERED = (
+        "1. Definitions. Words have their usual meaning.\n"
+        "2. Liability. Limited as follows.\n"
+        "2.1 Cap. Fees paid in the prior year.\n"
+        "(a) Excluding fraud.\n"
+        "2.2 Exclusions. Indirect loss.\n"
+        "3. Term. One year.\n"
+    )
+
+    def outline(self, clauses):
+        return [(c['number'], c['heading'], c['level'], c['parent_index']) for c in clauses]
+
+    def test_articles_nest_sections_and_lettered_clauses(self):
+        self.assertEqual(self.outline(segment_contract(self.ARTICLES)), [
+            ('', 'Preamble', 1, None),
+            ('I', 'DEFINITIONS', 1, None),
+            ('1.1', 'Services', 2, 1),
+            ('1.2', 'Fees', 2, 1),
+            ('(a)', 'Fees are payable monthly.', 3, 3),
+            ('(b)', 'Late fees accrue at 2%.', 3, 3),
+            ('II', 'TERM', 1, None),
+            ('2.1', 'Term', 2, 6),
+        ])
+
+    def test_numbered_clauses_nest_by_depth(self):
+        self.assertEqual(self.outline(segment_contract(self.NUMBERED)), [
+            ('1', 'Definitions', 1, None),
+            ('2', 'Liability', 1, None),
+            ('2.1', 'Cap', 2, 1),
+            ('(a)', 'Excluding fraud.', 3, 2),
+            ('2.2', 'Exclusions', 2, 1),
+            ('3', 'Term', 1, None),
+        ])
+
+    def test_text_without_headings_falls_back_to_paragraphs(self):
+        text = "First paragraph line.\nStill first.\n\nSecond paragraph.\n"
+        clauses = segment_contract(text)
+        self.assertEqual([c['heading'] for c in clauses], ['First paragraph line.', 'Second paragraph.'])
+        self.assertEqual(text[clauses[1]['start']:clauses[1]['end']], 'Second paragraph.\n')
+
+    def test_offsets_round_trip_into_raw_text(self):
+        user = User.objects.create_user('owner', 'owner@example.com', 'password')
+        contract = Contract.objects.create(
+            user=user, filename='agreement.txt', raw_text=self.ARTICLES,
+            summary='', overall_risk_score=0, overall_risk_level='Low', analysis_json={},
+        )
+        tasks.save_clauses(contract)
+
+        clauses = list(contract.clauses.all())
+        self.assertEqual(''.join(c.text_in(contract.raw_text) for c in clauses), self.ARTICLES)
+        for clause in clauses[1:]:
+            text = clause.text_in(contract.raw_text)
+            self.assertIn(clause.number, text.split('\n', 1)[0])
+            self.assertIn(clause.heading, text)
+
+
+class PrescreenTests(SimpleTestCase):
+    def test_single_newline_text_flags_the_matching_lines(self):
+        # Extracted PDFs join lines and pages with a single newline and often have no headings
+        filler = 'The parties agree to cooperate in good faith on the matters described here.'
+        lines = [filler] * 90
+        lines[60] = 'The Supplier shall be liable for all losses suffered by the Customer.'
+        lines[75] = 'The Customer shall not directly or indirectly compete with the Supplier.'
+        text = '\n'.join(lines)
+        self.assertGreater(len(text), 6000)
+
+        flags = {flag['category']: flag for flag in prescreen_contract(text)['flags']}
+
+        liability = flags['Liability']
+        self.assertGreater(liability['start'], 0)
+        self.assertLess(liability['end'] - liability['start'], len(text) // 2)
+        self.assertIn('liable for all losses', liability['excerpt'])
+        self.assertIn('compete with the Supplier', flags['Non-compete']['excerpt'])
+
+        selected = select_priority_text(text, list(flags.values()), 3000)
+        self.assertLessEqual(len(selected), 3000)
+        self.assertIn(lines[60], selected)
+        self.assertIn(lines[75], selected)
+
+
+class PdfExtractionTests(SimpleTestCase):
+    PAGES = [f'Page {number} of the agreement' for number in range(1, 13)]
+
+    @override_settings(PDF_EXTRACTION_WORKERS=3, PDF_PARALLEL_MIN_PAGES=4)
+    def test_parallel_extraction_matches_serial_output_in_page_order(self):
+        pdf = _make_pdf(self.PAGES)
+        with mock.patch.object(services, '_extract_pdf_pages_parallel',
+                               wraps=services._extract_pdf_pages_parallel) as parallel:
+            text = extract_text_from_pdf(pdf)
+        self.assertEqual(parallel.call_count, 1)
+
+        with self.settings(PDF_EXTRACTION_WORKERS=1):
+            serial = extract_text_from_pdf(pdf)
+        self.assertEqual(text, serial)
+        self.assertEqual(text.split('\n'), self.PAGES)
+
+    @override_settings(PDF_EXTRACTION_WORKERS=1)
+    def test_failing_page_falls_back_to_pypdf2_for_that_page_only(self):
+        original_plumber = pdfplumber.page.Page.extract_text
+        original_pypdf2 = PageObject.extract_text
+
+        def plumber_extract(page, *args, **kwargs):
+            if page.page_number == 2:
+                raise ValueError('broken content stream')
+            return original_plumber(page, *args, **kwargs)
+
+        with mock.patch.object(pdfplumber.page.Page, 'extract_text', autospec=True, side_effect=plumber_extract), \
+                mock.patch.object(PageObject, 'extract_text', autospec=True, side_effect=original_pypdf2) as pypdf2:
+            text = extract_text_from_pdf(_make_pdf(self.PAGES[:3]))
+
+        self.assertEqual(text.split('\n'), self.PAGES[:3])
+        self.assertEqual(pypdf2.call_count, 1)
+
+    def test_page_budget_interrupts_a_slow_page(self):
+        started = time.monotonic()
+        with self.assertRaises(PageTimeout):
+            services._run_with_budget(lambda: time.sleep(5), 0.1)
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(services._run_with_budget(lambda: 'done', 0.1), 'done')
+
+
+@requires_fakeredis
+class ExtractionCacheTests(TestCase):
+    def setUp(self):
+        _use_fakeredis(self)
+        self.user = User.objects.create_user('owner', 'owner@example.com', 'password')
+        self.client.force_login(self.user)
+
+    @override_settings(EXTRACTION_CACHE_MAX_BYTES=250)
+    def test_eviction_drops_the_least_recently_used_entries(self):
+        cache.store_extraction('a' * 64, 'a' * 100)
+        cache.store_extraction('b' * 64, 'b' * 100)
+        earlier = timezone.now() - timedelta(minutes=5)
+        ExtractionCacheEntry.objects.filter(sha256='a' * 64).update(last_used_at=earlier)
+        ExtractionCacheEntry.objects.filter(sha256='b' * 64).update(last_used_at=earlier + timedelta(minutes=1))
+
+        # Reading "a" makes "b" the least recently used
+        self.assertEqual(cache.get_cached_extraction('a' * 64), 'a' * 100)
+        cache.store_extraction('c' * 64, 'c' * 100)
+
+        self.assertCountEqual(
+            ExtractionCacheEntry.objects.values_list('sha256', flat=True), ['a' * 64, 'c' * 64]
+        )
+        self.assertIsNone(cache.get_cached_extraction('b' * 64))
+        self.assertEqual(cache.cache_stats()['extraction'], {'hits': 1, 'misses': 1})
+
+    def test_upload_of_a_cached_file_skips_extraction(self):
+        content = b'This agreement is made between the parties named below. ' * 5
+        cached_text = content.decode().strip()
+        cache.store_extraction(cache.file_digest(content), cached_text)
+
+        with mock.patch('analyzer.views.dispatch_analysis', return_value='task-1') as dispatch, \
+                mock.patch('analyzer.services.extract_text_from_file') as extract:
+            response = self.client.post(reverse('analyze_document'), {
+                'contract_pdf': SimpleUploadedFile('agreement.txt', content, content_type='text/plain'),
+            })
+
+        self.assertEqual(response.json()['task_id'], 'task-1')
+        extract.assert_not_called()
+        contract = dispatch.call_args.args[0]
+        self.assertEqual(contract.raw_text, cached_text)
+        self.assertFalse(contract.source_file)
+
+    def test_odt_upload_explains_how_to_convert(self):
+        response = self.client.post(reverse('analyze_document'), {
+            'contract_pdf': SimpleUploadedFile('agreement.odt', b'PK\x03\x04'),
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Please save as .docx', response.json()['error'])
+
+
+@override_settings(HISTORY_PAGE_SIZE=2,
+                   STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class HistoryPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', 'owner@example.com', 'password')
+        self.client.force_login(self.user)
+        other = User.objects.create_user('other', 'other@example.com', 'password')
+        Contract.objects.create(user=other, filename='theirs.txt', summary='', analysis_json={})
+        self.contracts = [
+            Contract.objects.create(user=self.user, filename=f'{i}.txt', summary='', analysis_json={})
+            for i in range(5)
+        ]
+        # Uploaded in the same instant, e.g. by one ZIP batch: only the id orders them
+        same_instant = timezone.now() - timedelta(hours=1)
+        Contract.objects.filter(id__in=[c.id for c in self.contracts[1:4]]).update(created_at=same_instant)
+        Contract.objects.filter(id=self.contracts[0].id).update(created_at=same_instant - timedelta(hours=1))
+
+    def page(self, before=None):
+        response = self.client.get(reverse('history'), {'before': before} if before is not None else {})
+        self.assertEqual(response.status_code, 200)
+        return [c.filename for c in response.context['contracts']], response.context['next_cursor']
+
+    def test_pages_walk_every_contract_once_in_order(self):
+        filenames, cursor = self.page()
+        seen = list(filenames)
+        while cursor:
+            filenames, cursor = self.page(cursor)
+            seen.extend(filenames)
+        self.assertEqual(seen, ['4.txt', '3.txt', '2.txt', '1.txt', '0.txt'])
+
+    def test_last_page_has_no_next_cursor(self):
+        Contract.objects.filter(id__in=[c.id for c in self.contracts[2:]]).delete()
+        self.assertEqual(self.page(), (['1.txt', '0.txt'], None))
+
+    def test_malformed_cursor_falls_back_to_the_first_page(self):
+        first_page = self.page()
+        for before in ('garbage', '12-ab', '99999999999999999999999-1', '-'):
+            self.assertEqual(self.page(before)[0], first_page[0], before)
+
+
+
+
+class QueryPlanTests(TestCase):
+    """Each hot query's SQLite plan uses its index and needs no extra sort step."""
+    CURSOR = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+
+    def assertPlanUses(self, queryset, index):
+        plan = queryset.explain()
+        self.assertTrue(index in plan and 'USE TEMP B-TREE' not in plan, f"expected {index} without a sort:\n{plan}")
+
+    def history(self):
+        return Contract.objects.filter(user_id=1).only(*Contract.LIST_FIELDS).order_by('-created_at', '-id')
+
+    def test_dashboard_recent_contracts(self):
+        self.assertPlanUses(Contract.objects.filter(user_id=1).only(*Contract.LIST_FIELDS)[:5],
+                            'contract_user_created_idx')
+
+    def test_history_first_page(self):
+        self.assertPlanUses(self.history()[:51], 'contract_user_created_idx')
+
+    def test_history_later_page(self):
+        later = self.history().filter(Q(created_at__lt=self.CURSOR) | Q(created_at=self.CURSOR, id__lt=1))
+        self.assertPlanUses(later[:51], 'contract_user_created_idx')
+
+    def test_risks_by_severity(self):
+        self.assertPlanUses(Risk.objects.filter(contract_id=1, severity='High'), 'risk_contract_severity_idx')
+
+    def test_chat_conversation(self):
+        self.assertPlanUses(ChatMessage.objects.filter(contract_id=1).values('role', 'content', 'created_at'),
+                            'chat_msg_contract_created_idx')
+
+    def test_chat_history_window(self):
+        self.assertPlanUses(
+            ChatMessage.objects.filter(contract_id=1, id__gt=0).order_by('id').values('id', 'role', 'content'),
+            '(contract_id=? AND rowid>?)',
+        )
+
+    def test_login_by_email(self):
+        self.assertPlanUses(User.objects.filter(email__iexact='someone@example.com'), 'accounts_user_email_ci_idx')
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'password')
+        self.other = User.objects.create_user('other', 'other@example.com', 'password')
+
+    def contract(self, user, filename, text, risks=()):
+        contract = Contract.objects.create(
+            user=user, filename=filename, raw_text=text,
+            summary='', overall_risk_score=0, overall_risk_level='Low', analysis_json={},
+        )
+        analysis = _analysis()
+        analysis['risks'] = [{'title': title, 'severity': 'High', 'clause': clause} for title, clause in risks]
+        tasks.persist_analysis(contract, analysis)
+        return contract
+
+    def search_rows(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM {search.TABLE}")
+            fts = cursor.fetchone()[0]
+            cursor.execute(f"SELECT COUNT(*) FROM {search.ROWS_TABLE}")
+            return fts, cursor.fetchone()[0]
+
+    def test_title_matches_rank_above_passing_mentions(self):
+        passing = self.contract(self.owner, 'lease.txt', 'The tenant gives an indemnity for damage. ' + 'Rent is due monthly. ' * 30)
+        focused = self.contract(self.owner, 'services.txt', 'Services are provided as described. ' * 5,
+                                risks=[('Broad indemnity', 'The customer gives an indemnity for all claims.')])
+
+        hits = search.search(self.owner, 'indemnity')
+        self.assertEqual([(contract_id, kind) for contract_id, kind, _ in hits],
+                         [(focused.id, 'risk'), (passing.id, 'contract')])
+
+    def test_results_only_include_the_users_own_contracts(self):
+        own = self.contract(self.owner, 'mine.txt', 'Confidential information stays secret. ' * 5)
+        self.contract(self.other, 'theirs.txt', 'Confidential information stays secret. ' * 5)
+
+        self.assertEqual([hit[0] for hit in search.search(self.owner, 'confidential')], [own.id])
+
+    def test_excerpts_are_escaped_with_matches_marked(self):
+        self.contract(self.owner, 'notes.txt', 'Clause <script>alert(1)</script> covers termination & notice. ' * 3)
+
+        snippet = search.search(self.owner, 'termination')[0][2]
+        self.assertIn('&lt;script&gt;alert(1)&lt;/script&gt;', snippet)
+        self.assertIn('<mark>termination</mark> &amp; notice', snippet)
+        self.assertNotIn('<script>', snippet)
+
+    def test_chat_messages_are_searchable(self):
+        contract = self.contract(self.owner, 'mine.txt', 'Payment terms apply. ' * 5)
+        message = ChatMessage.objects.create(contract=contract, user=self.owner, role='user',
+                                             content='Can they audit our accounts?')
+        search.index_chat_message(message)
+
+        self.assertEqual(search.search(self.owner, 'audit')[0][:2], (contract.id, 'chat'))
+
+    def test_rows_go_with_the_contract_however_it_is_deleted(self):
+        kept = self.contract(self.other, 'theirs.txt', 'Warranty disclaimed. ' * 5)
+        deleted = self.contract(self.owner, 'mine.txt', 'Warranty disclaimed. ' * 5, risks=[('No warranty', '')])
+        message = ChatMessage.objects.create(contract=deleted, user=self.owner, role='user', content='warranty?')
+        search.index_chat_message(message)
+
+        Contract.objects.filter(id=deleted.id).delete()
+        self.assertEqual(search.search(self.owner, 'warranty'), [])
+        self.assertEqual(self.search_rows(), (1, 1))
+
+        self.other.delete()
+        self.assertEqual(self.search_rows(), (0, 0))
+        self.assertFalse(Contract.objects.filter(id=kept.id).exists())
+
+
+class PersistAnalysisTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('owner', 'owner@example.com', 'password')
+        self.contract = Contract.objects.create(
+            user=user, filename='agreement.txt', raw_text='The supplier shall deliver the goods. ' * 20,
+            summary='', overall_risk_score=0, overall_risk_level='Low', analysis_json={},
+        )
+        self.analysis = _analysis('High', 'Medium', 'Low')
+        self.analysis['missing_protections'] = [{'title': 'Liability cap', 'importance': 'High'}]
+        self.analysis['positive_clauses'] = [{'title': 'Mutual confidentiality'}]
+
+    def snapshot(self):
+        contract = Contract.objects.get(id=self.contract.id)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT kind, COUNT(*) FROM analyzer_search_row WHERE contract_id = %s GROUP BY kind",
+                           [contract.id])
+            search_rows = sorted(cursor.fetchall())
+        return {
+            'risks': sorted(contract.risks.values_list('risk_id', 'title', 'severity')),
+            'missing': list(contract.missing_protections.values_list('title', 'importance')),
+            'positive': list(contract.positive_clauses.values_list('title', flat=True)),
+            'counts': {field: getattr(contract, field) for field in Contract.RISK_COUNT_FIELDS.values()},
+            'portfolio': sorted(PortfolioStat.objects.values_list('dimension', 'key', 'count')),
+            'search': search_rows,
+        }
+
+    def test_persisting_twice_leaves_the_same_rows(self):
+        tasks.persist_analysis(self.contract, self.analysis)
+        first = self.snapshot()
+        tasks.persist_analysis(Contract.objects.get(id=self.contract.id), self.analysis)
+
+        self.assertEqual(self.snapshot(), first)
+        self.assertEqual(Risk.objects.count(), 3)
+        self.assertEqual(first['counts'], {'critical_risks': 0, 'high_risks': 1, 'medium_risks': 1, 'low_risks': 1})
+
+    def counters_match_rows(self):
+        contract = Contract.objects.get(id=self.contract.id)
+        rows = Counter(contract.risks.values_list('severity', flat=True))
+        for severity, field in Contract.RISK_COUNT_FIELDS.items():
+            self.assertEqual(getattr(contract, field), rows.get(severity, 0), severity)
+        return sum(rows.values())
+
+    @requires_fakeredis
+    def test_risk_counters_match_the_rows_through_a_streamed_analysis(self):
+        _use_fakeredis(self)
+        # Provisional risks left by an interrupted earlier attempt
+        Risk.objects.create(contract=self.contract, title='Stale', severity='Critical')
+        self.contract.recount_risks()
+        stored = []
+
+        def stream(text, on_risks, on_progress, clause_starts):
+            stored.append(self.counters_match_rows())
+            on_risks([{'title': 'Indemnity', 'severity': 'High'}])
+            stored.append(self.counters_match_rows())
+            on_risks([{'title': 'Notice', 'severity': 'Low'}, {'title': 'Venue', 'severity': 'Low'}])
+            stored.append(self.counters_match_rows())
+            return self.analysis
+
+        with mock.patch.object(tasks, 'analyze_contract', side_effect=stream), \
+                mock.patch.object(tasks.analyze_contract_task, 'update_state'):
+            tasks.analyze_contract_task.apply((self.contract.id,))
+
+        self.assertEqual(stored, [0, 1, 3])
+        self.assertEqual(self.counters_match_rows(), 3)
+
+
+@requires_fakeredis
+@override_settings(ANALYSIS_POLL_TIMEOUT=1200, LLM_RATE_LIMIT_MAX_WAIT=300, LLM_TIMEOUT=90)
+class AnalysisRetryTests(TestCase):
+    def setUp(self):
+        _use_fakeredis(self)
+        user = User.objects.create_user('owner', 'owner@example.com', 'password')
+        self.contract = Contract.objects.create(
+            user=user, filename='agreement.txt', raw_text='The supplier shall deliver the goods. ' * 20,
+            summary='', overall_risk_score=0, overall_risk_level='Low', analysis_json={},
+        )
+        for patcher in (
+            mock.patch.object(tasks, 'analyze_contract', side_effect=ratelimit.RateLimitTimeout('busy')),
+            mock.patch.object(tasks.analyze_contract_task, 'update_state'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def run_task(self, retries=0):
+        with mock.patch.object(tasks.analyze_contract_task, 'retry', side_effect=Retry()) as retry:
+            result = tasks.analyze_contract_task.apply((self.contract.id,), retries=retries)
+        return result, retry
+
+    def test_rate_limited_analysis_is_retried_with_a_growing_countdown(self):
+        _, retry = self.run_task(retries=1)
+        self.assertEqual(retry.call_args.kwargs['countdown'], 120)
+
+    def test_retry_that_would_outlast_the_poll_window_fails_the_analysis_instead(self):
+        Contract.objects.filter(id=self.contract.id).update(created_at=timezone.now() - timedelta(seconds=700))
+        result, retry = self.run_task(retries=1)
+
+        retry.assert_not_called()
+        self.assertFalse(result.get()['success'])
+        self.contract.refresh_from_db()
+        self.assertIn('busy', self.contract.analysis_json['error'])
+
+    def test_gives_up_after_the_last_retry(self):
+        result, retry = self.run_task(retries=tasks.analyze_contract_task.max_retries)
+        retry.assert_not_called()
+        self.assertFalse(result.get()['success'])
+
+    def test_status_tells_the_page_how_long_to_poll(self):
+        self.client.force_login(self.contract.user)
+        with mock.patch('analyzer.views.AsyncResult') as async_result:
+            async_result.return_value.failed.return_value = False
+            async_result.return_value.ready.return_value = False
+            async_result.return_value.info = {'step': 'waiting'}
+            response = self.client.get(reverse('task_status', args=['task-1']))
+        self.assertEqual(response.json()['poll_timeout'], 1200)
+
+
+@requires_fakeredis
+class SingleFlightTests(TestCase):
+    FLIGHT = 'analysis:inflight:test'
+
+    def setUp(self):
+        self.redis = _use_fakeredis(self)
+
+    def test_first_task_leads_and_later_ones_wait(self):
+        self.assertTrue(singleflight.join(self.FLIGHT, 'leader', {'task_id': 'leader'}))
+        self.assertFalse(singleflight.join(self.FLIGHT, 'waiter-1', {'task_id': 'waiter-1'}))
+        self.assertFalse(singleflight.join(self.FLIGHT, 'waiter-2', {'task_id': 'waiter-2'}))
+        # A redelivered leader keeps its lock
+        self.assertTrue(singleflight.join(self.FLIGHT, 'leader', {'task_id': 'leader'}))
+        self.assertLessEqual(self.redis.ttl(self.FLIGHT), settings.ANALYSIS_SINGLEFLIGHT_TTL)
+
+        waiters = singleflight.leave(self.FLIGHT, 'leader')
+        self.assertEqual([w['task_id'] for w in waiters], ['waiter-1', 'waiter-2'])
+        self.assertFalse(self.redis.exists(self.FLIGHT, f'{self.FLIGHT}:waiters'))
+        self.assertTrue(singleflight.join(self.FLIGHT, 'next', {'task_id': 'next'}))
+
+    def test_task_that_may_not_wait_is_not_queued(self):
+        singleflight.join(self.FLIGHT, 'leader', {'task_id': 'leader'})
+        self.assertFalse(singleflight.join(self.FLIGHT, 'member', {'task_id': 'member'}, wait=False))
+        self.assertEqual(singleflight.leave(self.FLIGHT, 'leader'), [])
+
+    def test_leave_by_a_task_that_lost_the_lock_keeps_the_new_holder(self):
+        singleflight.join(self.FLIGHT, 'leader', {'task_id': 'leader'})
+        self.redis.delete(self.FLIGHT)  # the lock expired
+        singleflight.join(self.FLIGHT, 'successor', {'task_id': 'successor'})
+
+        singleflight.leave(self.FLIGHT, 'leader')
+        self.assertEqual(self.redis.get(self.FLIGHT), b'successor')
+
+
+@requires_fakeredis
+class SingleFlightTaskTests(TestCase):
+    def setUp(self):
+        _use_fakeredis(self)
+        user = User.objects.create_user('owner', 'owner@example.com', 'password')
+        self.contract = Contract.objects.create(
+            user=user, filename='agreement.txt', raw_text='The supplier shall deliver the goods. ' * 20,
+            summary='', overall_risk_score=0, overall_risk_level='Low', analysis_json={},
+        )
+        self.flight = singleflight.flight_key(cache.analysis_text_hash(self.contract.raw_text),
+                                              services.get_analysis_model())
+        for patcher in (
+            mock.patch.object(tasks, 'analyze_contract', return_value=_analysis('High')),
+            mock.patch.object(tasks.analyze_contract_task, 'update_state'),
+            mock.patch.object(tasks.analyze_contract_task, 'apply_async'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_waiter_schedules_its_fallback_inside_the_poll_window(self):
+        singleflight.join(self.flight, 'leader', {'task_id': 'leader'})
+        result = tasks.analyze_contract_task.apply((self.contract.id,), task_id='waiter')
+
+        self.assertIsInstance(result.result, Ignore)
+        tasks.analyze_contract.assert_not_called()
+        options = tasks.analyze_contract_task.apply_async.call_args.kwargs
+        self.assertEqual(options['task_id'], 'waiter')
+        self.assertEqual(tasks.analyze_contract_task.apply_async.call_args.args[1], {'fallback': True})
+        self.assertLess(options['countdown'], settings.ANALYSIS_POLL_TIMEOUT - settings.LLM_RATE_LIMIT_MAX_WAIT)
+
+    def test_leader_releases_its_waiters_under_their_own_ids(self):
+        def analyze_while_a_duplicate_arrives(*args, **kwargs):
+            self.assertFalse(singleflight.join(self.flight, 'waiter', {'contract_id': 7, 'task_id': 'waiter'}))
+            return _analysis('High')
+
+        tasks.analyze_contract.side_effect = analyze_while_a_duplicate_arrives
+        result = tasks.analyze_contract_task.apply((self.contract.id,), task_id='leader')
+
+        self.assertTrue(result.get()['success'])
+        tasks.analyze_contract_task.apply_async.assert_called_once_with((7,), task_id='waiter')
+        self.assertTrue(singleflight.join(self.flight, 'next', {}))
+
+    def test_fallback_reuses_the_result_the_leader_saved(self):
+        tasks.persist_analysis(self.contract, _analysis('Low'))
+        result = tasks.analyze_contract_task.apply((self.contract.id,), {'fallback': True})
+
+        self.assertTrue(result.get()['success'])
+        tasks.analyze_contract.assert_not_called()
+
+
+@requires_fakeredis
+class ZipBatchTests(TestCase):
+    CONTRACT = 'This services agreement is made between Acme Ltd and Beta LLC for the supply of software. ' * 5
+
+    def setUp(self):
+        self.redis = _use_fakeredis(self)
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=media)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        for patcher in (
+            mock.patch.object(batch, 'MAX_ENTRY_BYTES', 4096),
+            mock.patch.object(tasks, 'analyze_contract', side_effect=[_analysis('High', 'Low'), _analysis('Low')]),
+            mock.patch.object(tasks, 'chord'),
+            mock.patch.object(tasks.extract_contract_text_task, 'update_state'),
+            mock.patch.object(tasks.analyze_contract_task, 'update_state'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user('owner', 'owner@example.com', 'password')
+        self.client.force_login(self.user)
+
+    def upload(self, entries):
+        return self.client.post(reverse('analyze_batch'), {
+            'contract_zip': SimpleUploadedFile('contracts.zip', _zip(entries), content_type='application/zip'),
+        })
+
+    def dispatched_chord(self):
+        (header, body), _ = tasks.chord.call_args
+        return header, body
+
+    def test_unusable_entries_are_skipped_with_a_reason(self):
+        response = self.upload({
+            'supply.txt': self.CONTRACT,
+            'licence.txt': self.CONTRACT.replace('software', 'hardware'),
+            'notes.xyz': 'not a contract',
+            'scan.pdf': b'%PDF' + b'0' * 8192,
+            'empty.txt': '',
+            '__MACOSX/._supply.txt': 'resource fork',
+            'drafts/.DS_Store': 'finder',
+        })
+
+        data = response.json()
+        self.assertEqual(data['total'], 2)
+        self.assertCountEqual(data['skipped'], [
+            {'filename': 'notes.xyz', 'reason': 'unsupported file type'},
+            {'filename': 'scan.pdf', 'reason': 'file too large'},
+            {'filename': 'empty.txt', 'reason': 'empty file'},
+        ])
+        self.assertCountEqual(
+            Contract.objects.values_list('filename', flat=True), ['supply.txt', 'licence.txt']
+        )
+
+    def test_archive_without_supported_documents_is_rejected(self):
+        response = self.upload({'notes.xyz': 'not a contract', '__MACOSX/._a.txt': 'x'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Batch.objects.exists())
+
+    def test_identical_files_in_a_batch_never_wait_on_each_other(self):
+        text = services.extract_text_from_file(self.CONTRACT.encode(), 'supply.txt')
+        flight = singleflight.flight_key(cache.analysis_text_hash(text), services.get_analysis_model())
+        # Another analysis of the same text is in flight, e.g. a single upload
+        self.assertTrue(singleflight.join(flight, 'elsewhere', {'task_id': 'elsewhere'}))
+        self.upload({'supply.txt': self.CONTRACT, 'copy/supply.txt': self.CONTRACT})
+
+        with mock.patch.object(tasks.analyze_contract_task, 'apply_async') as requeue:
+            result = _run_chord(*self.dispatched_chord())
+
+        # Chord members analyze without the lock instead of ending in Ignore
+        requeue.assert_not_called()
+        self.assertEqual(self.redis.llen(f'{flight}:waiters'), 0)
+        self.assertEqual(tasks.analyze_contract.call_count, 1)
+        self.assertEqual(Batch.objects.get().report['analyzed'], 2)
+        self.assertTrue(result['success'])
+
+    def test_chord_callback_writes_the_batch_report(self):
+        self.upload({
+            'supply.txt': self.CONTRACT,
+            'licence.txt': self.CONTRACT.replace('software', 'hardware'),
+        })
+
+        result = _run_chord(*self.dispatched_chord())
+
+        self.assertTrue(result['success'])
+        batch_row = Batch.objects.get()
+        self.assertEqual(batch_row.status, 'completed')
+        self.assertEqual((batch_row.report['analyzed'], batch_row.report['failed']), (2, 0))
+        self.assertEqual(batch_row.report['risk_severities'], {'Critical': 0, 'High': 1, 'Medium': 0, 'Low': 2})
+        self.assertEqual(batch_row.report['risk_levels']['High'], 1)
+        status = self.client.get(reverse('batch_status', args=[batch_row.id])).json()
+        self.assertEqual((status['finished'], status['failed']), (2, 0))
+
+
+@requires_fakeredis
+class OfflineBatchTests(TestCase):
+    """Submit, poll and persist against the local API stub, as a deployment with AI_BASE_URL would."""
+
+    def setUp(self):
+        redis = _use_fakeredis(self)
+        server = ThreadingHTTPServer(('127.0.0.1', 0), llm_stub.StubHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        base_url = 'http://%s:%s' % server.server_address[:2]
+
+        stub_settings = override_settings(AI_BASE_URL=base_url, AI_API_KEY='test-key')
+        stub_settings.enable()
+        self.addCleanup(stub_settings.disable)
+        llm_stub._batches.clear()
+        for patcher in (
+            mock.patch.object(llm, '_client', None),
+            mock.patch.object(llm, '_get_redis', return_value=(redis, redis.register_script(llm.RECORD_SCRIPT))),
+            mock.patch.object(llm_stub, 'BATCH_DELAY', 0),
+            mock.patch.object(tasks.finalize_batch_task, 'delay',
+                              side_effect=lambda batch_id: tasks.finalize_batch_task.apply((batch_id,))),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        user = User.objects.create_user('owner', 'owner@example.com', 'password')
+        self.batch = Batch.objects.create(user=user, filename='contracts.zip', total=2)
+        self.contracts = []
+        for name in ('supply', 'licence'):
+            contract = Contract.objects.create(
+                user=user, batch=self.batch, analysis_mode='offline', filename=f'{name}.txt',
+                raw_text=f'This {name} agreement is made between Acme Ltd and Beta LLC. ' * 10,
+                summary='', overall_risk_score=0, overall_risk_level='Low', analysis_json={},
+            )
+            tasks.prepare_contract(contract)
+            self.contracts.append(contract)
+
+    def test_submitted_batch_is_collected_and_the_zip_batch_finalized(self):
+        self.assertEqual(tasks.submit_message_batches_task()['submitted'], 2)
+        message_batch = MessageBatch.objects.get()
+        self.assertTrue(message_batch.batch_id.startswith('msgbatch_stub_'))
+        self.assertEqual(message_batch.contracts.count(), 2)
+
+        self.assertEqual(tasks.poll_message_batches_task()['collected'], 1)
+
+        message_batch.refresh_from_db()
+        self.assertEqual((message_batch.status, message_batch.errored), ('processed', 0))
+        for contract in self.contracts:
+            contract.refresh_from_db()
+            self.assertEqual(contract.overall_risk_score, 42)
+            self.assertEqual(list(contract.risks.values_list('severity', flat=True)), ['High'])
+        self.batch.refresh_from_db()
+        self.assertEqual(self.batch.status, 'completed')
+        self.assertEqual(self.batch.report['analyzed'], 2)
+
+    def test_errored_and_expired_requests_fail_their_contracts(self):
+        def failing_results(batch):
+            for request, outcome in zip(batch['requests'], ('errored', 'expired')):
+                result = {'type': outcome}
+                if outcome == 'errored':
+                    result['error'] = {'type': 'error', 'error': {'type': 'overloaded_error', 'message': 'Overloaded'}}
+                yield json.dumps({'custom_id': request['custom_id'], 'result': result})
+
+        tasks.submit_message_batches_task()
+        with mock.patch.object(llm_stub, 'batch_results', failing_results):
+            tasks.poll_message_batches_task()
+
+        errors = sorted(Contract.objects.values_list('document__analysis_json__error', flat=True))
+        self.assertEqual(errors, ['Analysis failed: Batch request expired', 'Analysis failed: Overloaded'])
+        self.batch.refresh_from_db()
+        self.assertEqual((self.batch.status, self.batch.report['failed']), ('completed', 2))
+
+    def test_claims_of_a_submission_that_never_saved_its_id_are_released(self):
+        abandoned = MessageBatch.objects.create(model='m')
+        Contract.objects.update(message_batch=abandoned)
+        MessageBatch.objects.filter(id=abandoned.id).update(created_at=timezone.now() - timedelta(hours=2))
+
+        self.assertEqual(tasks.submit_message_batches_task()['submitted'], 2)
+        self.assertFalse(MessageBatch.objects.filter(id=abandoned.id).exists())
+        self.assertEqual(MessageBatch.objects.get().contracts.count(), 2)
+
+    def test_recent_unsubmitted_claims_are_left_alone(self):
+        in_flight = MessageBatch.objects.create(model='m')
+        Contract.objects.update(message_batch=in_flight)
+
+        self.assertEqual(tasks.submit_message_batches_task()['submitted'], 0)
+        self.assertEqual(in_flight.contracts.count(), 2)
+
+
+class PortfolioCounterTests(TestCase):
+    """The incremental counters always equal a full rebuild from the stored analyses."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner', 'owner@example.com', 'password')
+        self.client.force_login(self.user)
+        self.contracts = [
+            Contract.objects.create(user=self.user, filename=f'{i}.txt', raw_text='Agreement text. ' * 10,
+                                    summary='', overall_risk_score=0, overall_risk_level='Low', analysis_json={})
+            for i in range(2)
+        ]
+        for contract in self.contracts:
+            tasks.persist_analysis(contract, _analysis('High', 'Low'))
+
+    def counters(self):
+        return (
+            sorted(PortfolioStat.objects.values_list('user_id', 'dimension', 'key', 'count', 'total')),
+            sorted(Contract.objects.values_list('id', 'portfolio_counts')),
+        )
+
+    def assertMatchesRebuild(self):
+        incremental = self.counters()
+        with write_transaction():
+            portfolio.rebuild()
+        self.assertEqual(incremental, self.counters())
+
+    def test_after_persist(self):
+        self.assertMatchesRebuild()
+        self.assertEqual(portfolio.dashboard(self.user)['contracts'], 2)
+
+    def test_after_reanalysis(self):
+        tasks.persist_analysis(Contract.objects.get(id=self.contracts[0].id), _analysis('Critical', 'Medium', 'Low'))
+        self.assertMatchesRebuild()
+
+    def test_after_a_risk_status_change(self):
+        risk = self.contracts[0].risks.get(severity='High')
+        response = self.client.post(reverse('update_risk', args=[risk.id]), json.dumps({'status': 'accepted'}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertMatchesRebuild()
+        self.assertIn(('accepted', 1), portfolio.dashboard(self.user)['statuses'])
+
+    def test_after_delete(self):
+        self.client.post(reverse('delete_contract', args=[self.contracts[0].id]))
+        self.assertMatchesRebuild()
+        self.assertEqual(portfolio.dashboard(self.user)['contracts'], 1)
+
+    def test_after_a_failed_reanalysis(self):
+        tasks._mark_failed(self.contracts[1].id, 'The AI service is busy.')
+        self.assertMatchesRebuild()
+        self.assertEqual(portfolio.dashboard(self.user)['contracts'], 1)
@@ -6,11 +6,15 @@ urlpatterns = [
     path("", views.landing, name="landing"),
     path("dashboard/", views.index, name="index"),
     path("history/", views.history, name="history"),
+    path("search/", views.search_contracts, name="search"),
     path("results/<int:contract_id>/", views.results, name="results"),
 
     path("analyze-document/", views.analyze_document, name="analyze_document"),
     path("analyze-text/", views.analyze_text, name="analyze_text"),
+    path("analyze-batch/", views.analyze_batch, name="analyze_batch"),
+    path("batch/<int:batch_id>/status/", views.batch_status, name="batch_status"),
     path("task-status/<str:task_id>/", views.task_status, name="task_status"),
+    path("llm-stats/", views.llm_stats, name="llm_stats"),
 
     path("risk/<int:risk_id>/update/", views.update_risk, name="update_risk"),
     path("contract/<int:contract_id>/delete/", views.delete_contract, name="delete_contract"),
@@ -1,13 +1,25 @@
 import json
 import logging
+import os
+import zipfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db.models import Q
+from django.http import Http404, JsonResponse
 from django.views.decorators.http import require_POST
-from .models import Contract, Risk
-from .services import extract_text_from_file, extract_text_from_pdf, analyze_contract
-from .tasks import analyze_contract_task
+from django.utils import timezone
+from .models import Batch, Contract, Risk
+from .services import SUPPORTED_EXTENSIONS, UNSUPPORTED_FORMAT_MESSAGES
+from .tasks import dispatch_analysis, dispatch_batch, prepare_contract
+from .batch import create_batch
+from . import portfolio, search
+from .cache import analysis_text_hash, file_digest, get_cached_extraction
 from celery.result import AsyncResult
+from clauseguard import llm
+from clauseguard.sqlite import write_transaction
 from analyzer.models import Risk
 
 logger = logging.getLogger(__name__)
@@ -21,13 +33,56 @@ def landing(request):
 # Protected views (login required)
 @login_required
 def index(request):
-    recent = Contract.objects.filter(user=request.user)[:5]
-    return render(request, 'analyzer/index.html', {'recent': recent})
+    recent = Contract.objects.filter(user=request.user).only(*Contract.LIST_FIELDS)[:5]
+    return render(request, 'analyzer/index.html', {
+        'recent': recent,
+        'portfolio': portfolio.dashboard(request.user),
+    })
+
+def _parse_cursor(cursor):
+    """Decode a history cursor ("<created_at in microseconds>-<id>"), or None if malformed."""
+    try:
+        micros, contract_id = cursor.split('-')
+        created_at = datetime.fromtimestamp(int(micros) / 1_000_000, tz=dt_timezone.utc)
+        return created_at, int(contract_id)
+    except (ValueError, OverflowError, OSError):
+        return None
+
+
+def _cursor_for(contract):
+    micros = int(contract.created_at.timestamp()) * 1_000_000 + contract.created_at.microsecond
+    return f"{micros}-{contract.id}"
+
 
 @login_required
 def history(request):
-    contracts = Contract.objects.filter(user=request.user)
-    return render(request, 'analyzer/history.html', {'contracts': contracts})
+    """
+    One page of the user's contracts, newest first. Pages are keyed on
+    (created_at, id) rather than an offset, so a page costs the same however
+    far back it is, and rows added meanwhile do not shift later pages.
+    """
+    contracts = (
+        Contract.objects.filter(user=request.user)
+        .only(*Contract.LIST_FIELDS)
+        .order_by('-created_at', '-id')
+    )
+    cursor = _parse_cursor(request.GET.get('before', ''))
+    if cursor is not None:
+        created_at, contract_id = cursor
+        contracts = contracts.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=contract_id)
+        )
+
+    page = list(contracts[:settings.HISTORY_PAGE_SIZE + 1])
+    next_cursor = None
+    if len(page) > settings.HISTORY_PAGE_SIZE:
+        page = page[:settings.HISTORY_PAGE_SIZE]
+        next_cursor = _cursor_for(page[-1])
+    return render(request, 'analyzer/history.html', {
+        'contracts': page,
+        'next_cursor': next_cursor,
+        'paged': cursor is not None,
+    })
 
 @login_required
 def results(request, contract_id):
@@ -36,10 +91,12 @@ def results(request, contract_id):
     return render(request, 'analyzer/results.html', {
         'contract': contract,
         'risks': contract.risks.all(),
-        'missing_protections': analysis.get('missing_protections', []),
-        'positive_clauses': analysis.get('positive_clauses', []),
+        'missing_protections': contract.missing_protections.all(),
+        'positive_clauses': contract.positive_clauses.all(),
         'quick_stats': analysis.get('quick_stats', {}),
         'party_info': analysis.get('party_info', {}),
+        'prescreen_flags': contract.prescreen.get('flags', [])[:20],
+        'analysis_pending': not analysis,
     })
 
 @login_required
@@ -52,21 +109,99 @@ def analyze_document(request):
     if uploaded.size > 10 * 1024 * 1024:
         return JsonResponse({'error': 'File too large. Max 10MB.'}, status=400)
 
+    ext = os.path.splitext(uploaded.name)[1].lower()
+    if ext not in SUPPORTED_EXTENSIONS:
+        logger.error(f"Unsupported file type: {ext}")
+        return JsonResponse(
+            {'error': UNSUPPORTED_FORMAT_MESSAGES.get(ext) or f'Unsupported file type: {ext}'}, status=400
+        )
+
+    # Re-uploads of a known file skip the parsers entirely
+    cached_text = get_cached_extraction(file_digest(uploaded))
+    if cached_text is not None:
+        return _run_analysis(request, cached_text, uploaded.name)
+
+    # Persist the upload and hand extraction to the Celery pipeline
     try:
-        # Use your extract_text_from_file function that handles multiple types
-        text = extract_text_from_file(uploaded, uploaded.name)
-    except ValueError as e:
-        # Handle unsupported file types
-        logger.error(f"Unsupported file type: {str(e)}")
-        return JsonResponse({'error': str(e)}, status=400)
+        contract = Contract.objects.create(
+            user=request.user,
+            filename=uploaded.name,
+            source_file=uploaded,
+            summary='',
+            overall_risk_score=0,
+            overall_risk_level='Low',
+            analysis_json={}
+        )
+        task_id = dispatch_analysis(contract)
+
+        return JsonResponse({
+            'success': True,
+            'task_id': task_id,
+            'message': 'Analysis started'
+        })
+
     except Exception as e:
-        logger.error(f"Text extraction failed: {str(e)}", exc_info=True)
-        return JsonResponse({'error': f'Could not read file: {e}'}, status=422)
+        logger.error(f"Failed to start analysis: {str(e)}", exc_info=True)
+        return JsonResponse({
+            'success': False,
+            'error': f'Failed to start analysis: {str(e)}'
+        }, status=500)
 
-    if len(text.strip()) < 100:
-        return JsonResponse({'error': 'File has no readable text.'}, status=422)
+@login_required
+@require_POST
+def analyze_batch(request):
+    """
+    Analyze every document in a ZIP archive; poll batch_status for the report.
+    With mode=offline the analyses go through the Message Batches API, which is
+    cheaper but can take hours.
+    """
+    uploaded = request.FILES.get("contract_zip")
+    offline = request.POST.get("mode") == "offline"
+    if not uploaded:
+        return _json_error("No file uploaded. Field must be contract_zip.", 400)
+
+    if uploaded.size > settings.BATCH_MAX_UPLOAD_BYTES:
+        return _json_error(f"Archive too large. Max {settings.BATCH_MAX_UPLOAD_BYTES // (1024 * 1024)}MB.", 400)
+
+    try:
+        batch, contracts = create_batch(request.user, uploaded, analysis_mode='offline' if offline else 'interactive')
+    except (zipfile.BadZipFile, ValueError) as e:
+        return _json_error(str(e) if isinstance(e, ValueError) else "File is not a valid ZIP archive.", 400)
+
+    try:
+        dispatch_batch(batch, contracts, offline=offline)
+    except Exception as e:
+        logger.error(f"Failed to start batch {batch.id}: {str(e)}", exc_info=True)
+        batch.status = 'failed'
+        batch.save(update_fields=['status'])
+        return _json_error(f'Failed to start analysis: {str(e)}', 500)
 
-    return _run_analysis(request, text, uploaded.name)
+    return JsonResponse({
+        'success': True,
+        'batch_id': batch.id,
+        'total': batch.total,
+        'skipped': batch.skipped,
+        'mode': 'offline' if offline else 'interactive',
+        'message': 'Batch analysis started'
+    })
+
+@login_required
+def batch_status(request, batch_id):
+    """Progress of a ZIP batch, and its aggregated report once complete."""
+    batch = get_object_or_404(Batch, id=batch_id, user=request.user)
+    contracts = batch.contracts.all()
+    finished = contracts.exclude(document__analysis_json={})
+    return JsonResponse({
+        'batch_id': batch.id,
+        'filename': batch.filename,
+        'status': batch.status,
+        'total': batch.total,
+        'finished': finished.count(),
+        'failed': finished.filter(document__analysis_json__has_key='error').count(),
+        'skipped': batch.skipped,
+        'contracts': list(contracts.values('id', 'filename', 'overall_risk_score', 'overall_risk_level')),
+        'report': batch.report,
+    })
 
 @login_required
 @require_POST
@@ -89,13 +224,22 @@ def analyze_text(request):
 @login_required
 @require_POST
 def update_risk(request, risk_id):
-    risk = get_object_or_404(Risk, id=risk_id, contract__user=request.user)
     try:
         body = json.loads(request.body)
-        risk.status = body.get('status', risk.status)
-        risk.user_note = body.get('note', risk.user_note)
-        risk.save()
+        if body.get('status', 'pending') not in dict(Risk.STATUS_CHOICES):
+            return JsonResponse({'error': 'Unknown status'}, status=400)
+        with write_transaction():
+            risk = get_object_or_404(Risk.objects.select_related('contract'), id=risk_id, contract__user=request.user)
+            old_status = risk.status
+            risk.status = body.get('status', risk.status)
+            risk.user_note = body.get('note', risk.user_note)
+            risk.save()
+            if risk.status != old_status:
+                portfolio.change_risk_status(risk.contract, old_status, risk.status)
+                risk.contract.save(update_fields=['portfolio_counts'])
         return JsonResponse({'success': True})
+    except Http404:
+        raise
     except Exception as e:
         logger.error(f"Failed to update risk {risk_id}: {str(e)}", exc_info=True)
         return JsonResponse({'error': str(e)}, status=400)
@@ -103,16 +247,60 @@ def update_risk(request, risk_id):
 @login_required
 @require_POST
 def delete_contract(request, contract_id):
-    contract = get_object_or_404(Contract, id=contract_id, user=request.user)
-    contract.delete()
+    with write_transaction():
+        contract = get_object_or_404(Contract, id=contract_id, user=request.user)
+        portfolio.forget(contract)
+        # Its search rows go in the same transaction, see analyzer.signals
+        contract.delete()
     return JsonResponse({'success': True})
 
+@login_required
+def search_contracts(request):
+    """Ranked full-text search over the user's contracts, risks and chat, one page at a time."""
+    query = request.GET.get('q', '').strip()
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    size = settings.SEARCH_PAGE_SIZE
+    if not query:
+        return JsonResponse({'query': query, 'page': page, 'results': [], 'has_next': False})
+
+    # One extra hit tells us whether there is a next page
+    hits = search.search(request.user, query, offset=(page - 1) * size, limit=size + 1)
+    has_next = len(hits) > size
+    hits = hits[:size]
+    contracts = (
+        Contract.objects.filter(user=request.user, id__in=[contract_id for contract_id, _, _ in hits])
+        .only(*Contract.LIST_FIELDS)
+        .in_bulk()
+    )
+    results = [
+        {
+            'contract_id': contract_id,
+            'filename': contracts[contract_id].filename,
+            'overall_risk_level': contracts[contract_id].overall_risk_level,
+            'overall_risk_score': contracts[contract_id].overall_risk_score,
+            'created_at': contracts[contract_id].created_at,
+            'matched_in': kind,
+            'snippet': snippet,
+        }
+        for contract_id, kind, snippet in hits
+        if contract_id in contracts
+    ]
+    return JsonResponse({'query': query, 'page': page, 'results': results, 'has_next': has_next})
+
 @login_required
 def task_status(request, task_id):
     """Check the status of a Celery task"""
     task = AsyncResult(task_id)
     
-    if task.ready():
+    if task.failed():
+        return JsonResponse({
+            'status': 'FAILURE',
+            'error': str(task.result) or 'Unknown error'
+        })
+    elif task.ready():
         result = task.result
         if result and result.get('success'):
             return JsonResponse({
@@ -125,15 +313,45 @@ def task_status(request, task_id):
                 'error': result.get('error') if result else 'Unknown error'
             })
     else:
-        meta = task.info or {}
+        # RETRY states carry the exception rather than progress metadata
+        meta = task.info if isinstance(task.info, dict) else {}
         return JsonResponse({
             'status': 'PROGRESS',
+            'step': meta.get('step', ''),
             'progress': meta.get('progress', 0),
-            'message': meta.get('message', 'Processing...')
+            'risks_found': meta.get('risks_found', 0),
+            'message': meta.get('message', 'Processing...'),
+            # The task gives up on retries before this, so the page never stops polling a live task
+            'poll_timeout': settings.ANALYSIS_POLL_TIMEOUT,
         })
     
+@staff_member_required
+def llm_stats(request):
+    """Per-call-site LLM latency and token usage across the web and worker processes."""
+    return JsonResponse({'stats': llm.get_stats()})
+
 def _run_analysis(request, text, filename):
     """Helper function to handle both file and text analysis"""
+    # A double-click or resubmission of text still being analyzed attaches to that run
+    duplicate = (
+        Contract.objects
+        .filter(
+            user=request.user,
+            content_hash=analysis_text_hash(text),
+            document__analysis_json={},
+            created_at__gte=timezone.now() - timedelta(seconds=settings.ANALYSIS_DUPLICATE_WINDOW),
+        )
+        .exclude(analysis_task_id='')
+        .first()
+    )
+    if duplicate is not None:
+        logger.info(f"Attaching duplicate submission to contract {duplicate.id}")
+        return JsonResponse({
+            'success': True,
+            'task_id': duplicate.analysis_task_id,
+            'message': 'Analysis started'
+        })
+
     try:
         # Create contract record with correct field names
         contract = Contract.objects.create(
@@ -147,14 +365,15 @@ def _run_analysis(request, text, filename):
             overall_risk_level='Low',
             analysis_json={}
         )
+        prepare_contract(contract)
         
         # Start Celery task for analysis
-        task = analyze_contract_task.delay(contract.id)
+        task_id = dispatch_analysis(contract)
         
         # Return task ID for polling
         return JsonResponse({
             'success': True,
-            'task_id': task.id,
+            'task_id': task_id,
             'message': 'Analysis started'
         })
         
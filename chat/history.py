@@ -0,0 +1,47 @@
+# chat/history.py
+"""
+Chat history window.
+Only the last CHAT_HISTORY_TURNS turns are sent verbatim, trimmed to a token
+budget. Older turns are folded into the contract's rolling chat_summary by
+summarize_chat_task, a few turns at a time, so nothing is summarised twice.
+Until a fold has landed, the turns it covers are still sent verbatim.
+"""
+from django.conf import settings
+
+CHARS_PER_TOKEN = 4  # same rough estimate as llm.estimate_tokens
+
+
+def _tokens(message):
+    return len(message['content']) // CHARS_PER_TOKEN + 1
+
+
+def history_window(contract):
+    """
+    Return (messages, fold_upto) for the next request.
+    messages are the turns to send as-is, always starting with a user message:
+    the recent window plus any older turns the summary does not cover yet.
+    fold_upto is the id of the newest message that fell out of the window and
+    still needs summarising, or None.
+    """
+    # Ordered by id, the same key the fold point uses, so the contract_id index
+    # answers both the range and the order
+    pending = list(
+        contract.messages.filter(id__gt=contract.chat_summary_upto)
+        .order_by('id')
+        .values('id', 'role', 'content')
+    )
+    window = pending[-2 * settings.CHAT_HISTORY_TURNS:]
+
+    # Drop the oldest turns until the window fits, but always keep the latest question
+    total = sum(_tokens(m) for m in window)
+    while len(window) > 1 and total > settings.CHAT_HISTORY_TOKENS:
+        total -= _tokens(window.pop(0))
+    while len(window) > 1 and window[0]['role'] != 'user':
+        window.pop(0)
+
+    overflow = pending[:len(pending) - len(window)]
+    fold_upto = overflow[-1]['id'] if overflow else None
+    # chat_summary_upto only moves once summarize_chat_task has finished, so the
+    # overflow is not in the summary yet; leaving it out would lose it for this turn
+    messages = [{'role': m['role'], 'content': m['content']} for m in overflow + window]
+    return messages, fold_upto
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.16 on 2026-10-16 20:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmessage',
+            name='cache_read_tokens',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='cache_write_tokens',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.16 on 2026-10-16 20:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_chatmessage_cache_tokens'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['contract', 'created_at'], name='chat_msg_contract_created_idx'),
+        ),
+    ]
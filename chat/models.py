@@ -10,10 +10,17 @@ class ChatMessage(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     role = models.CharField(max_length=20, choices=ROLE_CHOICES)
     content = models.TextField()
+    # Prompt-cache usage reported for assistant replies
+    cache_read_tokens = models.IntegerField(default=0)
+    cache_write_tokens = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            # A contract's conversation, in order
+            models.Index(fields=['contract', 'created_at'], name='chat_msg_contract_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.role}: {self.content[:50]}"
@@ -0,0 +1,164 @@
+# chat/retrieval.py
+"""
+Clause retrieval for chat.
+Each contract gets an in-memory BM25 index over its clauses, built on first
+use and kept in a small per-process LRU cache. For every question the
+highest-scoring clauses are packed into the prompt up to a token budget.
+"""
+import logging
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from django.conf import settings
+from analyzer.segmentation import segment_contract
+
+logger = logging.getLogger(__name__)
+
+# Standard BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+CHARS_PER_TOKEN = 4  # same rough estimate as llm.estimate_tokens
+
+WORD_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+STOP_WORDS = frozenset("""
+a an and are as at be been but by can could do does for from has have he her his how i if in into is it its
+me my no not of on or our shall she should so such than that the their them then there these they this those
+to under upon us was we were what when where which while who why will with would you your
+""".split())
+
+# Crude suffix stripping so "terminate", "terminated" and "termination" share a term
+SUFFIXES = ('ations', 'ation', 'ating', 'ated', 'ates', 'ate', 'ing', 'ed', 'es', 's', 'e')
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def _stem(word):
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3 and not word.endswith('ss'):
+            return word[:-len(suffix)]
+    return word
+
+
+def tokenize(text):
+    """Lowercase, stemmed word tokens without stop words."""
+    return [_stem(word) for word in WORD_RE.findall(text.lower()) if word not in STOP_WORDS]
+
+
+class ClauseIndex:
+    """Inverted index with BM25 scoring over one contract's clauses."""
+
+    def __init__(self, clauses):
+        # clauses: list of dicts with number, heading, start, end
+        self.clauses = clauses
+        self.postings = {}
+        self.lengths = []
+        for doc, clause in enumerate(clauses):
+            counts = Counter(tokenize(clause['text']))
+            self.lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.postings.setdefault(term, []).append((doc, tf))
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0
+        total = len(clauses)
+        self.idf = {
+            term: math.log(1 + (total - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def search(self, query, k):
+        """Return [(score, clause)] for the k best-matching clauses."""
+        scores = {}
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc, tf in self.postings[term]:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[doc] / self.avg_length)
+                scores[doc] = scores.get(doc, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        best = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+        return [(score, self.clauses[doc]) for doc, score in best]
+
+
+def _contract_clauses(contract):
+    """The contract's stored clauses, or a fresh segmentation for contracts not yet backfilled."""
+    raw_text = contract.raw_text
+    stored = list(contract.clauses.values('number', 'heading', 'start_offset', 'end_offset'))
+    if stored:
+        spans = [
+            {'number': c['number'], 'heading': c['heading'], 'start': c['start_offset'], 'end': c['end_offset']}
+            for c in stored
+        ]
+    else:
+        spans = segment_contract(raw_text)
+    return [
+        {
+            'number': span['number'],
+            'heading': span['heading'],
+            'start': span['start'],
+            'end': span['end'],
+            'text': raw_text[span['start']:span['end']].strip(),
+        }
+        for span in spans
+        if raw_text[span['start']:span['end']].strip()
+    ]
+
+
+def get_index(contract):
+    """Return the cached index for a contract, building it on first use."""
+    # The text hash is part of the key so a re-extracted contract gets a fresh
+    # index, and a cache hit never has to load the contract's document
+    key = (contract.id, contract.content_hash)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+            return index
+
+    started = time.perf_counter()
+    index = ClauseIndex(_contract_clauses(contract))
+    logger.info(
+        f"Built clause index for contract {contract.id}: {len(index.clauses)} clauses, "
+        f"{len(index.postings)} terms in {(time.perf_counter() - started) * 1000:.1f}ms"
+    )
+
+    with _indexes_lock:
+        _indexes[key] = index
+        _indexes.move_to_end(key)
+        while len(_indexes) > settings.CHAT_INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    return index
+
+
+def retrieve_clauses(contract, question, token_budget=None, k=None):
+    """
+    Pick the clauses most relevant to the question, in document order, that fit
+    in token_budget. When nothing matches, the opening clauses are used instead.
+    """
+    token_budget = token_budget or settings.CHAT_CONTEXT_TOKENS
+    k = k or settings.CHAT_RETRIEVAL_K
+    index = get_index(contract)
+
+    started = time.perf_counter()
+    ranked = [clause for score, clause in index.search(question, k)] or index.clauses[:k]
+
+    selected = []
+    budget = token_budget * CHARS_PER_TOKEN
+    for clause in ranked:
+        if budget <= 0:
+            break
+        text = clause['text']
+        if len(text) > budget:
+            text = text[:budget].rsplit(' ', 1)[0] + ' ...'
+        selected.append({**clause, 'text': text})
+        budget -= len(text)
+
+    selected.sort(key=lambda clause: clause['start'])
+    logger.debug(
+        f"Retrieved {len(selected)} clauses for contract {contract.id} "
+        f"in {(time.perf_counter() - started) * 1000:.2f}ms"
+    )
+    return selected
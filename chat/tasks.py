@@ -0,0 +1,66 @@
+# chat/tasks.py
+import logging
+from celery import shared_task
+from clauseguard import llm
+from analyzer.models import Contract
+from analyzer.services import get_analysis_model
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a user and a contract-review assistant.
+
+CURRENT SUMMARY:
+{summary}
+
+NEW TURNS TO FOLD IN:
+{turns}
+
+Rewrite the summary so it also covers the new turns. Keep every question the user asked, the answers given,
+facts about the contract that were established, and anything the user said they want or plan to do.
+Be concise. Reply with the summary text only."""
+
+
+@shared_task(bind=True, max_retries=3)
+def summarize_chat_task(self, contract_id, upto_id):
+    """
+    Fold chat messages up to upto_id into the contract's rolling summary.
+    Only messages after chat_summary_upto are sent, together with the previous
+    summary, so each message is summarised once.
+    """
+    try:
+        contract = Contract.objects.get(id=contract_id)
+        folded_upto = contract.chat_summary_upto
+        if folded_upto >= upto_id:
+            return {'success': True, 'contract_id': contract_id, 'skipped': True}
+
+        turns = contract.messages.filter(id__gt=folded_upto, id__lte=upto_id).order_by('id')
+        prompt = SUMMARY_PROMPT.format(
+            summary=contract.chat_summary or '(none yet)',
+            turns="\n\n".join(f"{m.role.upper()}: {m.content}" for m in turns),
+        )
+        response = llm.create_message(
+            'chat.summarize_chat',
+            model=get_analysis_model(),
+            max_tokens=settings.CHAT_SUMMARY_MAX_TOKENS,
+            messages=[{'role': 'user', 'content': prompt}],
+        )
+        summary = response.content[0].text.strip()
+
+        # Only apply if no other fold finished in the meantime
+        updated = Contract.objects.filter(id=contract_id, chat_summary_upto=folded_upto).update(
+            chat_summary=summary,
+            chat_summary_upto=upto_id,
+        )
+        logger.info(f"Folded chat up to message {upto_id} into summary for contract {contract_id}")
+        return {'success': bool(updated), 'contract_id': contract_id}
+
+    except llm.RATE_LIMIT_ERRORS as e:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e, countdown=60 * (self.request.retries + 1))
+        logger.error(f"Chat summary gave up waiting for LLM capacity: {str(e)}")
+        return {'success': False, 'error': str(e)}
+
+    except Exception as e:
+        logger.error(f"Chat summary failed for contract {contract_id}: {str(e)}")
+        return {'success': False, 'error': str(e)}
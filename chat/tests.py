@@ -0,0 +1,151 @@
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from analyzer.models import Contract
+from clauseguard import llm_stub
+from . import retrieval
+from .history import history_window
+from .models import ChatMessage
+from .views import _system_blocks
+
+HEADINGS = [
+    'Definitions', 'Services', 'Fees and Payment', 'Term', 'Termination', 'Confidentiality',
+    'Intellectual Property', 'Warranties', 'Limitation of Liability', 'Indemnification',
+    'Data Protection', 'Governing Law',
+]
+
+
+class PromptCacheTests(TestCase):
+    def setUp(self):
+        llm_stub._seen_prefixes.clear()
+        user = User.objects.create_user('owner', 'owner@example.com', 'password')
+        body = "Each party shall perform its obligations under this section promptly and in good faith. " * 8
+        self.contract = Contract(
+            user=user,
+            filename='services.pdf',
+            summary='A services agreement between a supplier and a customer.',
+            overall_risk_level='Medium',
+            overall_risk_score=45,
+        )
+        # Single newlines only, as extract_text_from_pdf produces
+        self.contract.raw_text = '\n'.join(
+            f"{number}. {heading}\n{body}" for number, heading in enumerate(HEADINGS, start=1)
+        )
+        self.contract.analysis_json = {
+            'party_info': {'document_type': 'Services Agreement'},
+            'risks': [{'title': 'Uncapped liability', 'severity': 'High', 'category': 'Liability'}],
+        }
+        self.contract.save()
+
+    def _usage(self, question):
+        return llm_stub._usage({
+            'system': _system_blocks(self.contract, question),
+            'messages': [{'role': 'user', 'content': question}],
+        }, 'reply')
+
+    def test_follow_up_questions_read_the_contract_prefix_from_cache(self):
+        first = self._usage('Can the supplier terminate early?')
+        follow_up = self._usage('Who owns the intellectual property?')
+
+        # The stub, like the API, caches nothing below MIN_CACHE_TOKENS
+        self.assertGreaterEqual(first['cache_creation_input_tokens'], llm_stub.MIN_CACHE_TOKENS)
+        self.assertEqual(follow_up['cache_creation_input_tokens'], 0)
+        self.assertEqual(follow_up['cache_read_input_tokens'], first['cache_creation_input_tokens'])
+
+
+class RetrievalTests(TestCase):
+    CLAUSES = {
+        'Fees and Payment': 'The customer pays all invoices within thirty days of receipt.',
+        'Termination': 'Either party may terminate this agreement on ninety days written notice, '
+                       'and the customer may terminate at once for material breach.',
+        'Confidentiality': 'Each party keeps the other party\'s confidential information secret.',
+        'Governing Law': 'This agreement is governed by the laws of England.',
+    }
+
+    def setUp(self):
+        retrieval._indexes.clear()
+        user = User.objects.create_user('owner', 'owner@example.com', 'password')
+        filler = 'The parties agree to act reasonably and in good faith at all times. ' * 10
+        self.contract = Contract(user=user, filename='services.pdf', summary='',
+                                 overall_risk_level='Low', overall_risk_score=0)
+        self.contract.raw_text = '\n'.join(
+            f"{number}. {heading}\n{body} {filler}"
+            for number, (heading, body) in enumerate(self.CLAUSES.items(), start=1)
+        )
+        self.contract.analysis_json = {}
+        self.contract.save()
+
+    def test_the_relevant_clause_ranks_first(self):
+        ranked = retrieval.get_index(self.contract).search('How can I terminate the contract?', 3)
+        self.assertEqual(ranked[0][1]['heading'], 'Termination')
+        self.assertGreater(ranked[0][0], ranked[1][0] if len(ranked) > 1 else 0)
+
+    def test_retrieved_clauses_stay_within_the_token_budget(self):
+        budget = 60
+        selected = retrieval.retrieve_clauses(self.contract, 'When is termination allowed?', token_budget=budget, k=3)
+
+        self.assertEqual(selected[0]['heading'], 'Termination')
+        # A clause cut to fit ends with " ..."
+        self.assertLessEqual(sum(len(c['text']) for c in selected), budget * retrieval.CHARS_PER_TOKEN + len(' ...'))
+        self.assertTrue(selected[-1]['text'].endswith(' ...'))
+
+    def test_unmatched_question_falls_back_to_the_opening_clauses(self):
+        selected = retrieval.retrieve_clauses(self.contract, 'xylophone', token_budget=10000, k=2)
+        self.assertEqual([c['heading'] for c in selected], ['Fees and Payment', 'Termination'])
+
+
+@override_settings(CHAT_HISTORY_TURNS=2, CHAT_HISTORY_TOKENS=3000)
+class HistoryWindowTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', 'owner@example.com', 'password')
+        self.contract = Contract(user=self.user, filename='services.pdf', summary='',
+                                 overall_risk_level='Low', overall_risk_score=0)
+        self.contract.raw_text = 'Agreement.'
+        self.contract.analysis_json = {}
+        self.contract.save()
+
+    def say(self, *contents):
+        roles = ('user', 'assistant')
+        return [
+            ChatMessage.objects.create(contract=self.contract, user=self.user, role=roles[i % 2], content=content)
+            for i, content in enumerate(contents)
+        ]
+
+    def fold(self, upto_id):
+        self.contract.chat_summary_upto = upto_id
+        self.contract.save(update_fields=['chat_summary_upto'])
+
+    def test_window_keeps_the_last_turns_once_older_ones_are_folded(self):
+        sent = self.say('q1', 'a1', 'q2', 'a2', 'q3', 'a3', 'q4')
+
+        messages, fold_upto = history_window(self.contract)
+        self.assertEqual(fold_upto, sent[3].id)
+        # Nothing is folded yet, so every turn is still sent
+        self.assertEqual([m['content'] for m in messages], ['q1', 'a1', 'q2', 'a2', 'q3', 'a3', 'q4'])
+
+        self.fold(fold_upto)
+        messages, fold_upto = history_window(self.contract)
+        self.assertIsNone(fold_upto)
+        self.assertEqual([m['content'] for m in messages], ['q3', 'a3', 'q4'])
+
+    def test_window_is_trimmed_to_the_token_budget_but_keeps_the_question(self):
+        long_reply = 'x' * 4000
+        sent = self.say('q1', long_reply, 'q2')
+
+        with self.settings(CHAT_HISTORY_TOKENS=500):
+            messages, fold_upto = history_window(self.contract)
+            self.assertEqual(fold_upto, sent[1].id)
+            self.assertEqual(messages[-1], {'role': 'user', 'content': 'q2'})
+
+            self.fold(fold_upto)
+            messages, fold_upto = history_window(self.contract)
+        self.assertIsNone(fold_upto)
+        self.assertEqual(messages, [{'role': 'user', 'content': 'q2'}])
+
+    def test_overflow_stays_in_the_prompt_while_the_summary_lags(self):
+        sent = self.say('q1', 'a1', 'q2', 'a2', 'q3', 'a3', 'q4', 'a4', 'q5')
+        self.fold(sent[1].id)
+
+        messages, fold_upto = history_window(self.contract)
+        self.assertEqual(fold_upto, sent[5].id)
+        self.assertEqual(messages[0], {'role': 'user', 'content': 'q2'})
+        self.assertEqual(len(messages), 7)
@@ -3,5 +3,6 @@ from . import views
 
 urlpatterns = [
     path('<int:contract_id>/send/', views.send_message, name='chat_send'),
+    path('<int:contract_id>/stream/', views.stream_message, name='chat_stream'),
     path('<int:contract_id>/messages/', views.get_messages, name='chat_messages'),
 ]
@@ -1,12 +1,19 @@
 import json
-import anthropic
+from django.conf import settings
 from django.shortcuts import get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_POST
-from django.http import JsonResponse
-from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from clauseguard import llm
+from clauseguard.sqlite import write_transaction
+from analyzer import search
 from analyzer.models import Contract
 from .models import ChatMessage
+from .history import history_window
+from .retrieval import CHARS_PER_TOKEN, retrieve_clauses
+from .tasks import summarize_chat_task
+
+CHAT_MODEL = 'claude-opus-4-6'
 
 
 @login_required
@@ -14,32 +21,144 @@ from .models import ChatMessage
 def send_message(request, contract_id):
     contract = get_object_or_404(Contract, id=contract_id, user=request.user)
 
+    messages, error = _start_turn(request, contract)
+    if error:
+        return error
+
+    try:
+        response = llm.create_message(
+            'chat.send_message',
+            model=CHAT_MODEL,
+            max_tokens=1000,
+            system=_system_blocks(contract, messages[-1]['content']),
+            messages=messages,
+        )
+        ai_reply = response.content[0].text
+    except Exception as e:
+        return JsonResponse({'error': f'AI error: {str(e)}'}, status=500)
+
+    _save_reply(request, contract, ai_reply, response.usage)
+
+    return JsonResponse({'success': True, 'reply': ai_reply})
+
+
+@login_required
+@require_POST
+def stream_message(request, contract_id):
+    """
+    Same as send_message, but forwards the reply as server-sent events while it is
+    generated: "token" events carry text, then one "done" (or "error") event.
+    The assistant ChatMessage is saved once the stream completes.
+    """
+    contract = get_object_or_404(Contract, id=contract_id, user=request.user)
+
+    messages, error = _start_turn(request, contract)
+    if error:
+        return error
+
+    stream = llm.stream_message(
+        'chat.stream_message',
+        model=CHAT_MODEL,
+        max_tokens=1000,
+        system=_system_blocks(contract, messages[-1]['content']),
+        messages=messages,
+    )
+
+    def events():
+        parts = []
+        try:
+            for text in stream:
+                parts.append(text)
+                yield _sse('token', {'text': text})
+        except Exception as e:
+            yield _sse('error', {'error': f'AI error: {str(e)}'})
+            return
+
+        ai_reply = ''.join(parts)
+        _save_reply(request, contract, ai_reply, stream.final_message.usage)
+        yield _sse('done', {'success': True, 'reply': ai_reply})
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # keep proxies from buffering the stream
+    return response
+
+
+@login_required
+def get_messages(request, contract_id):
+    contract = get_object_or_404(Contract, id=contract_id, user=request.user)
+    messages = contract.messages.values('role', 'content', 'created_at')
+    return JsonResponse({'messages': list(messages)})
+
+
+def _start_turn(request, contract):
+    """
+    Validate and save the user's message, then build the conversation for the AI.
+    Returns (messages, None) or (None, error_response).
+    """
     try:
         body = json.loads(request.body)
         user_message = body.get('message', '').strip()
     except Exception:
-        return JsonResponse({'error': 'Invalid request.'}, status=400)
+        return None, JsonResponse({'error': 'Invalid request.'}, status=400)
 
     if not user_message:
-        return JsonResponse({'error': 'Message cannot be empty.'}, status=400)
-
-    # Save user message
-    ChatMessage.objects.create(
-        contract=contract,
-        user=request.user,
-        role='user',
-        content=user_message,
-    )
+        return None, JsonResponse({'error': 'Message cannot be empty.'}, status=400)
+
+    # Save user message, together with its search row
+    with write_transaction():
+        message = ChatMessage.objects.create(
+            contract=contract,
+            user=request.user,
+            role='user',
+            content=user_message,
+        )
+        search.index_chat_message(message)
+
+    # Build conversation history for AI: recent turns verbatim, older ones summarised
+    messages, fold_upto = history_window(contract)
+    if fold_upto:
+        summarize_chat_task.delay(contract.id, fold_upto)
+    return messages, None
+
+
+def _save_reply(request, contract, ai_reply, usage):
+    # Save AI reply along with how much of the prompt was served from cache
+    with write_transaction():
+        message = ChatMessage.objects.create(
+            contract=contract,
+            user=request.user,
+            role='assistant',
+            content=ai_reply,
+            cache_read_tokens=getattr(usage, 'cache_read_input_tokens', 0) or 0,
+            cache_write_tokens=getattr(usage, 'cache_creation_input_tokens', 0) or 0,
+        )
+        search.index_chat_message(message)
 
-    # Build conversation history for AI
-    history = contract.messages.all()
-    messages = [
-        {'role': m.role, 'content': m.content}
-        for m in history
-    ]
 
-    # System prompt with contract context
-    system = f"""You are ClauseGuard's AI legal assistant. You help users understand their contracts.
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _contract_opening(raw_text, max_chars):
+    """The start of the contract up to max_chars, cut at a line break where possible."""
+    if len(raw_text) <= max_chars:
+        return raw_text
+    cut = raw_text.rfind('\n', 0, max_chars)
+    return raw_text[:cut if cut > max_chars // 2 else max_chars]
+
+
+def _system_blocks(contract, question):
+    """
+    System prompt with contract context.
+    The summary, the risks and the opening of the contract never change between
+    turns, so they form a cacheable prefix that follow-up questions read from the
+    prompt cache. The opening (parties, definitions) also keeps that prefix above
+    the API's minimum cacheable length. The clauses relevant to the current
+    question and the summary of older turns follow in a separate, uncached block.
+    """
+    opening = _contract_opening(contract.raw_text, settings.CHAT_CACHED_TEXT_TOKENS * CHARS_PER_TOKEN)
+    context = f"""You are ClauseGuard's AI legal assistant. You help users understand their contracts.
 
 You have already analyzed this contract and here is the context:
 
@@ -47,41 +166,33 @@ CONTRACT SUMMARY: {contract.summary}
 RISK LEVEL: {contract.overall_risk_level} ({contract.overall_risk_score}/100)
 DOCUMENT TYPE: {contract.analysis_json.get('party_info', {}).get('document_type', 'Unknown')}
 
-CONTRACT TEXT (first 4000 chars):
-{contract.raw_text[:4000]}
-
 IDENTIFIED RISKS:
 {json.dumps(contract.analysis_json.get('risks', []), indent=2)[:2000]}
 
+OPENING OF THE CONTRACT:
+{opening or 'No contract text available.'}
+
 Answer the user's questions about this specific contract in plain English.
 Be helpful, clear, and practical. If asked about legal advice, remind them to consult a lawyer.
 Keep responses concise and focused."""
 
-    try:
-        client = anthropic.Anthropic(api_key=settings.AI_API_KEY)
-        response = client.messages.create(
-            model='claude-opus-4-6',
-            max_tokens=1000,
-            system=system,
-            messages=messages,
-        )
-        ai_reply = response.content[0].text
-    except Exception as e:
-        return JsonResponse({'error': f'AI error: {str(e)}'}, status=500)
-
-    # Save AI reply
-    ChatMessage.objects.create(
-        contract=contract,
-        user=request.user,
-        role='assistant',
-        content=ai_reply,
+    # Clauses wholly inside the opening are already in the prompt
+    clauses = [clause for clause in retrieve_clauses(contract, question) if clause['end'] > len(opening)]
+    excerpts = "\n\n".join(
+        f"[{' '.join(filter(None, [clause['number'], clause['heading']])) or 'Clause'}]\n{clause['text']}"
+        for clause in clauses
     )
-
-    return JsonResponse({'success': True, 'reply': ai_reply})
-
-
-@login_required
-def get_messages(request, contract_id):
-    contract = get_object_or_404(Contract, id=contract_id, user=request.user)
-    messages = contract.messages.values('role', 'content', 'created_at')
-    return JsonResponse({'messages': list(messages)})
+    if not excerpts:
+        excerpts = 'None beyond the opening above.' if opening else 'No contract text available.'
+    relevant = f"""RELEVANT CONTRACT CLAUSES (selected for the user's latest question):
+{excerpts}"""
+    if contract.chat_summary:
+        relevant += f"""
+
+SUMMARY OF THE EARLIER CONVERSATION:
+{contract.chat_summary}"""
+
+    return [
+        {'type': 'text', 'text': context, 'cache_control': {'type': 'ephemeral'}},
+        {'type': 'text', 'text': relevant},
+    ]
@@ -0,0 +1,310 @@
+# clauseguard/llm.py
+"""
+Process-wide gateway for Anthropic API calls.
+Both the analyzer and chat apps go through here so they share one pooled
+client, the same timeout/retry policy, and per-call-site usage statistics.
+Statistics are aggregated in Redis, so calls made in Celery workers show up
+next to those made by whichever web process answers /llm-stats/.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from types import SimpleNamespace
+import anthropic
+import redis
+from django.conf import settings
+from . import ratelimit
+
+logger = logging.getLogger(__name__)
+
+# Rate limits, overload and transient server errors are worth retrying
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+# Errors that mean "try again later" rather than "this request is broken"
+RATE_LIMIT_ERRORS = (anthropic.RateLimitError, ratelimit.RateLimitTimeout)
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+STATS_KEY = 'llm:stats:{site}'
+STATS_SITES_KEY = 'llm:stats:sites'
+
+# Adds each field/increment pair in ARGV[3:] to the site's hash, keeps the largest
+# latency seen (ARGV[2], -1 for none) in max_latency_ms and registers the site (ARGV[1])
+RECORD_SCRIPT = """
+for i = 3, #ARGV, 2 do
+  redis.call('HINCRBY', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+local latency = tonumber(ARGV[2])
+if latency >= 0 and latency > (tonumber(redis.call('HGET', KEYS[1], 'max_latency_ms')) or -1) then
+  redis.call('HSET', KEYS[1], 'max_latency_ms', latency)
+end
+redis.call('SADD', KEYS[2], ARGV[1])
+return 1
+"""
+
+STATS_FIELDS = (
+    'calls', 'errors', 'retries', 'total_latency_ms', 'max_latency_ms', 'streamed',
+    'total_first_token_ms', 'input_tokens', 'output_tokens', 'cache_read_tokens', 'cache_write_tokens',
+)
+
+_redis = None
+_record_script = None
+_redis_lock = threading.Lock()
+
+
+def get_client():
+    """Return the pooled client for this process, creating it on first use."""
+    global _client, _client_pid
+    # A client inherited across fork() would share sockets with the parent
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                # The SDK's HTTP client keeps a keep-alive connection pool,
+                # so reusing one instance reuses TCP and TLS sessions
+                _client = anthropic.Anthropic(
+                    api_key=settings.AI_API_KEY,
+                    base_url=settings.AI_BASE_URL or None,  # e.g. a local llm_stub
+                    timeout=settings.LLM_TIMEOUT,
+                    max_retries=0,  # retries are handled by _call_with_retries
+                )
+                _client_pid = os.getpid()
+    return _client
+
+
+def create_message(site: str, timeout: float = None, **kwargs):
+    """
+    Call messages.create with retries, recording latency and token usage under site,
+    e.g. create_message('chat.send_message', model=..., messages=[...]).
+    """
+    client = get_client()
+    input_tokens = estimate_tokens(kwargs)
+    output_tokens = kwargs.get('max_tokens', 0)
+
+    def call():
+        ratelimit.acquire(input_tokens, output_tokens)
+        try:
+            return client.messages.create(timeout=timeout or settings.LLM_TIMEOUT, **kwargs)
+        except BaseException:
+            ratelimit.settle(input_tokens, output_tokens, _failed_usage(input_tokens, ''))
+            raise
+
+    response = _call_with_retries(site, call)
+    ratelimit.settle(input_tokens, output_tokens, getattr(response, 'usage', None))
+    return response
+
+
+def _failed_usage(input_tokens: int, generated: str):
+    """
+    Usage to settle a call that ended without reporting any.
+    The prompt counts once generation has started; output counts as far as it got.
+    """
+    return SimpleNamespace(
+        input_tokens=input_tokens if generated else 0,
+        output_tokens=len(generated) // 4,
+    )
+
+
+def estimate_tokens(kwargs: dict) -> int:
+    """Rough input token count of a request, about 4 characters per token."""
+    chars = len(str(kwargs.get('system', ''))) + len(str(kwargs.get('messages', '')))
+    return chars // 4
+
+
+class MessageStream:
+    """
+    Iterate to receive text deltas as the model generates them.
+    Once iteration finishes, final_message holds the complete Message with usage.
+    """
+
+    def __init__(self, site, timeout, kwargs):
+        self.site = site
+        self.timeout = timeout or settings.LLM_TIMEOUT
+        self.kwargs = kwargs
+        self.final_message = None
+
+    def __iter__(self):
+        client = get_client()
+        input_tokens = estimate_tokens(self.kwargs)
+        output_tokens = self.kwargs.get('max_tokens', 0)
+        attempt = 0
+
+        while True:
+            started = time.monotonic()
+            first_token = None
+            generated = []
+            try:
+                ratelimit.acquire(input_tokens, output_tokens)
+                try:
+                    with client.messages.stream(timeout=self.timeout, **self.kwargs) as stream:
+                        for text in stream.text_stream:
+                            if first_token is None:
+                                first_token = time.monotonic() - started
+                            generated.append(text)
+                            yield text
+                        self.final_message = stream.get_final_message()
+                except BaseException:
+                    # Also reached when the caller stops iterating early
+                    ratelimit.settle(input_tokens, output_tokens, _failed_usage(input_tokens, ''.join(generated)))
+                    raise
+            except Exception as e:
+                # Text already handed to the caller cannot be replayed
+                if first_token is not None:
+                    _record(self.site, time.monotonic() - started, error=True)
+                    raise
+                _retry_or_raise(self.site, attempt, e, time.monotonic() - started)
+                attempt += 1
+                continue
+
+            usage = self.final_message.usage
+            _record(self.site, time.monotonic() - started, usage=usage, first_token=first_token)
+            ratelimit.settle(input_tokens, output_tokens, usage)
+            return
+
+
+def stream_message(site: str, timeout: float = None, **kwargs) -> MessageStream:
+    """Streaming counterpart of create_message; retries only before the first token."""
+    return MessageStream(site, timeout, kwargs)
+
+
+def create_message_batch(site: str, requests: list):
+    """
+    Submit a Message Batch of {'custom_id', 'params'} requests.
+    Batches are billed and rate-limited separately from interactive calls,
+    so they bypass the shared limiter.
+    """
+    client = get_client()
+    return _call_with_retries(site, lambda: client.messages.batches.create(requests=requests))
+
+
+def retrieve_message_batch(site: str, batch_id: str):
+    client = get_client()
+    return _call_with_retries(site, lambda: client.messages.batches.retrieve(batch_id))
+
+
+def message_batch_results(batch_id: str):
+    """Iterate the results of an ended batch; the JSONL file is streamed, not loaded whole."""
+    return get_client().messages.batches.results(batch_id)
+
+
+def get_stats() -> dict:
+    """Per-call-site statistics summed over every web and worker process."""
+    snapshot = {}
+    try:
+        client, _ = _get_redis()
+        for site in sorted(member.decode() for member in client.smembers(STATS_SITES_KEY)):
+            counts = client.hgetall(STATS_KEY.format(site=site))
+            snapshot[site] = {field: int(counts.get(field.encode(), 0)) for field in STATS_FIELDS}
+    except redis.RedisError as e:
+        logger.warning(f"LLM statistics unavailable: {str(e)}")
+        return snapshot
+
+    for values in snapshot.values():
+        values['total_latency'] = values.pop('total_latency_ms') / 1000
+        values['max_latency'] = values.pop('max_latency_ms') / 1000
+        values['total_first_token'] = values.pop('total_first_token_ms') / 1000
+        values['avg_latency'] = round(values['total_latency'] / values['calls'], 3) if values['calls'] else 0
+        values['avg_first_token'] = (
+            round(values['total_first_token'] / values['streamed'], 3) if values['streamed'] else 0
+        )
+    return snapshot
+
+
+def _get_redis():
+    global _redis, _record_script
+    if _record_script is None:
+        with _redis_lock:
+            if _record_script is None:
+                _redis = redis.Redis.from_url(settings.REDIS_URL, socket_timeout=2)
+                _record_script = _redis.register_script(RECORD_SCRIPT)
+    return _redis, _record_script
+
+
+def _call_with_retries(site, call):
+    attempt = 0
+    while True:
+        started = time.monotonic()
+        try:
+            response = call()
+        except Exception as e:
+            _retry_or_raise(site, attempt, e, time.monotonic() - started)
+            attempt += 1
+            continue
+
+        _record(site, time.monotonic() - started, usage=getattr(response, 'usage', None))
+        return response
+
+
+def _retry_or_raise(site, attempt, error, latency):
+    """Sleep before the next attempt, or record the failure and re-raise."""
+    if not _is_retryable(error) or attempt >= settings.LLM_MAX_RETRIES:
+        _record(site, latency, error=True)
+        raise error
+
+    delay = _backoff_delay(attempt, error)
+    logger.warning(
+        f"LLM call {site} failed ({error.__class__.__name__}), "
+        f"retry {attempt + 1}/{settings.LLM_MAX_RETRIES} in {delay:.1f}s"
+    )
+    _record(site, latency, retried=True)
+    time.sleep(delay)
+
+
+def _is_retryable(error) -> bool:
+    if isinstance(error, anthropic.APIConnectionError):
+        # Also covers APITimeoutError
+        return True
+    if isinstance(error, anthropic.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES
+    return False
+
+
+def _backoff_delay(attempt: int, error) -> float:
+    """Exponential backoff with full jitter, honouring Retry-After when the API sends it."""
+    delay = random.uniform(0, min(settings.LLM_BACKOFF_MAX, settings.LLM_BACKOFF_BASE * (2 ** attempt)))
+
+    response = getattr(error, 'response', None)
+    retry_after = response.headers.get('retry-after') if response is not None else None
+    if retry_after:
+        try:
+            delay = max(delay, min(float(retry_after), settings.LLM_BACKOFF_MAX))
+        except ValueError:
+            pass
+    return delay
+
+
+def _record(site, latency, usage=None, error=False, retried=False, first_token=None):
+    if retried:
+        increments = {'retries': 1}
+        latency = None
+    else:
+        increments = {'calls': 1, 'total_latency_ms': round(latency * 1000)}
+        if error:
+            increments['errors'] = 1
+        if first_token is not None:
+            increments['streamed'] = 1
+            increments['total_first_token_ms'] = round(first_token * 1000)
+        if usage is not None:
+            increments['input_tokens'] = getattr(usage, 'input_tokens', 0) or 0
+            increments['output_tokens'] = getattr(usage, 'output_tokens', 0) or 0
+            increments['cache_read_tokens'] = getattr(usage, 'cache_read_input_tokens', 0) or 0
+            increments['cache_write_tokens'] = getattr(usage, 'cache_creation_input_tokens', 0) or 0
+
+    args = [site, round(latency * 1000) if latency is not None else -1]
+    for field, amount in increments.items():
+        args.extend((field, amount))
+    try:
+        _, record_script = _get_redis()
+        record_script(keys=[STATS_KEY.format(site=site), STATS_SITES_KEY], args=args)
+    except redis.RedisError as e:
+        # Statistics are diagnostics only; never fail a call over them
+        logger.debug(f"Could not record LLM statistics for {site}: {str(e)}")
+
+    if usage is not None:
+        logger.info(
+            f"LLM call {site}: {latency:.2f}s, "
+            f"{getattr(usage, 'input_tokens', 0)} in / {getattr(usage, 'output_tokens', 0)} out tokens"
+        )
@@ -0,0 +1,268 @@
+# clauseguard/llm_stub.py
+"""
+Local stand-in for the Anthropic Messages API, for development and testing.
+
+    python -m clauseguard.llm_stub --port 8787
+    AI_BASE_URL=http://127.0.0.1:8787 python manage.py runserver
+
+Replies are canned, but usage is reported like the real API: the first request
+with a given cache_control prefix reports cache_creation_input_tokens, and later
+requests with the same prefix report cache_read_input_tokens. Prefixes shorter
+than --min-cache-tokens are not cached at all, as the API ignores them too.
+
+Message Batches are emulated too: a submitted batch reports "in_progress" until
+--batch-delay seconds have passed, then "ended" with one result per request.
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_seen_prefixes = set()
+_seen_lock = threading.Lock()
+
+_batches = {}
+_batches_lock = threading.Lock()
+BATCH_DELAY = 2.0  # seconds until a submitted batch ends; set by --batch-delay
+LATENCY = 0.0  # seconds before each /v1/messages reply; set by --latency
+MIN_CACHE_TOKENS = 1024  # shortest cacheable prefix; set by --min-cache-tokens
+
+
+def _estimate_tokens(value) -> int:
+    return max(1, len(json.dumps(value)) // 4)
+
+
+def _cacheable_prefix(body: dict):
+    """Everything up to and including the last block marked with cache_control."""
+    blocks = []
+    system = body.get('system')
+    if isinstance(system, list):
+        blocks.extend(system)
+    for message in body.get('messages', []):
+        if isinstance(message.get('content'), list):
+            blocks.extend(message['content'])
+
+    marked = [i for i, block in enumerate(blocks) if block.get('cache_control')]
+    if not marked:
+        return None
+    return blocks[:marked[-1] + 1]
+
+
+def _usage(body: dict, reply: str) -> dict:
+    total = _estimate_tokens(body.get('system', '')) + _estimate_tokens(body.get('messages', []))
+    usage = {
+        'input_tokens': total,
+        'output_tokens': max(1, len(reply) // 4),
+        'cache_creation_input_tokens': 0,
+        'cache_read_input_tokens': 0,
+    }
+
+    prefix = _cacheable_prefix(body)
+    cached = _estimate_tokens(prefix) if prefix else 0
+    if cached >= MIN_CACHE_TOKENS:
+        key = hashlib.sha256(json.dumps(prefix, sort_keys=True).encode('utf-8')).hexdigest()
+        with _seen_lock:
+            hit = key in _seen_prefixes
+            _seen_prefixes.add(key)
+        usage['cache_read_input_tokens' if hit else 'cache_creation_input_tokens'] = cached
+        usage['input_tokens'] = max(0, total - cached)
+    return usage
+
+
+def _reply_text(body: dict) -> str:
+    system = json.dumps(body.get('system', ''))
+    if 'Always respond with valid JSON' in system:
+        return json.dumps({
+            'overall_risk_score': 42,
+            'overall_risk_level': 'Medium',
+            'summary': 'Stub analysis of the submitted contract.',
+            'party_info': {'document_type': 'Agreement', 'key_parties': 'Party A, Party B'},
+            'risks': [{
+                'id': 'risk_1',
+                'title': 'Uncapped liability',
+                'severity': 'High',
+                'category': 'Liability',
+                'clause': 'The Supplier shall be liable for all losses.',
+                'explanation': 'There is no limit on what you could owe.',
+                'recommendation': 'Negotiate a liability cap.',
+            }],
+            'missing_protections': [],
+            'positive_clauses': [],
+        })
+    return 'This is a stub reply from the local LLM stand-in.'
+
+
+def build_message(body: dict) -> dict:
+    reply = _reply_text(body)
+    return {
+        'id': f'msg_stub_{uuid.uuid4().hex[:24]}',
+        'type': 'message',
+        'role': 'assistant',
+        'model': body.get('model', 'stub'),
+        'content': [{'type': 'text', 'text': reply}],
+        'stop_reason': 'end_turn',
+        'stop_sequence': None,
+        'usage': _usage(body, reply),
+    }
+
+
+def stream_events(message: dict):
+    """Server-sent events for a message, in the order the real API emits them."""
+    text = message['content'][0]['text']
+    started = dict(message, content=[], stop_reason=None,
+                   usage=dict(message['usage'], output_tokens=1))
+    yield 'message_start', {'type': 'message_start', 'message': started}
+    yield 'content_block_start', {
+        'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''},
+    }
+    for start in range(0, len(text), 12):
+        yield 'content_block_delta', {
+            'type': 'content_block_delta', 'index': 0,
+            'delta': {'type': 'text_delta', 'text': text[start:start + 12]},
+        }
+    yield 'content_block_stop', {'type': 'content_block_stop', 'index': 0}
+    yield 'message_delta', {
+        'type': 'message_delta',
+        'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+        'usage': {'output_tokens': message['usage']['output_tokens']},
+    }
+    yield 'message_stop', {'type': 'message_stop'}
+
+
+def _timestamp(seconds):
+    return datetime.fromtimestamp(seconds, timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def batch_object(batch: dict, base_url: str) -> dict:
+    """The MessageBatch resource for a stored batch, ended once BATCH_DELAY has passed."""
+    ended = time.time() - batch['created'] >= BATCH_DELAY
+    count = len(batch['requests'])
+    return {
+        'id': batch['id'],
+        'type': 'message_batch',
+        'processing_status': 'ended' if ended else 'in_progress',
+        'request_counts': {
+            'processing': 0 if ended else count,
+            'succeeded': count if ended else 0,
+            'errored': 0,
+            'canceled': 0,
+            'expired': 0,
+        },
+        'created_at': _timestamp(batch['created']),
+        'expires_at': _timestamp(batch['created'] + timedelta(days=1).total_seconds()),
+        'ended_at': _timestamp(batch['created'] + BATCH_DELAY) if ended else None,
+        'archived_at': None,
+        'cancel_initiated_at': None,
+        'results_url': f"{base_url}/v1/messages/batches/{batch['id']}/results" if ended else None,
+    }
+
+
+def batch_results(batch: dict):
+    """JSONL lines, one succeeded result per request."""
+    for request in batch['requests']:
+        yield json.dumps({
+            'custom_id': request['custom_id'],
+            'result': {'type': 'succeeded', 'message': build_message(request['params'])},
+        })
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _send_json(self, payload, status=200):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, message):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        for event, data in stream_events(message):
+            self.wfile.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+        self.close_connection = True
+
+    def _base_url(self):
+        return f"http://{self.headers.get('Host') or '%s:%s' % self.server.server_address[:2]}"
+
+    def _find_batch(self, batch_id):
+        with _batches_lock:
+            batch = _batches.get(batch_id)
+        if batch is None:
+            self._send_json({'type': 'error', 'error': {'type': 'not_found_error', 'message': batch_id}}, 404)
+        return batch
+
+    def do_GET(self):
+        parts = self.path.split('?', 1)[0].strip('/').split('/')
+        if parts[:3] == ['v1', 'messages', 'batches'] and len(parts) in (4, 5):
+            batch = self._find_batch(parts[3])
+            if batch is None:
+                return
+            if len(parts) == 4:
+                return self._send_json(batch_object(batch, self._base_url()))
+            if parts[4] == 'results':
+                data = ('\n'.join(batch_results(batch)) + '\n').encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/binary')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                return
+        self._send_json({'type': 'error', 'error': {'type': 'not_found_error', 'message': self.path}}, 404)
+
+    def do_POST(self):
+        if self.path.rstrip('/') == '/v1/messages/batches':
+            batch = {
+                'id': f'msgbatch_stub_{uuid.uuid4().hex[:24]}',
+                'requests': self._read_json().get('requests', []),
+                'created': time.time(),
+            }
+            with _batches_lock:
+                _batches[batch['id']] = batch
+            return self._send_json(batch_object(batch, self._base_url()))
+        if self.path.rstrip('/') == '/v1/messages':
+            body = self._read_json()
+            time.sleep(LATENCY)
+            if body.get('stream'):
+                return self._send_stream(build_message(body))
+            return self._send_json(build_message(body))
+        self._send_json({'type': 'error', 'error': {'type': 'not_found_error', 'message': self.path}}, 404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    global BATCH_DELAY, LATENCY, MIN_CACHE_TOKENS
+    parser = argparse.ArgumentParser(description="Local stand-in for the Anthropic API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8787)
+    parser.add_argument('--batch-delay', type=float, default=BATCH_DELAY,
+                        help="Seconds before a submitted message batch ends")
+    parser.add_argument('--latency', type=float, default=LATENCY,
+                        help="Seconds to wait before answering each message request")
+    parser.add_argument('--min-cache-tokens', type=int, default=MIN_CACHE_TOKENS,
+                        help="Shortest prompt prefix, in tokens, that is cached")
+    args = parser.parse_args()
+    BATCH_DELAY = args.batch_delay
+    LATENCY = args.latency
+    MIN_CACHE_TOKENS = args.min_cache_tokens
+
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    print(f"LLM stub listening on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+# clauseguard/ratelimit.py
+"""
+Cluster-wide rate limiter for LLM calls.
+Three token buckets (requests, input tokens and output tokens per minute)
+live in Redis so every web and worker process draws from the same budget,
+mirroring the API's RPM, ITPM and OTPM limits. Callers block until every
+bucket has capacity instead of sending a request that would get a 429.
+Output is reserved at max_tokens, as the API does, and the unused part is
+refunded once the response reports what was really generated.
+"""
+import logging
+import random
+import threading
+import time
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+REQUESTS_KEY = 'llm:ratelimit:requests'
+INPUT_TOKENS_KEY = 'llm:ratelimit:input_tokens'
+OUTPUT_TOKENS_KEY = 'llm:ratelimit:output_tokens'
+
+# Refills every bucket in KEYS from Redis' own clock, then debits each by its
+# cost only if all of them can afford it. ARGV holds a capacity and a cost per
+# key. Returns 0 when granted, otherwise the milliseconds to wait before trying again.
+ACQUIRE_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+
+local levels = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+  local capacity = tonumber(ARGV[2 * i - 1])
+  local cost = math.min(tonumber(ARGV[2 * i]), capacity)
+  local data = redis.call('HMGET', key, 'tokens', 'ts')
+  local tokens = tonumber(data[1]) or capacity
+  local ts = tonumber(data[2]) or now
+  tokens = math.min(capacity, tokens + (now - ts) * capacity / 60000)
+  if tokens < cost then
+    wait = math.max(wait, (cost - tokens) * 60000 / capacity)
+  end
+  levels[i] = {tokens, cost}
+end
+
+for i, key in ipairs(KEYS) do
+  local tokens = levels[i][1]
+  if wait == 0 then
+    tokens = tokens - levels[i][2]
+  end
+  redis.call('HSET', key, 'tokens', tokens, 'ts', now)
+  redis.call('PEXPIRE', key, 120000)
+end
+return math.ceil(wait)
+"""
+
+# Credits each bucket in KEYS by its ARGV delta, capped at the ARGV capacity.
+# A bucket that has already expired is left alone: recreating it here would
+# leave a hash without ts or a TTL, and an absent bucket already reads as full.
+SETTLE_SCRIPT = """
+for i, key in ipairs(KEYS) do
+  if redis.call('EXISTS', key) == 1 then
+    local capacity = tonumber(ARGV[2 * i - 1])
+    local tokens = tonumber(redis.call('HGET', key, 'tokens')) or capacity
+    redis.call('HSET', key, 'tokens', math.min(capacity, tokens + tonumber(ARGV[2 * i])))
+  end
+end
+return 0
+"""
+
+
+class RateLimitTimeout(Exception):
+    """Raised when capacity did not free up within LLM_RATE_LIMIT_MAX_WAIT."""
+
+
+_redis = None
+_acquire_script = None
+_settle_script = None
+_redis_lock = threading.Lock()
+
+
+def _get_script():
+    global _redis, _acquire_script, _settle_script
+    if _acquire_script is None:
+        with _redis_lock:
+            if _acquire_script is None:
+                _redis = redis.Redis.from_url(settings.REDIS_URL, socket_timeout=2)
+                _settle_script = _redis.register_script(SETTLE_SCRIPT)
+                _acquire_script = _redis.register_script(ACQUIRE_SCRIPT)
+    return _acquire_script
+
+
+def enabled() -> bool:
+    return (
+        settings.LLM_RATE_LIMIT_RPM > 0
+        and settings.LLM_RATE_LIMIT_ITPM > 0
+        and settings.LLM_RATE_LIMIT_OTPM > 0
+    )
+
+
+def acquire(input_tokens: int, output_tokens: int, max_wait: float = None):
+    """
+    Block until one request, input_tokens and output_tokens fit in the shared budget.
+    output_tokens is the call's max_tokens; settle() refunds what goes unused.
+    If Redis is unreachable the call is let through rather than failing the caller.
+    """
+    if not enabled():
+        return
+
+    max_wait = settings.LLM_RATE_LIMIT_MAX_WAIT if max_wait is None else max_wait
+    deadline = time.monotonic() + max_wait
+    waited = False
+
+    while True:
+        try:
+            wait_ms = _get_script()(
+                keys=[REQUESTS_KEY, INPUT_TOKENS_KEY, OUTPUT_TOKENS_KEY],
+                args=[
+                    settings.LLM_RATE_LIMIT_RPM, 1,
+                    settings.LLM_RATE_LIMIT_ITPM, input_tokens,
+                    settings.LLM_RATE_LIMIT_OTPM, output_tokens,
+                ],
+            )
+        except redis.RedisError as e:
+            logger.warning(f"Rate limiter unavailable, proceeding without it: {str(e)}")
+            return
+
+        if not wait_ms:
+            if waited:
+                logger.info(
+                    f"Rate limiter granted {input_tokens} input / {output_tokens} output tokens after waiting"
+                )
+            return
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise RateLimitTimeout(f"No LLM capacity available after waiting {max_wait:.0f}s")
+
+        # Jitter keeps waiting processes from waking up in lockstep
+        waited = True
+        time.sleep(min(remaining, wait_ms / 1000 + random.uniform(0, 0.25)))
+
+
+def settle(reserved_input: int, reserved_output: int, usage):
+    """
+    Correct both token buckets once a call reports its real usage.
+    A call that failed passes the usage it is known to have consumed, so the rest is refunded.
+    """
+    if not enabled() or usage is None:
+        return
+    # Cache reads do not count towards the input limit; cache writes do
+    actual_input = (getattr(usage, 'input_tokens', 0) or 0) + (getattr(usage, 'cache_creation_input_tokens', 0) or 0)
+    actual_output = getattr(usage, 'output_tokens', 0) or 0
+    if actual_input == reserved_input and actual_output == reserved_output:
+        return
+    try:
+        _get_script()
+        _settle_script(
+            keys=[INPUT_TOKENS_KEY, OUTPUT_TOKENS_KEY],
+            args=[
+                settings.LLM_RATE_LIMIT_ITPM, reserved_input - actual_input,
+                settings.LLM_RATE_LIMIT_OTPM, reserved_output - actual_output,
+            ],
+        )
+    except redis.RedisError as e:
+        logger.warning(f"Rate limiter unavailable, could not settle usage: {str(e)}")
@@ -1,5 +1,6 @@
 from pathlib import Path
 import os
+from kombu import Exchange, Queue
 from dotenv import load_dotenv
 import socket
 
@@ -65,10 +66,14 @@ WSGI_APPLICATION = 'clauseguard.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',  
+        # sqlite3 in WAL mode with a busy timeout; see clauseguard/sqlite
+        'ENGINE': 'clauseguard.sqlite',
+        'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', '600')),  # seconds; keep connections between requests
+        'CONN_HEALTH_CHECKS': True,
     }
 }
+SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', '5000'))  # milliseconds to wait for a lock
 
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -117,11 +122,121 @@ SOCIAL_AUTH_PIPELINE = (
 )
 
 # File uploads
+MEDIA_URL = '/media/'
+MEDIA_ROOT = BASE_DIR / 'media'
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024
+BATCH_MAX_UPLOAD_BYTES = int(os.environ.get('BATCH_MAX_UPLOAD_BYTES', 200 * 1024 * 1024))
+BATCH_MAX_ENTRIES = int(os.environ.get('BATCH_MAX_ENTRIES', '200'))
+
+# PDF extraction
+PDF_EXTRACTION_WORKERS = int(os.environ.get('PDF_EXTRACTION_WORKERS', min(4, os.cpu_count() or 1)))
+PDF_PAGE_TIMEOUT = float(os.environ.get('PDF_PAGE_TIMEOUT', '10'))  # seconds per page
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get('PDF_PARALLEL_MIN_PAGES', '8'))
+EXTRACTION_CACHE_MAX_BYTES = int(os.environ.get('EXTRACTION_CACHE_MAX_BYTES', 256 * 1024 * 1024))
 
 # AI
 AI_API_KEY = os.environ.get('AI_API_KEY', '')
+AI_BASE_URL = os.environ.get('AI_BASE_URL', '')  # override to point at a local stand-in
+LLM_TIMEOUT = float(os.environ.get('LLM_TIMEOUT', '90'))  # seconds per call
+LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', '4'))
+LLM_BACKOFF_BASE = float(os.environ.get('LLM_BACKOFF_BASE', '1'))
+LLM_BACKOFF_MAX = float(os.environ.get('LLM_BACKOFF_MAX', '30'))
+
+# Shared LLM rate limits across all processes (0 disables the limiter)
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+LLM_RATE_LIMIT_RPM = int(os.environ.get('LLM_RATE_LIMIT_RPM', '50'))
+# Input and output tokens are limited separately, like the API's ITPM and OTPM;
+# set all three to the organisation's limits for the analysis model
+LLM_RATE_LIMIT_ITPM = int(os.environ.get('LLM_RATE_LIMIT_ITPM', '100000'))
+LLM_RATE_LIMIT_OTPM = int(os.environ.get('LLM_RATE_LIMIT_OTPM', '40000'))
+LLM_RATE_LIMIT_MAX_WAIT = float(os.environ.get('LLM_RATE_LIMIT_MAX_WAIT', '300'))  # seconds
+ANALYSIS_CHUNKED = os.environ.get('ANALYSIS_CHUNKED', 'True') == 'True'
+# About 10k input tokens per chunk: a 100-page (~320k character) contract splits into
+# 9 chunks, one wave at the default concurrency if the rate limits below admit it
+ANALYSIS_CHUNK_CHARS = int(os.environ.get('ANALYSIS_CHUNK_CHARS', '40000'))
+ANALYSIS_MAX_CONCURRENCY = int(os.environ.get('ANALYSIS_MAX_CONCURRENCY', '10'))
+ANALYSIS_CACHE_TTL = int(os.environ.get('ANALYSIS_CACHE_TTL', 30 * 24 * 3600))  # seconds
+# Seconds a leader may hold the lock. A waiter's fallback runs a minute after it expires,
+# and must still have time to analyze before the page stops polling (ANALYSIS_POLL_TIMEOUT)
+ANALYSIS_SINGLEFLIGHT_TTL = int(os.environ.get('ANALYSIS_SINGLEFLIGHT_TTL', '420'))
+ANALYSIS_DUPLICATE_WINDOW = int(os.environ.get('ANALYSIS_DUPLICATE_WINDOW', '60'))  # seconds
+# How long the page polls a running analysis; rate-limit retries are only scheduled
+# while they can still finish inside it
+ANALYSIS_POLL_TIMEOUT = int(os.environ.get('ANALYSIS_POLL_TIMEOUT', '1200'))  # seconds
+HISTORY_PAGE_SIZE = int(os.environ.get('HISTORY_PAGE_SIZE', '50'))
+SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', '20'))
+
+# Offline analysis through the Message Batches API
+MESSAGE_BATCH_MAX_CONTRACTS = int(os.environ.get('MESSAGE_BATCH_MAX_CONTRACTS', '500'))
+MESSAGE_BATCH_SUBMIT_INTERVAL = float(os.environ.get('MESSAGE_BATCH_SUBMIT_INTERVAL', '300'))  # seconds
+MESSAGE_BATCH_POLL_INTERVAL = float(os.environ.get('MESSAGE_BATCH_POLL_INTERVAL', '60'))  # seconds
+# Contracts claimed by a submission that never recorded its batch_id are released after this
+MESSAGE_BATCH_CLAIM_TIMEOUT = int(os.environ.get('MESSAGE_BATCH_CLAIM_TIMEOUT', '3600'))  # seconds
+CELERY_BEAT_SCHEDULE = {
+    'submit-message-batches': {
+        'task': 'analyzer.tasks.submit_message_batches_task',
+        'schedule': MESSAGE_BATCH_SUBMIT_INTERVAL,
+    },
+    'poll-message-batches': {
+        'task': 'analyzer.tasks.poll_message_batches_task',
+        'schedule': MESSAGE_BATCH_POLL_INTERVAL,
+    },
+}
+
+# Chat context: the contract's opening sits in the cached prompt prefix, which the API
+# only caches from 1024 tokens up; clauses retrieved per question follow it uncached
+CHAT_CACHED_TEXT_TOKENS = int(os.environ.get('CHAT_CACHED_TEXT_TOKENS', '2000'))
+CHAT_CONTEXT_TOKENS = int(os.environ.get('CHAT_CONTEXT_TOKENS', '1500'))
+CHAT_RETRIEVAL_K = int(os.environ.get('CHAT_RETRIEVAL_K', '6'))
+CHAT_INDEX_CACHE_SIZE = int(os.environ.get('CHAT_INDEX_CACHE_SIZE', '128'))  # contracts per process
+
+# Chat history: recent turns sent verbatim, older ones folded into a summary
+CHAT_HISTORY_TURNS = int(os.environ.get('CHAT_HISTORY_TURNS', '6'))
+CHAT_HISTORY_TOKENS = int(os.environ.get('CHAT_HISTORY_TOKENS', '3000'))
+CHAT_SUMMARY_MAX_TOKENS = int(os.environ.get('CHAT_SUMMARY_MAX_TOKENS', '500'))
+
+# Celery: Redis broker and result backend, one queue per kind of work
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', REDIS_URL)
+CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', REDIS_URL)
+CELERY_RESULT_EXPIRES = int(os.environ.get('CELERY_RESULT_EXPIRES', 24 * 3600))  # seconds
+CELERY_TASK_DEFAULT_QUEUE = 'interactive'
+CELERY_TASK_QUEUES = (
+    Queue('interactive', Exchange('interactive'), routing_key='interactive'),  # a user is watching
+    Queue('extraction', Exchange('extraction'), routing_key='extraction'),  # CPU-bound, needs a solo pool
+    Queue('bulk', Exchange('bulk'), routing_key='bulk'),  # ZIP batches
+    Queue('maintenance', Exchange('maintenance'), routing_key='maintenance'),  # periodic housekeeping
+)
+CELERY_TASK_ROUTES = {
+    # Prefork children are daemonic and may not fork the PDF page pool, so extraction
+    # runs on its own worker started with --pool solo (see start.sh)
+    'analyzer.tasks.extract_contract_text_task': {'queue': 'extraction', 'priority': 0},
+    'analyzer.tasks.analyze_contract_task': {'queue': 'interactive', 'priority': 0},
+    'analyzer.tasks.finalize_batch_task': {'queue': 'bulk', 'priority': 5},
+    'analyzer.tasks.submit_message_batches_task': {'queue': 'maintenance', 'priority': 9},
+    'analyzer.tasks.poll_message_batches_task': {'queue': 'maintenance', 'priority': 9},
+    'chat.tasks.summarize_chat_task': {'queue': 'maintenance', 'priority': 5},
+}
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    # A worker consuming several queues always drains them in the order given to -Q
+    'queue_order_strategy': 'priority',
+    # 0 is served first within a queue
+    'priority_steps': list(range(10)),
+    'sep': ':',
+    # Unacked tasks are redelivered after this long, so it must exceed the longest task
+    'visibility_timeout': int(os.environ.get('CELERY_VISIBILITY_TIMEOUT', 2 * 3600)),
+}
+CELERY_RESULT_BACKEND_TRANSPORT_OPTIONS = {
+    'visibility_timeout': CELERY_BROKER_TRANSPORT_OPTIONS['visibility_timeout'],
+}
+# LLM tasks run for minutes: take one at a time, and only acknowledge once done so a
+# worker that dies mid-task hands it back to the queue
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_TASK_ACKS_LATE = True
+CELERY_TASK_REJECT_ON_WORKER_LOST = True
+CELERY_TASK_SERIALIZER = 'json'
+CELERY_RESULT_SERIALIZER = 'json'
+CELERY_ACCEPT_CONTENT = ['json']
 
 
 # Resend (via Anymail) configuration
@@ -0,0 +1,33 @@
+# clauseguard/sqlite/__init__.py
+"""
+SQLite backend tuned for the web and worker containers sharing one database
+file (ENGINE 'clauseguard.sqlite'). Every connection runs in WAL mode, so
+readers keep reading while a worker commits, and waits on busy_timeout
+instead of failing with "database is locked".
+"""
+from contextlib import contextmanager
+from django.db import transaction
+
+
+@contextmanager
+def write_transaction(using=None):
+    """
+    atomic() that takes SQLite's write lock up front (BEGIN IMMEDIATE).
+    A deferred transaction that reads first and writes later cannot wait for
+    the lock when another writer got there in between, it fails straight away;
+    taking the lock at BEGIN queues writers on busy_timeout instead. Keep the
+    block short: nothing else can write until it commits. Nested blocks and
+    other database backends get a plain atomic().
+    """
+    connection = transaction.get_connection(using)
+    immediate = not connection.in_atomic_block and hasattr(connection, 'begin_immediate')
+    if immediate:
+        connection.begin_immediate = True
+    try:
+        with transaction.atomic(using=using):
+            if immediate:
+                connection.begin_immediate = False
+            yield
+    finally:
+        if immediate:
+            connection.begin_immediate = False
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.db.backends.sqlite3 import base
+
+
+def configure_connection(conn):
+    """Per-connection settings for a database file shared between processes."""
+    # WAL lets readers proceed while a write is in progress. It needs all
+    # processes on one host (the -shm file is shared memory), which holds for
+    # containers mounting the same volume.
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute(f'PRAGMA busy_timeout = {int(settings.SQLITE_BUSY_TIMEOUT)}')
+    # In WAL mode NORMAL only fsyncs at checkpoints; a power loss can drop the
+    # last commits but never corrupts the database
+    conn.execute('PRAGMA synchronous = NORMAL')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    begin_immediate = False  # set by write_transaction for the next BEGIN
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        configure_connection(conn)
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE' if self.begin_immediate else 'BEGIN')
@@ -0,0 +1,219 @@
+import os
+import shutil
+import tempfile
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+import anthropic
+import httpx
+from django.db import OperationalError, connections
+from django.test import SimpleTestCase, override_settings
+from . import llm, ratelimit
+from .sqlite import write_transaction
+from .sqlite.base import DatabaseWrapper
+
+try:
+    # fakeredis runs the Lua scripts through lupa, so Redis-backed code is tested as written
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+requires_fakeredis = skipUnless(fakeredis, "fakeredis[lua] is not installed")
+
+
+def _status_error(status, retry_after=None):
+    headers = {'retry-after': retry_after} if retry_after else {}
+    response = httpx.Response(status, headers=headers, request=httpx.Request('POST', 'https://api.test/v1/messages'))
+    return anthropic.APIStatusError(f'HTTP {status}', response=response, body=None)
+
+
+def _message(text='ok', input_tokens=100, output_tokens=20):
+    return SimpleNamespace(
+        content=[SimpleNamespace(text=text)],
+        usage=SimpleNamespace(input_tokens=input_tokens, output_tokens=output_tokens,
+                              cache_read_input_tokens=0, cache_creation_input_tokens=0),
+    )
+
+
+@requires_fakeredis
+@override_settings(LLM_RATE_LIMIT_RPM=0, LLM_MAX_RETRIES=3, LLM_BACKOFF_BASE=1, LLM_BACKOFF_MAX=30)
+class GatewayTests(SimpleTestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        self.create = mock.Mock()
+        client = SimpleNamespace(messages=SimpleNamespace(create=self.create))
+        for patcher in (
+            mock.patch.object(llm, 'get_client', return_value=client),
+            mock.patch.object(llm, '_get_redis',
+                              return_value=(self.redis, self.redis.register_script(llm.RECORD_SCRIPT))),
+            mock.patch.object(llm.time, 'sleep'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_retry_after_sets_a_floor_on_the_backoff_capped_at_the_maximum(self):
+        self.assertGreaterEqual(llm._backoff_delay(0, _status_error(429, retry_after='7')), 7)
+        self.assertEqual(llm._backoff_delay(0, _status_error(429, retry_after='120')), 30)
+        self.assertLessEqual(llm._backoff_delay(0, _status_error(529)), 1)
+
+    def test_retryable_statuses_are_retried_and_others_raise_at_once(self):
+        for status in (408, 429, 500, 503, 529):
+            self.assertTrue(llm._is_retryable(_status_error(status)), status)
+        for status in (400, 401, 403, 404, 413):
+            self.assertFalse(llm._is_retryable(_status_error(status)), status)
+        self.assertTrue(llm._is_retryable(anthropic.APIConnectionError(request=httpx.Request('POST', 'https://x'))))
+
+        self.create.side_effect = _status_error(400)
+        with self.assertRaises(anthropic.APIStatusError):
+            llm.create_message('test.bad_request', model='m', max_tokens=10, messages=[])
+        self.assertEqual(self.create.call_count, 1)
+
+    def test_transient_errors_are_retried_until_the_call_succeeds(self):
+        self.create.side_effect = [_status_error(529), _status_error(503), _message()]
+        response = llm.create_message('test.flaky', model='m', max_tokens=10, messages=[])
+
+        self.assertEqual(response.content[0].text, 'ok')
+        self.assertEqual(self.create.call_count, 3)
+        stats = llm.get_stats()['test.flaky']
+        self.assertEqual((stats['calls'], stats['retries'], stats['errors']), (1, 2, 0))
+
+    def test_gives_up_after_the_configured_retries(self):
+        self.create.side_effect = _status_error(529)
+        with self.assertRaises(anthropic.APIStatusError):
+            llm.create_message('test.down', model='m', max_tokens=10, messages=[])
+        self.assertEqual(self.create.call_count, 4)
+        stats = llm.get_stats()['test.down']
+        self.assertEqual((stats['calls'], stats['retries'], stats['errors']), (1, 3, 1))
+
+    def test_stats_are_summed_per_call_site(self):
+        self.create.side_effect = [
+            _message(input_tokens=100, output_tokens=10),
+            _message(input_tokens=50, output_tokens=5),
+            _message(input_tokens=7, output_tokens=1),
+        ]
+        llm.create_message('analyzer.analyze_contract', model='m', max_tokens=10, messages=[])
+        llm.create_message('analyzer.analyze_contract', model='m', max_tokens=10, messages=[])
+        llm.create_message('chat.send_message', model='m', max_tokens=10, messages=[])
+
+        stats = llm.get_stats()
+        self.assertEqual(sorted(stats), ['analyzer.analyze_contract', 'chat.send_message'])
+        analyzer = stats['analyzer.analyze_contract']
+        self.assertEqual(analyzer['calls'], 2)
+        self.assertEqual((analyzer['input_tokens'], analyzer['output_tokens']), (150, 15))
+        self.assertEqual(stats['chat.send_message']['calls'], 1)
+
+    def test_latency_keeps_the_maximum_and_the_average(self):
+        llm._record('test.latency', 0.5)
+        llm._record('test.latency', 2.0)
+        llm._record('test.latency', 1.0, retried=True)
+        llm._record('test.latency', 0.3, first_token=0.1)
+
+        stats = llm.get_stats()['test.latency']
+        self.assertEqual((stats['calls'], stats['retries'], stats['streamed']), (3, 1, 1))
+        self.assertEqual(stats['max_latency'], 2.0)
+        self.assertEqual(stats['avg_latency'], 0.933)
+        self.assertEqual(stats['avg_first_token'], 0.1)
+
+
+@requires_fakeredis
+@override_settings(LLM_RATE_LIMIT_RPM=2, LLM_RATE_LIMIT_ITPM=1000, LLM_RATE_LIMIT_OTPM=100,
+                   LLM_RATE_LIMIT_MAX_WAIT=0, LLM_MAX_RETRIES=0)
+class RateLimiterTests(SimpleTestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        self.create = mock.Mock()
+        self.stream = mock.MagicMock()
+        client = SimpleNamespace(messages=SimpleNamespace(create=self.create, stream=self.stream))
+        for patcher in (
+            mock.patch.object(ratelimit, '_redis', self.redis),
+            mock.patch.object(ratelimit, '_acquire_script', self.redis.register_script(ratelimit.ACQUIRE_SCRIPT)),
+            mock.patch.object(ratelimit, '_settle_script', self.redis.register_script(ratelimit.SETTLE_SCRIPT)),
+            mock.patch.object(llm, 'get_client', return_value=client),
+            mock.patch.object(llm, '_get_redis',
+                              return_value=(self.redis, self.redis.register_script(llm.RECORD_SCRIPT))),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tokens(self, key):
+        return float(self.redis.hget(key, 'tokens'))
+
+    def test_acquire_draws_from_every_bucket_and_times_out_when_one_is_empty(self):
+        ratelimit.acquire(400, 60)
+        self.assertAlmostEqual(self.tokens(ratelimit.INPUT_TOKENS_KEY), 600, delta=1)
+        self.assertAlmostEqual(self.tokens(ratelimit.OUTPUT_TOKENS_KEY), 40, delta=1)
+
+        # Enough requests and input left, but not enough output
+        with self.assertRaises(ratelimit.RateLimitTimeout):
+            ratelimit.acquire(400, 60)
+        self.assertAlmostEqual(self.tokens(ratelimit.REQUESTS_KEY), 1, delta=0.1)
+
+    def test_settle_refunds_unused_output_up_to_the_capacity(self):
+        ratelimit.acquire(400, 60)
+        ratelimit.settle(400, 60, SimpleNamespace(input_tokens=400, output_tokens=10))
+        self.assertAlmostEqual(self.tokens(ratelimit.OUTPUT_TOKENS_KEY), 90, delta=1)
+
+        # A refund never fills a bucket past its capacity
+        ratelimit.settle(0, 500, SimpleNamespace(input_tokens=0, output_tokens=0))
+        self.assertEqual(self.tokens(ratelimit.OUTPUT_TOKENS_KEY), 100)
+
+    def test_settle_leaves_an_expired_bucket_alone(self):
+        ratelimit.settle(400, 60, SimpleNamespace(input_tokens=0, output_tokens=0))
+        self.assertFalse(self.redis.exists(ratelimit.INPUT_TOKENS_KEY, ratelimit.OUTPUT_TOKENS_KEY))
+
+    def test_failed_call_refunds_its_reservation(self):
+        self.create.side_effect = _status_error(400)
+        with self.assertRaises(anthropic.APIStatusError):
+            llm.create_message('test.bad_request', model='m', max_tokens=60, messages=[])
+        self.assertAlmostEqual(self.tokens(ratelimit.OUTPUT_TOKENS_KEY), 100, delta=1)
+
+    def test_stream_that_breaks_off_is_charged_only_for_what_it_generated(self):
+        def text_stream():
+            yield 'x' * 40
+            raise anthropic.APIConnectionError(request=httpx.Request('POST', 'https://x'))
+
+        self.stream.return_value.__enter__.return_value.text_stream = text_stream()
+        stream = llm.stream_message('test.stream', model='m', max_tokens=60, messages=[])
+        with self.assertRaises(anthropic.APIConnectionError):
+            list(stream)
+        # 40 characters are about 10 output tokens; the other 50 are given back
+        self.assertAlmostEqual(self.tokens(ratelimit.OUTPUT_TOKENS_KEY), 90, delta=1)
+
+
+@override_settings(SQLITE_BUSY_TIMEOUT=50)
+class SqliteConcurrencyTests(SimpleTestCase):
+    """Two connections to one database file, as the web and worker containers have."""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        settings_dict = {**connections['default'].settings_dict, 'NAME': os.path.join(directory, 'db.sqlite3')}
+        for alias in ('writer', 'reader'):
+            connections[alias] = DatabaseWrapper(dict(settings_dict), alias)
+            self.addCleanup(connections.__delitem__, alias)
+            self.addCleanup(connections[alias].close)
+        self.writer, self.reader = connections['writer'], connections['reader']
+        with self.writer.cursor() as cursor:
+            cursor.execute('CREATE TABLE item (name TEXT)')
+            cursor.execute("INSERT INTO item VALUES ('committed')")
+
+    def test_connections_run_in_wal_mode(self):
+        with self.reader.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+
+    def test_readers_are_not_blocked_by_an_open_write_transaction(self):
+        with write_transaction(using='writer'):
+            # BEGIN IMMEDIATE holds the write lock before anything is written
+            with self.reader.cursor() as cursor:
+                with self.assertRaisesMessage(OperationalError, 'database is locked'):
+                    cursor.execute('BEGIN IMMEDIATE')
+
+            with self.writer.cursor() as cursor:
+                cursor.execute("INSERT INTO item VALUES ('pending')")
+            with self.reader.cursor() as cursor:
+                cursor.execute('SELECT name FROM item')
+                self.assertEqual(cursor.fetchall(), [('committed',)])
+
+        with self.reader.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM item')
+            self.assertEqual(cursor.fetchone()[0], 2)
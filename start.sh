@@ -10,10 +10,29 @@ echo "Python version: $(python --version)"
 echo "Django version: $(python -m django --version)"
 echo "Working directory: $(pwd)"
 
-# Run migrations
+# Workers and the scheduler share this image; SERVICE_TYPE picks the process
+case "${SERVICE_TYPE:-web}" in
+    worker)
+        echo "⚙️  Starting Celery worker..."
+        # Queues listed first are always drained first (see CELERY_BROKER_TRANSPORT_OPTIONS)
+        exec celery -A clauseguard worker --loglevel=info \
+            --queues "${CELERY_QUEUES:-interactive,extraction,bulk,maintenance}" \
+            --pool "${CELERY_POOL:-prefork}" \
+            --concurrency "${CELERY_CONCURRENCY:-4}"
+        ;;
+    beat)
+        echo "⏰ Starting Celery beat..."
+        exec celery -A clauseguard beat --loglevel=info --schedule /tmp/celerybeat-schedule
+        ;;
+esac
+
+# Only the web service migrates, so containers starting together never race on the schema
 echo "📦 Running database migrations..."
 python manage.py migrate --noinput
 
+# Drop cached analyses made with an older prompt
+python manage.py invalidate_analysis_cache || true
+
 echo "📦 Collecting static files..."
 python manage.py collectstatic --noinput
 
@@ -25,6 +44,8 @@ echo "🌐 Starting Gunicorn server..."
 exec gunicorn clauseguard.wsgi:application \
     --bind 0.0.0.0:8000 \
     --workers 2 \
+    --worker-class gthread \
+    --threads 8 \
     --timeout 120 \
     --access-logfile - \
     --error-logfile -
\ No newline at end of file